@@ -1,36 +1,427 @@
 import json
+import os
+import sys
+import time
 
-import cw_metric_helper
+# Start of the module initialization, for the STARTUP_PROFILE report.
+_initStart = time.perf_counter()
+_initModules = len(sys.modules)
 
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
 
-def lambda_handler(event, context):
-    cwHelper = cw_metric_helper.CloudWatch(region="us-east-1")
-    result = cwHelper.list_metrics()
-    print(result)
+# Modules of the optional features (scan cache, cost estimates, stores,
+# incremental, coordinator, index and export modes) and the publishers are
+# imported where they are used: the module initialization only loads what
+# every scan needs, and multiprocessing, sqlite3 and pyarrow stay out of
+# the default scan.
+import cw_metric_helper  # noqa: E402
+import cw_metric_instrument  # noqa: E402
+
+
+METRIC_NAMESPACE = "testnamespace"
+METRIC_NAME = "testmetric"
+DEFAULT_REGION = "us-east-1"
+
+
+def get_store():
+    """
+    Return the store for state kept between runs.
+
+    Uses the S3 bucket named by INVENTORY_STORE_BUCKET if set, otherwise
+    the local directory INVENTORY_STORE_PATH (default: /tmp).
+    """
+    import cw_metric_store
+    bucket = os.environ.get("INVENTORY_STORE_BUCKET")
+    if bucket:
+        return cw_metric_store.S3Store(bucket=bucket,
+                                       prefix=os.environ.get("INVENTORY_STORE_PREFIX", "cw-metric-usage-monitor"))
+
+    return cw_metric_store.LocalFileStore(
+            os.environ.get("INVENTORY_STORE_PATH", "/tmp/cw-metric-usage-monitor"))
+
+
+_scanCache = None
+
+
+def get_cache():
+    """
+    Return the scan cache of the container, or None when SCAN_CACHE_TTL
+    (seconds) is not set.
+
+    The cache lives as long as the container, SCAN_CACHE_PATH adds a file
+    tier and SCAN_CACHE_SIZE bounds the number of results kept (default 64).
+    """
+    global _scanCache
+    ttl = float(os.environ.get("SCAN_CACHE_TTL", 0))
+    if ttl <= 0:
+        return None
+
+    if _scanCache is None:
+        import cw_metric_cache
+        _scanCache = cw_metric_cache.ScanCache(ttl=ttl,
+                                               max_entries=int(os.environ.get("SCAN_CACHE_SIZE", 64)),
+                                               path=os.environ.get("SCAN_CACHE_PATH"))
+    return _scanCache
+
+
+def scan(cwHelper, event, context=None):
+    """
+    Run the ListMetrics scan selected by the event and return its result.
+    """
+    if event.get("resumable") and context is not None:
+        # Stop before the function times out and continue on the next run.
+        result = cwHelper.list_metrics_resumable(
+                get_store(), context.get_remaining_time_in_millis,
+                checkpoint_key="checkpoint/%s/scan" % cwHelper.region,
+                sketches=event.get("sketches", False))
+        cw_metric_helper.log_record("ResumableScan", Region=cwHelper.region,
+                                    Complete=result["Complete"], PageCount=result["PageCount"])
+        return result
+
+    if event.get("incremental"):
+        # Only page recently active metrics, deltas against the stored snapshot.
+        import cw_metric_inventory
+        inventory = cw_metric_inventory.IncrementalInventory(
+                cwHelper, get_store(),
+                snapshot_key="inventory/%s/snapshot" % cwHelper.region)
+        result = inventory.update(full_scan=event.get("fullScan", False))
+        cw_metric_helper.log_record("IncrementalScan", Region=cwHelper.region,
+                                    FullScan=result["FullScan"], PageCount=result["PageCount"],
+                                    Added=len(result["Added"]), Removed=len(result["Removed"]))
+        return result
+
+    if event.get("index"):
+        # Load the scan into a SQLite index for ad-hoc inventory queries.
+        path = os.path.join(os.environ.get("INDEX_PATH", "/tmp/cw-metric-usage-monitor"),
+                            "index-%s.db" % cwHelper.region)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        import cw_metric_index
+        with cw_metric_index.MetricIndex.scan(cwHelper, path) as index:
+            result = {"Summary": index.summary(), "IndexPath": path}
+        cw_metric_helper.log_record("IndexScan", Region=cwHelper.region, Path=path)
+        return result
+
+    if event.get("export"):
+        # Stream the scan to a Parquet / Arrow file for offline analysis.
+        import cw_metric_export
+        exportFormat = event.get("exportFormat") or os.environ.get("EXPORT_FORMAT", "parquet")
+        path = "%s/metrics-%s-%d%s" % (
+                os.environ.get("EXPORT_PATH", "/tmp/cw-metric-usage-monitor/export").rstrip("/"),
+                cwHelper.region, int(time.time()), cw_metric_export.FORMATS.get(exportFormat, ""))
+        result = cw_metric_export.export_scan(cwHelper, path, format=exportFormat)
+        cw_metric_helper.log_record("ExportScan", Region=cwHelper.region, **result["Export"])
+        return result
+
+    if event.get("mode") == "coordinator":
+        # Hand account / namespace shards to worker processes or invocations.
+        import cw_metric_distributed
+        result = cw_metric_distributed.coordinate(
+                cwHelper, get_executor(event, context),
+                account_ids=get_account_ids(event),
+                namespaces=event.get("namespaces"),
+                sketches=event.get("sketches", False))
+        cw_metric_helper.log_record("CoordinatedScan", Region=cwHelper.region,
+                                    ShardCount=result["ShardCount"], PageCount=result["PageCount"])
+        return result
+
+    accountIds = get_account_ids(event)
+    if accountIds or event.get("namespaces"):
+        # Page independent account/namespace shards concurrently.
+        return cwHelper.list_metrics_sharded(
+                account_ids=accountIds,
+                namespaces=event.get("namespaces"),
+                sketches=event.get("sketches", False),
+                heavy_hitters=event.get("heavyHitters", 0),
+                cache=get_cache())
+
+    return cwHelper.list_metrics(include_metrics=False,
+                                 sketches=event.get("sketches", False),
+                                 heavy_hitters=event.get("heavyHitters", 0),
+                                 cache=get_cache())
+
+
+def get_executor(event, context=None):
+    """
+    Return the worker backend of a coordinated scan, selected by the event
+    "executor" key or the EXECUTOR environment variable: "lambda" (default)
+    invokes WORKER_FUNCTION_NAME, by default this function itself, and
+    "local" runs the workers in local processes.
+    """
+    import cw_metric_distributed
+    backend = event.get("executor") or os.environ.get("EXECUTOR", "lambda")
+    if backend == "local":
+        return cw_metric_distributed.LocalExecutor(max_workers=event.get("workers"))
+    if backend == "lambda":
+        functionName = os.environ.get("WORKER_FUNCTION_NAME") or \
+            getattr(context, "function_name", None)
+        if not functionName:
+            raise ValueError("The lambda executor needs WORKER_FUNCTION_NAME outside of Lambda")
+        return cw_metric_distributed.LambdaExecutor(functionName, max_workers=event.get("workers", 32))
+
+    raise ValueError("Unknown executor %s, expected lambda or local" % backend)
+
+
+def get_account_ids(event):
+    """
+    Return the accounts of a sharded or coordinated scan, from the event
+    "accountIds" key or the comma separated ACCOUNT_IDS environment
+    variable. None lets the coordinator discover the accounts linked to
+    the monitoring account.
+    """
+    accountIds = event.get("accountIds")
+    if not accountIds and os.environ.get("ACCOUNT_IDS"):
+        accountIds = [accountId.strip() for accountId in os.environ["ACCOUNT_IDS"].split(",")
+                      if accountId.strip()]
+
+    return accountIds or None
+
+
+def get_regions(event):
+    """
+    Return the regions to scan, from the event "regions" key or the
+    comma separated REGIONS environment variable, default us-east-1.
+    """
+    regions = event.get("regions")
+    if not regions and os.environ.get("REGIONS"):
+        regions = [region.strip() for region in os.environ["REGIONS"].split(",") if region.strip()]
+
+    return regions or [DEFAULT_REGION]
+
+
+def scan_regions(cwHelpers, event, context=None):
+    """
+    Scan every region concurrently, each with its own CloudWatch client.
+
+    A region that fails is logged and reported, the others still complete.
+
+    Args:
+        cwHelpers: Dictionary of region -> cw_metric_helper.CloudWatch
+        event: Lambda event selecting the scan mode
+        context: Lambda context, used by the resumable scan
+
+    Returns:
+        (region -> scan result, region -> error message of the failed regions)
+    """
+    def scanRegion(region):
+        try:
+            return region, scan(cwHelpers[region], event, context), None
+        except Exception as err:
+            cw_metric_helper.log_record("ScanFailed", Region=region, Error=str(err))
+            return region, None, "%s: %s" % (type(err).__name__, err)
+
+    with ThreadPoolExecutor(max_workers=len(cwHelpers)) as executor:
+        outcomes = list(executor.map(scanRegion, list(cwHelpers)))
+
+    results = {region: result for region, result, error in outcomes if error is None}
+    failures = {region: error for region, _, error in outcomes if error is not None}
+    return results, failures
+
+
+def get_publisher(cwHelper, event):
+    """
+    Return the publishing backend selected by the event "publisher" key or
+    the PUBLISHER environment variable: "api" (PutMetricData, default) or
+    "emf" (Embedded Metric Format log lines on stdout).
+    """
+    import cw_metric_publisher
+    backend = event.get("publisher") or os.environ.get("PUBLISHER", "api")
+    if backend == "emf":
+        return cw_metric_publisher.EmfPublisher()
+    if backend == "api":
+        return cw_metric_publisher.ApiPublisher(cwHelper)
+
+    raise ValueError("Unknown publisher %s, expected api or emf" % backend)
+
+
+def build_metric_data(result, detailed=False, region=None):
+    """
+    Build the MetricDatum list published for a scan result.
+
+    Always includes the per account total metric count. With detailed set
+    the per namespace counts, unique metric name counts and the series
+    counts of the heavy hitter metric names are added. With region set
+    every datapoint gets a region dimension.
+    """
+    estimates = {}
+    if "Sketches" in result:
+        estimates = result["Sketches"].estimates()
+
+    metricData = []
     for key in result["Summary"]:
         if key == "TotalMetricCount":
             continue
 
-        # push metrics.
-        print("Key: ", key)
-        totalMetricCount = result["Summary"][key]["TotalMetricCount"]
+        accountSummary = result["Summary"][key]
         dimensions = []
         dimensions.append({"Name": "accountId", "Value": key})
+        if region is not None:
+            dimensions.append({"Name": "region", "Value": region})
 
-        print("Dimension: %s, totalmetriccount: %s" % (dimensions, totalMetricCount))
+        metricData.append(cw_metric_helper.CloudWatch.build_metric_datum(
+                metric_name=METRIC_NAME,
+                value=accountSummary["TotalMetricCount"],
+                unit="Count",
+                dimensions=dimensions))
+        if not detailed:
+            continue
 
-        ret = cwHelper.put_metric_data(
-                namespace="testnamespace",
-                metric_name="testmetric",
-                value=totalMetricCount,
+        if "UniqueMetricNames" in accountSummary:
+            uniqueNames = len(accountSummary["UniqueMetricNames"])
+        else:
+            uniqueNames = estimates[key]["UniqueMetricNames"]
+        metricData.append(cw_metric_helper.CloudWatch.build_metric_datum(
+                metric_name="UniqueMetricNameCount",
+                value=uniqueNames,
                 unit="Count",
-                dimensions=dimensions)
+                dimensions=dimensions))
+
+        for namespace, count in accountSummary["MetricCountByNamespace"].items():
+            metricData.append(cw_metric_helper.CloudWatch.build_metric_datum(
+                    metric_name="MetricCountByNamespace",
+                    value=count,
+                    unit="Count",
+                    dimensions=dimensions + [{"Name": "namespace", "Value": namespace}]))
+
+    if detailed and "HeavyHitters" in result:
+        for entry in result["HeavyHitters"].report()["TopMetricNames"]:
+            dimensions = [{"Name": "namespace", "Value": entry["Namespace"]},
+                          {"Name": "metricName", "Value": entry["MetricName"]}]
+            if region is not None:
+                dimensions.append({"Name": "region", "Value": region})
+            metricData.append(cw_metric_helper.CloudWatch.build_metric_datum(
+                    metric_name="TopMetricNameSeriesCount",
+                    value=entry["SeriesCount"],
+                    unit="Count",
+                    dimensions=dimensions))
+
+    return metricData
+
+
+def prewarm_clients():
+    """
+    Create the CloudWatch clients of the configured regions.
+
+    Called while the container initializes, so the first invocation finds
+    the clients (see cw_metric_helper.get_client) ready.
+    """
+    for region in get_regions({}):
+        try:
+            cw_metric_helper.get_client(region)
+        except Exception as err:
+            # The handler creates the client again and reports the error.
+            cw_metric_helper.log_record("PrewarmFailed", Region=region, Error=str(err))
+
+
+_importSeconds = time.perf_counter() - _initStart
+_clientSeconds = 0.0
+if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") and os.environ.get("PREWARM_CLIENTS", "true") != "false":
+    _clientStart = time.perf_counter()
+    prewarm_clients()
+    _clientSeconds = time.perf_counter() - _clientStart
+_startup = {
+    "ImportSeconds": round(_importSeconds, 4),
+    "ClientInitSeconds": round(_clientSeconds, 4),
+    "InitSeconds": round(time.perf_counter() - _initStart, 4),
+    "ModulesLoaded": len(sys.modules) - _initModules
+}
+
+
+def lambda_handler(event, context):
+    event = event or {}
+    global _startup
+    if _startup is not None:
+        # First invocation of the container.
+        if os.environ.get("STARTUP_PROFILE", "false") == "true":
+            cw_metric_helper.log_record("Startup", **_startup)
+        _startup = None
+
+    if event.get("mode") == "worker":
+        # Invoked by a coordinator: scan one shard and return the partial.
+        import cw_metric_distributed
+        return cw_metric_distributed.scan_shard(event)
+
+    # Instrumentation of the run itself. On unless the event sets
+    # "instrumentation": false or INSTRUMENTATION is "false": its metrics
+    # are custom metrics too and add to the bill this function reports on.
+    if event.get("instrumentation", os.environ.get("INSTRUMENTATION", "true") != "false"):
+        instrumentation = cw_metric_instrument.Instrumentation()
+    else:
+        instrumentation = cw_metric_instrument.NullInstrumentation()
+
+    regions = get_regions(event)
+    cwHelpers = {region: cw_metric_helper.CloudWatch(region=region, instrumentation=instrumentation)
+                 for region in regions}
+    with instrumentation.phase("scan"):
+        results, failedRegions = scan_regions(cwHelpers, event, context)
+    # Partial passes of a resumable scan are only published once complete.
+    results = {region: result for region, result in results.items()
+               if result.get("Complete", True)}
+    for region, result in results.items():
+        cw_metric_helper.log_record("ScanSummary", Region=region,
+                                    **cw_metric_helper.summary_log_record(result["Summary"]))
+        if "Sketches" in result:
+            cw_metric_helper.log_record("CardinalityEstimates", Region=region,
+                                        Estimates=result["Sketches"].estimates())
+
+    # Everything is published from the first region. Datapoints only get a
+    # region dimension when regions are configured, so the single region
+    # default keeps publishing the same metrics.
+    publisher = get_publisher(cwHelpers[regions[0]], event)
+    # The EMF path costs no API calls, so it publishes the full breakdown.
+    import cw_metric_publisher
+    detailed = event.get("detailed", isinstance(publisher, cw_metric_publisher.EmfPublisher))
+    tagRegion = bool(event.get("regions") or os.environ.get("REGIONS"))
+    metricData = []
+    costs = {}
+    with instrumentation.phase("aggregate"):
+        for region, result in results.items():
+            metricData.extend(build_metric_data(result, detailed=detailed,
+                                                region=region if tagRegion else None))
+
+        if event.get("costs"):
+            import cw_metric_cost
+            priceTable = cw_metric_cost.load_price_table(os.environ.get("PRICE_TABLE_PATH"))
+            for region, result in results.items():
+                costs[region] = cw_metric_cost.estimate_costs(
+                        cw_metric_cost.counts_from_summary(result["Summary"]), priceTable)
+                cw_metric_helper.log_record("CostEstimate", Region=region,
+                                            TotalMonthlyCost=costs[region]["TotalMonthlyCost"],
+                                            Currency=costs[region]["Currency"])
+                metricData.extend(cw_metric_cost.build_metric_data(
+                        costs[region], detailed=detailed, region=region if tagRegion else None))
+
+    # push metrics.
+    with instrumentation.phase("publish"):
+        ret = publisher.publish(namespace=METRIC_NAMESPACE, metric_data=metricData)
+
+    cw_metric_helper.log_record("Publish", Status=ret["Status"], BatchCount=ret["BatchCount"],
+                                FailureCount=ret["FailureCount"],
+                                Errors=[{"BatchIndex": batch["BatchIndex"], "Error": batch["Error"]}
+                                        for batch in ret["Batches"] if batch["Status"] != "Success"])
+    for region, cwHelper in cwHelpers.items():
+        cw_metric_helper.log_record("RateLimiting", Region=region, **cwHelper.rate_limit_stats())
+
+    if instrumentation.enabled:
+        cw_metric_helper.log_record("Instrumentation", **instrumentation.report())
+        publisher.publish(namespace=METRIC_NAMESPACE, metric_data=instrumentation.metric_data())
+
+    body = {
+        "message": "hello cloudwatch monitor",
+    }
+    heavyHitters = {region: result["HeavyHitters"].report()
+                    for region, result in results.items() if "HeavyHitters" in result}
+    if heavyHitters:
+        body["heavyHitters"] = heavyHitters
+    if costs:
+        body["costs"] = costs
 
-        print("Ret: ", ret)
+    # 207 when only some regions were scanned and published, 500 when none.
+    statusCode = 200
+    if failedRegions:
+        body["FailedRegions"] = failedRegions
+        statusCode = 207 if results else 500
 
     return {
-        "statusCode": 200,
-        "body": json.dumps({
-            "message": "hello cloudwatch monitor",
-        }),
+        "statusCode": statusCode,
+        "body": json.dumps(body),
     }
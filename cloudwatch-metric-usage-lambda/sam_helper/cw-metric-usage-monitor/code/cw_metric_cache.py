@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+TTL cache of scan results.
+
+ScanCache keeps list_metrics results for a configurable time, keyed by
+caller identity (profile and ARN), region, ListMetrics filters (e.g. the
+owning account) and scan options.
+The memory tier is an LRU dictionary bounded by max_entries and holds the
+result objects themselves, so a hit in a warm Lambda container or a long
+running process costs a dictionary lookup. The optional file tier keeps
+serialized results in a local directory, so other processes on the host
+(or the next container reusing /tmp) can share them.
+
+Cached results are shared between callers and must be treated as read
+only.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Any
+
+import cw_metric_helper
+
+
+class ScanCache():
+    def __init__(self, ttl: float = 300, max_entries: int = 64,
+                 path: Optional[str] = None, clock=time.time):
+        """
+        Initialize the cache.
+
+        Args:
+            ttl: Seconds a result stays valid
+            max_entries: Results kept per tier, least recently used go first
+            path: Directory of the file tier (default: memory only)
+            clock: Wall clock function (for tests)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(identity: Any, region: str, filters: Dict[str, Any], options: Dict[str, Any]) -> str:
+        """
+        Return the cache key of a scan.
+
+        Args:
+            identity: Caller the scan runs as, e.g. the profile and role ARN
+                      (see cw_metric_helper.CloudWatch.identity)
+            region: AWS region
+            filters: ListMetrics filters, e.g. OwningAccount or Namespace
+            options: Scan options that change the result
+        """
+        return cw_metric_helper.encode([identity, region, filters, options]).decode("utf-8")
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached result of key, or None if missing or expired.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, result = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+
+        result = self._get_file(key, now)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._put_memory(key, result[0], result[1])
+
+        return result[1]
+
+    def _get_file(self, key: str, now: float):
+        if self.path is None:
+            return None
+
+        try:
+            with open(self._file(key), "rb") as cacheFile:
+                data = cw_metric_helper.decode(cacheFile.read())
+        except (OSError, ValueError):
+            return None
+        if data.get("Key") != key or data["Expires"] <= now:
+            return None
+
+        return data["Expires"], cw_metric_helper.result_from_dict(data["Result"])
+
+    def _put_memory(self, key: str, expires: float, result: Dict[str, Any]) -> None:
+        self._entries[key] = (expires, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """
+        Cache a result under key for ttl seconds.
+        """
+        expires = self.clock() + self.ttl
+        with self._lock:
+            self._put_memory(key, expires, result)
+
+        if self.path is not None:
+            self._put_file(key, expires, result)
+
+    def _put_file(self, key: str, expires: float, result: Dict[str, Any]) -> None:
+        payload = cw_metric_helper.encode({
+            "Key": key,
+            "Expires": expires,
+            "Result": cw_metric_helper.result_to_dict(result)
+        })
+        # Write to a temporary file and rename, so readers never see a partial file.
+        fd, tmpPath = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as cacheFile:
+            cacheFile.write(payload)
+        os.replace(tmpPath, self._file(key))
+
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path)
+                 if name.endswith(".json")]
+        if len(files) > self.max_entries:
+            files.sort(key=os.path.getmtime)
+            for filePath in files[:len(files) - self.max_entries]:
+                try:
+                    os.remove(filePath)
+                except OSError:
+                    pass
+
+    def clear(self) -> None:
+        """
+        Remove every entry of both tiers.
+        """
+        with self._lock:
+            self._entries.clear()
+        if self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.path, name))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"Hits": self.hits, "Misses": self.misses, "Entries": len(self._entries)}
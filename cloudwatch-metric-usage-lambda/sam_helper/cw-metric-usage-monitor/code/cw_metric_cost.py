@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Estimated monthly CloudWatch metric cost of the inventory.
+
+Metrics in AWS/ namespaces are vended by AWS services and not billed as
+custom metrics. Every other namespace is custom, billed per metric and
+month at tiered prices: the first 10,000 metrics of an account at one
+price, the next 240,000 at a lower one, and so on.
+
+The estimate works on metric counts per (account, namespace) rather than
+on the metrics themselves. The counts come from a scan summary, or from
+the columns of a MetricInventory in a single counting pass. Each distinct
+namespace is classified once, the tiered price is applied once per
+account, and the account cost is spread over its custom namespaces in
+proportion to their counts (the blended rate of the account).
+"""
+
+import json
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Any
+
+import cw_metric_helper
+
+
+VENDED_NAMESPACE_PREFIX = "AWS/"
+
+# Custom metric prices per metric and month (us-east-1). "UpTo" is the
+# cumulative metric count the tier ends at, None for the last tier.
+DEFAULT_PRICE_TABLE = {
+    "Currency": "USD",
+    "CustomMetricTiers": [
+        {"UpTo": 10000, "PricePerMetric": 0.30},
+        {"UpTo": 250000, "PricePerMetric": 0.10},
+        {"UpTo": 1000000, "PricePerMetric": 0.05},
+        {"UpTo": None, "PricePerMetric": 0.02}
+    ],
+    "VendedPricePerMetric": 0.0
+}
+
+
+def load_price_table(path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Return the price table from a local JSON file, default DEFAULT_PRICE_TABLE.
+
+    Keys missing from the file are taken from DEFAULT_PRICE_TABLE.
+    """
+    if path is None:
+        return DEFAULT_PRICE_TABLE
+
+    with open(path) as priceFile:
+        return dict(DEFAULT_PRICE_TABLE, **json.load(priceFile))
+
+
+def is_vended(namespace: str) -> bool:
+    """
+    Return True if the namespace holds AWS vended metrics.
+    """
+    return namespace.startswith(VENDED_NAMESPACE_PREFIX)
+
+
+def tiered_cost(count: int, tiers: List[Dict[str, Any]]) -> float:
+    """
+    Return the monthly cost of count custom metrics under tiered prices.
+    """
+    cost = 0.0
+    tierStart = 0
+    for tier in tiers:
+        tierEnd = tier["UpTo"]
+        if tierEnd is None or count <= tierEnd:
+            return cost + (count - tierStart) * tier["PricePerMetric"]
+        cost += (tierEnd - tierStart) * tier["PricePerMetric"]
+        tierStart = tierEnd
+
+    return cost
+
+
+def counts_from_summary(summary: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """
+    Return account id -> namespace -> metric count of a list_metrics summary.
+    """
+    return {accountId: dict(accountSummary["MetricCountByNamespace"])
+            for accountId, accountSummary in summary.items()
+            if accountId != "TotalMetricCount"}
+
+
+def counts_from_inventory(inventory) -> Dict[str, Dict[str, int]]:
+    """
+    Return account id -> namespace -> metric count of a MetricInventory.
+
+    The (account, namespace) id columns are counted in one pass, strings
+    are only looked up once per distinct pair.
+    """
+    counts = defaultdict(dict)
+    for (accountIdx, namespaceIdx), count in Counter(zip(inventory.accountCol,
+                                                         inventory.namespaceCol)).items():
+        counts[inventory.accounts[accountIdx]][inventory.namespaces[namespaceIdx]] = count
+
+    return dict(counts)
+
+
+def estimate_costs(counts: Dict[str, Dict[str, int]],
+                   price_table: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Estimate the monthly metric cost per account and namespace.
+
+    Tiers are applied to the custom metric count of each account.
+
+    Args:
+        counts: Account id -> namespace -> metric count
+        price_table: Price table (default: DEFAULT_PRICE_TABLE)
+
+    Returns:
+        Dictionary with the "Currency", the "TotalMonthlyCost" and per
+        account the custom/vended counts, "MonthlyCost" and "Namespaces"
+        breakdown
+    """
+    price_table = price_table or DEFAULT_PRICE_TABLE
+    vendedPrice = price_table.get("VendedPricePerMetric", 0.0)
+    namespaces = {namespace for accountCounts in counts.values() for namespace in accountCounts}
+    vended = {namespace: is_vended(namespace) for namespace in namespaces}
+
+    estimate = {
+        "Currency": price_table["Currency"],
+        "TotalMonthlyCost": 0.0,
+        "Accounts": {}
+    }
+    for accountId, accountCounts in counts.items():
+        customCount = sum(count for namespace, count in accountCounts.items() if not vended[namespace])
+        vendedCount = sum(accountCounts.values()) - customCount
+        customCost = tiered_cost(customCount, price_table["CustomMetricTiers"])
+        blendedRate = customCost / customCount if customCount else 0.0
+
+        namespaceCosts = {}
+        for namespace, count in accountCounts.items():
+            rate = vendedPrice if vended[namespace] else blendedRate
+            namespaceCosts[namespace] = {
+                "MetricCount": count,
+                "Vended": vended[namespace],
+                "MonthlyCost": round(count * rate, 2)
+            }
+
+        accountCost = customCost + vendedCount * vendedPrice
+        estimate["Accounts"][accountId] = {
+            "CustomMetricCount": customCount,
+            "VendedMetricCount": vendedCount,
+            "MonthlyCost": round(accountCost, 2),
+            "Namespaces": namespaceCosts
+        }
+        estimate["TotalMonthlyCost"] += accountCost
+
+    estimate["TotalMonthlyCost"] = round(estimate["TotalMonthlyCost"], 2)
+    return estimate
+
+
+def build_metric_data(estimate: Dict[str, Any], detailed: bool = False,
+                      region: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Build MetricDatum dictionaries of a cost estimate.
+
+    Publishes "EstimatedMonthlyCost" and "CustomMetricCount" per account and,
+    with detailed set, "EstimatedMonthlyCost" per custom namespace.
+    """
+    metricData = []
+    for accountId, accountEstimate in estimate["Accounts"].items():
+        dimensions = [{"Name": "accountId", "Value": accountId}]
+        if region is not None:
+            dimensions.append({"Name": "region", "Value": region})
+
+        metricData.append(cw_metric_helper.CloudWatch.build_metric_datum(
+                metric_name="EstimatedMonthlyCost",
+                value=accountEstimate["MonthlyCost"],
+                unit="None",
+                dimensions=dimensions))
+        metricData.append(cw_metric_helper.CloudWatch.build_metric_datum(
+                metric_name="CustomMetricCount",
+                value=accountEstimate["CustomMetricCount"],
+                unit="Count",
+                dimensions=dimensions))
+        if not detailed:
+            continue
+
+        for namespace, namespaceEstimate in accountEstimate["Namespaces"].items():
+            if namespaceEstimate["Vended"]:
+                continue
+            metricData.append(cw_metric_helper.CloudWatch.build_metric_datum(
+                    metric_name="EstimatedMonthlyCost",
+                    value=namespaceEstimate["MonthlyCost"],
+                    unit="None",
+                    dimensions=dimensions + [{"Name": "namespace", "Value": namespace}]))
+
+    return metricData
+
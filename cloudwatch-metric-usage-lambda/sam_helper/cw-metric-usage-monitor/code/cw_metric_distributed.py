@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Coordinator / worker scan across processes or Lambda invocations.
+
+The coordinator splits a ListMetrics scan into account (and namespace)
+shards and hands every shard to a worker through a ShardExecutor. A worker
+pages its shard and returns a partial: the summary and sketches in their
+JSON serializable dictionary form plus page and shard counts. Partials
+merge associatively (merge_partials), so they can be combined in any order
+or grouping, and the coordinator merges them into the usual scan result.
+
+Executors:
+    LocalExecutor: worker processes of a multiprocessing pool, for local
+                   runs and tests
+    LambdaExecutor: one synchronous invocation of the worker function per
+                    shard, with the function running in worker mode
+
+Every worker has its own rate limiter, so N workers together may send up
+to N times the configured ListMetrics rate. They all draw from the same
+account TPS quota of the region, so the scan time only shrinks with the
+number of workers until that quota is reached; past it the workers are
+throttled and their limiters back off. Size the worker count to the quota.
+
+The accounts to shard on are given by the caller or discovered from the
+CloudWatch cross-account observability (OAM) sinks and their attached
+links, which costs a few API calls instead of a pass over the metrics.
+"""
+
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Any
+
+import botocore.session
+from botocore.config import Config
+
+import cw_metric_helper
+import cw_metric_sketch
+
+
+PARTIAL_VERSION = 1
+
+
+def new_partial() -> Dict[str, Any]:
+    """
+    Return the empty partial, the identity of merge_partials.
+    """
+    return {
+        "Version": PARTIAL_VERSION,
+        "Summary": cw_metric_helper.summary_to_dict(cw_metric_helper.new_summary()),
+        "Sketches": None,
+        "PageCount": 0,
+        "ShardCount": 0
+    }
+
+
+def run_shard(cwHelper, request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Page one shard and return its partial.
+
+    Args:
+        cwHelper: cw_metric_helper.CloudWatch instance
+        request: Worker request with the "shard" ListMetrics filters and
+                 the "sketches" flag
+
+    Returns:
+        Partial dictionary (see new_partial)
+    """
+    sketches = request.get("sketches", False)
+    summary = cw_metric_helper.new_summary()
+    sketchSummary = cw_metric_sketch.SketchSummary() if sketches else None
+    pageCount = 0
+    for metrics, owningAccounts in cwHelper.iter_metric_pages(**request.get("shard", {})):
+        cw_metric_helper.add_page_to_summary(summary, metrics, owningAccounts,
+                                             unique_names=not sketches)
+        if sketches:
+            sketchSummary.add_page(metrics, owningAccounts)
+        pageCount += 1
+
+    return {
+        "Version": PARTIAL_VERSION,
+        "Summary": cw_metric_helper.summary_to_dict(summary),
+        "Sketches": sketchSummary.to_dict() if sketches else None,
+        "PageCount": pageCount,
+        "ShardCount": 1
+    }
+
+
+def scan_shard(request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Worker entry point: page the shard of a request in its region.
+    """
+    return run_shard(cw_metric_helper.CloudWatch(region=request["region"]), request)
+
+
+def merge_partials(partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge partials of disjoint shards into one partial.
+
+    The merge is associative and new_partial() is its identity, so
+    partials can be merged in any grouping, e.g. in a tree.
+    """
+    merged = new_partial()
+    summaries = [cw_metric_helper.summary_from_dict(merged["Summary"])]
+    sketchSummary = None
+    for partial in partials:
+        if partial.get("Version") != PARTIAL_VERSION:
+            raise ValueError("Unsupported partial version %s" % partial.get("Version"))
+
+        summaries.append(cw_metric_helper.summary_from_dict(partial["Summary"]))
+        merged["PageCount"] += partial["PageCount"]
+        merged["ShardCount"] += partial["ShardCount"]
+        if partial["Sketches"] is not None:
+            sketchSummary = sketchSummary or cw_metric_sketch.SketchSummary()
+            sketchSummary.merge(cw_metric_sketch.SketchSummary.from_dict(partial["Sketches"]))
+
+    merged["Summary"] = cw_metric_helper.summary_to_dict(cw_metric_helper.merge_summaries(summaries))
+    if sketchSummary is not None:
+        merged["Sketches"] = sketchSummary.to_dict()
+
+    return merged
+
+
+class ShardExecutor():
+    """
+    Interface of a worker backend.
+    """
+    def map(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run every worker request and return the partials in request order.
+
+        Raises:
+            The error of a failed worker
+        """
+        raise NotImplementedError
+
+
+class LocalExecutor(ShardExecutor):
+    def __init__(self, max_workers: Optional[int] = None, worker=scan_shard, mp_context=None):
+        """
+        Run workers in a multiprocessing pool.
+
+        Args:
+            max_workers: Number of worker processes (default: CPU count)
+            worker: Picklable function of a request returning its partial
+            mp_context: multiprocessing context (default: the platform default)
+        """
+        self.max_workers = max_workers
+        self.worker = worker
+        self.mp_context = mp_context
+
+    def map(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not requests:
+            return []
+
+        workers = min(self.max_workers or len(requests), len(requests))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=self.mp_context) as executor:
+            return list(executor.map(self.worker, requests))
+
+
+class LambdaExecutor(ShardExecutor):
+    def __init__(self, function_name: str, region: Optional[str] = None,
+                 client=None, max_workers: int = 32):
+        """
+        Run every worker as a synchronous Lambda invocation.
+
+        Args:
+            function_name: Name or ARN of the worker function, usually this
+                           function itself
+            region: Region of the function
+            client: Pre-built Lambda client
+            max_workers: Maximum number of concurrent invocations
+        """
+        self.function_name = function_name
+        self.max_workers = max_workers
+        if client is None:
+            # A worker may run for the whole Lambda timeout. Shards are read
+            # only, so invocations failing on throttling or service errors
+            # are retried; a function error is not.
+            config = Config(read_timeout=900, retries={"mode": "standard", "max_attempts": 3},
+                            max_pool_connections=max_workers)
+            client = botocore.session.Session().create_client("lambda", region_name=region,
+                                                              config=config)
+        self.client = client
+
+    def invoke(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        response = self.client.invoke(FunctionName=self.function_name,
+                                      InvocationType="RequestResponse",
+                                      Payload=json.dumps(dict(request, mode="worker")))
+        payload = json.loads(response["Payload"].read())
+        if response.get("FunctionError"):
+            raise RuntimeError("Worker for shard %s failed: %s" %
+                               (request.get("shard"), payload.get("errorMessage", payload)))
+
+        return payload
+
+    def map(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not requests:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(requests))) as executor:
+            return list(executor.map(self.invoke, requests))
+
+
+def discover_accounts(region: str, client=None) -> List[str]:
+    """
+    Return the monitoring account and the source accounts linked to it.
+
+    Lists the OAM sinks of the monitoring account in the region and the
+    links attached to each sink. The account ids are taken from the sink
+    and link ARNs.
+
+    Args:
+        region: Region of the monitoring account sinks
+        client: Pre-built OAM client
+
+    Raises:
+        ValueError: The region has no sink, the accounts have to be given
+    """
+    if client is None:
+        client = botocore.session.Session().create_client("oam", region_name=region)
+
+    accounts = set()
+    sinkKwargs = {}
+    while True:
+        sinks = client.list_sinks(**sinkKwargs)
+        for sink in sinks.get("Items", []):
+            accounts.add(sink["Arn"].split(":")[4])
+            linkKwargs = {"SinkIdentifier": sink["Arn"]}
+            while True:
+                links = client.list_attached_links(**linkKwargs)
+                accounts.update(link["LinkArn"].split(":")[4] for link in links.get("Items", []))
+                if not links.get("NextToken"):
+                    break
+                linkKwargs["NextToken"] = links["NextToken"]
+
+        if not sinks.get("NextToken"):
+            break
+        sinkKwargs["NextToken"] = sinks["NextToken"]
+
+    if not accounts:
+        raise ValueError("No OAM sink in %s, pass the account ids to scan" % region)
+
+    return sorted(accounts)
+
+
+def coordinate(cwHelper, executor: ShardExecutor,
+               account_ids: Optional[List[str]] = None,
+               namespaces: Optional[List[str]] = None,
+               sketches: bool = False, oam_client=None) -> Dict[str, Any]:
+    """
+    Scan a region through workers and merge their partials.
+
+    Args:
+        cwHelper: cw_metric_helper.CloudWatch instance of the region
+        executor: ShardExecutor running the workers
+        account_ids: Accounts to shard on (default: discover_accounts)
+        namespaces: Namespaces to shard on
+        sketches: Use cardinality sketches (see list_metrics)
+        oam_client: Pre-built OAM client of discover_accounts
+
+    Returns:
+        Dictionary with the merged "Summary", "ShardCount", "PageCount"
+        and, if requested, "Sketches"
+    """
+    if account_ids is None:
+        account_ids = discover_accounts(cwHelper.region, client=oam_client)
+
+    shards = cwHelper.build_shards(account_ids=account_ids, namespaces=namespaces)
+    requests = [{"region": cwHelper.region, "shard": shard, "sketches": sketches}
+                for shard in shards]
+    merged = merge_partials(executor.map(requests))
+
+    result = {
+        "Summary": cw_metric_helper.summary_from_dict(merged["Summary"]),
+        "ShardCount": merged["ShardCount"],
+        "PageCount": merged["PageCount"]
+    }
+    if sketches:
+        result["Sketches"] = cw_metric_sketch.SketchSummary.from_dict(merged["Sketches"]) \
+            if merged["Sketches"] is not None else cw_metric_sketch.SketchSummary()
+
+    return result
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Columnar export of ListMetrics scans.
+
+InventoryWriter streams a scan into a Parquet file or an Arrow IPC stream.
+Every ListMetrics page becomes a record batch as it arrives. An Arrow
+stream gets one record batch per page. For Parquet the batches are
+buffered and written as row groups of row_group_size rows (64k by
+default), as row groups of a single 500 row page would make large files
+slow to read; the export holds at most one row group of batches in
+memory. The account, namespace and metric name columns are dictionary
+encoded, and the dimensions of a metric are a list of (name, value)
+structs.
+
+Files are written through pyarrow.fs: a plain path is written to the
+local file system, a URI such as s3://bucket/prefix/file.parquet to the
+object store it names.
+
+pyarrow is an optional dependency. It is only needed to export, the rest
+of the monitor works without it. An export without pyarrow fails before
+the scan starts (see require_pyarrow).
+"""
+
+import os
+from typing import Dict, List, Optional, Any
+
+try:
+    import pyarrow
+    import pyarrow.fs
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import cw_metric_helper
+
+
+FORMATS = {
+    "parquet": ".parquet",
+    "arrow": ".arrows",
+}
+
+DEFAULT_ROW_GROUP_SIZE = 65536
+
+
+def require_pyarrow() -> None:
+    """
+    Raise ImportError with install instructions if pyarrow is missing.
+    """
+    if pyarrow is None:
+        raise ImportError("Exporting scans requires pyarrow, which is not part of the default "
+                          "requirements: add pyarrow to code/requirements.txt (or a Lambda "
+                          "layer) or pip install pyarrow")
+
+
+def inventory_schema():
+    """
+    Return the Arrow schema of an exported scan.
+    """
+    dictionary = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.schema([
+        ("region", dictionary),
+        ("account_id", dictionary),
+        ("namespace", dictionary),
+        ("metric_name", dictionary),
+        ("dimensions", pyarrow.list_(pyarrow.struct([("name", pyarrow.string()),
+                                                     ("value", pyarrow.string())])))
+    ])
+
+
+def open_output(path: str):
+    """
+    Open an output stream for a local path or a file system URI.
+    """
+    if "://" not in path:
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return pyarrow.fs.LocalFileSystem().open_output_stream(path)
+
+    filesystem, filePath = pyarrow.fs.FileSystem.from_uri(path)
+    return filesystem.open_output_stream(filePath)
+
+
+class InventoryWriter():
+    def __init__(self, path: str, format: str = "parquet", region: Optional[str] = None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        """
+        Open a streaming writer.
+
+        Args:
+            path: Local file path or URI (e.g. s3://bucket/key.parquet)
+            format: "parquet" or "arrow" (Arrow IPC stream)
+            region: Value of the region column
+            row_group_size: Rows per Parquet row group
+
+        Raises:
+            ImportError: pyarrow is not installed
+            ValueError: Unknown format
+        """
+        require_pyarrow()
+        if format not in FORMATS:
+            raise ValueError("Unknown export format %s, expected %s" %
+                             (format, " or ".join(FORMATS)))
+
+        self.path = path
+        self.format = format
+        self.region = region or ""
+        self.row_group_size = row_group_size
+        self.schema = inventory_schema()
+        self.batchCount = 0
+        self.rowCount = 0
+
+        # Parquet record batches not yet written as a row group.
+        self._batches = []
+        self._bufferedRows = 0
+
+        self._sink = open_output(path)
+        if format == "parquet":
+            self._writer = pyarrow.parquet.ParquetWriter(self._sink, self.schema)
+        else:
+            # The stream format allows every batch its own dictionaries.
+            self._writer = pyarrow.ipc.new_stream(self._sink, self.schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _batch(self, metrics: List[Dict[str, Any]], owningAccounts: List[str]):
+        return pyarrow.RecordBatch.from_arrays([
+            pyarrow.array([self.region] * len(metrics), pyarrow.string()).dictionary_encode(),
+            pyarrow.array(owningAccounts, pyarrow.string()).dictionary_encode(),
+            pyarrow.array([metric["Namespace"] for metric in metrics], pyarrow.string()).dictionary_encode(),
+            pyarrow.array([metric["MetricName"] for metric in metrics], pyarrow.string()).dictionary_encode(),
+            pyarrow.array([[{"name": dimension["Name"], "value": dimension["Value"]}
+                            for dimension in metric.get("Dimensions", [])]
+                           for metric in metrics], self.schema.field("dimensions").type)
+        ], schema=self.schema)
+
+    def write_page(self, metrics: List[Dict[str, Any]], owningAccounts: List[str]) -> None:
+        """
+        Write the metrics of one ListMetrics page.
+
+        The page is converted to a record batch right away. An Arrow stream
+        gets the batch, Parquet batches are written once a row group is full.
+        """
+        if not metrics:
+            return
+
+        batch = self._batch(metrics, owningAccounts)
+        self.rowCount += batch.num_rows
+        if self.format != "parquet":
+            self._writer.write_batch(batch)
+            self.batchCount += 1
+            return
+
+        self._batches.append(batch)
+        self._bufferedRows += batch.num_rows
+        if self._bufferedRows >= self.row_group_size:
+            self._write_row_groups(final=False)
+
+    def _write_row_groups(self, final: bool) -> None:
+        """
+        Write the buffered batches as full row groups, and the rest if final.
+        """
+        table = pyarrow.Table.from_batches(self._batches, schema=self.schema)
+        rows = table.num_rows if final else table.num_rows - table.num_rows % self.row_group_size
+        if rows:
+            self._writer.write_table(table.slice(0, rows), row_group_size=self.row_group_size)
+            self.batchCount += -(-rows // self.row_group_size)
+
+        # Slices share the buffers of the batches, the rest is not copied.
+        self._batches = table.slice(rows).to_batches()
+        self._bufferedRows = table.num_rows - rows
+
+    def close(self) -> None:
+        if self._writer is not None:
+            if self._bufferedRows:
+                self._write_row_groups(final=True)
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+
+
+def export_scan(cwHelper, path: str, format: str = "parquet",
+                row_group_size: int = DEFAULT_ROW_GROUP_SIZE, **filters) -> Dict[str, Any]:
+    """
+    Export a ListMetrics scan page by page and summarize it on the way.
+
+    Args:
+        cwHelper: cw_metric_helper.CloudWatch instance
+        path: Local file path or URI of the export
+        format: "parquet" or "arrow"
+        row_group_size: Rows per Parquet row group
+        filters: Extra ListMetrics parameters
+
+    Returns:
+        Dictionary with the "Summary" and the "Export" path, format, batch
+        (Arrow record batch or Parquet row group) and row counts
+    """
+    require_pyarrow()
+    summary = cw_metric_helper.new_summary()
+    with InventoryWriter(path, format=format, region=cwHelper.region,
+                         row_group_size=row_group_size) as writer:
+        for metrics, owningAccounts in cwHelper.iter_metric_pages(**filters):
+            writer.write_page(metrics, owningAccounts)
+            cw_metric_helper.add_page_to_summary(summary, metrics, owningAccounts)
+
+    return {
+        "Summary": summary,
+        "Export": {
+            "Path": path,
+            "Format": format,
+            "BatchCount": writer.batchCount,
+            "RowCount": writer.rowCount
+        }
+    }
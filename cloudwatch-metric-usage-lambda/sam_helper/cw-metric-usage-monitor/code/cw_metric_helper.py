@@ -1,68 +1,736 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import boto3
+import json
+import threading
+import time
+import botocore.session
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Any
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+import cw_metric_instrument
+import cw_metric_ratelimit
+import cw_metric_sketch
+
+
+# PutMetricData accepts at most 1000 MetricDatum entries and a 1 MB
+# request payload per call. Keep some headroom under the payload limit
+# for the request envelope.
+MAX_METRIC_DATA_PER_CALL = 1000
+MAX_METRIC_DATA_BYTES = 900 * 1024
+
+# Connections per client. Sharded scans, regions and batched publishing
+# share one client per region from many threads (botocore default: 10).
+MAX_POOL_CONNECTIONS = 32
+
+# Serialization formats of summaries and scan results. msgpack is optional.
+SERIALIZATION_FORMATS = ("json", "msgpack")
+
+
+def new_summary() -> Dict[str, Any]:
+    """
+    Return an empty metric usage summary.
+    """
+    return {
+        "TotalMetricCount": 0
+    }
+
+
+def add_page_to_summary(summary: Dict[str, Any],
+                        metrics: List[Dict[str, Any]],
+                        owningAccounts: List[str],
+                        unique_names: bool = True) -> Dict[str, Any]:
+    """
+    Fold one ListMetrics page into the per-account summary counters.
+
+    Args:
+        summary: Summary to update (see new_summary)
+        metrics: "Metrics" list of a ListMetrics response
+        owningAccounts: "OwningAccounts" list of the same response
+        unique_names: Keep the exact "UniqueMetricNames" set per account
+
+    Returns:
+        The updated summary
+    """
+    for metric, accountId in zip(metrics, owningAccounts):
+        if summary.get(accountId, None) is None:
+            summary[accountId] = {}
+            summary[accountId]["TotalMetricCount"] = 0
+            summary[accountId]["MetricCountByNamespace"] = defaultdict(int)
+            if unique_names:
+                summary[accountId]["UniqueMetricNames"] = set()
+
+        summary["TotalMetricCount"] += 1
+        summary[accountId]["TotalMetricCount"] += 1
+        if unique_names:
+            summary[accountId]["UniqueMetricNames"].add(metric["MetricName"])
+        summary[accountId]["MetricCountByNamespace"][metric["Namespace"]] += 1
+
+    return summary
+
+
+def merge_summaries(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge partial summaries into one summary of the same shape.
+
+    The partials must cover disjoint sets of metrics (e.g. one per shard),
+    otherwise the counts are double counted. The inputs are not modified.
+
+    Args:
+        summaries: List of summaries (see new_summary)
+
+    Returns:
+        The merged summary
+    """
+    merged = new_summary()
+    for summary in summaries:
+        for key, value in summary.items():
+            if key == "TotalMetricCount":
+                merged["TotalMetricCount"] += value
+                continue
+
+            if merged.get(key, None) is None:
+                merged[key] = {}
+                merged[key]["TotalMetricCount"] = 0
+                merged[key]["MetricCountByNamespace"] = defaultdict(int)
+
+            merged[key]["TotalMetricCount"] += value["TotalMetricCount"]
+            if "UniqueMetricNames" in value:
+                merged[key].setdefault("UniqueMetricNames", set()).update(value["UniqueMetricNames"])
+            for namespace, count in value["MetricCountByNamespace"].items():
+                merged[key]["MetricCountByNamespace"][namespace] += count
+
+    return merged
+
+
+def summary_to_dict(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return a JSON serializable copy of a summary.
+
+    The "UniqueMetricNames" sets become sorted lists and the namespace
+    counters plain dictionaries. summary_from_dict reverses it.
+    """
+    data = {}
+    for key, value in summary.items():
+        if key == "TotalMetricCount":
+            data[key] = value
+            continue
+
+        data[key] = {
+            "TotalMetricCount": value["TotalMetricCount"],
+            "MetricCountByNamespace": dict(value["MetricCountByNamespace"])
+        }
+        if "UniqueMetricNames" in value:
+            data[key]["UniqueMetricNames"] = sorted(value["UniqueMetricNames"])
+
+    return data
+
+
+def summary_from_dict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rebuild a summary from the output of summary_to_dict.
+    """
+    summary = new_summary()
+    for key, value in data.items():
+        if key == "TotalMetricCount":
+            summary[key] = value
+            continue
+
+        summary[key] = {
+            "TotalMetricCount": value["TotalMetricCount"],
+            "MetricCountByNamespace": defaultdict(int, value["MetricCountByNamespace"])
+        }
+        if "UniqueMetricNames" in value:
+            summary[key]["UniqueMetricNames"] = set(value["UniqueMetricNames"])
+
+    return summary
+
+
+def encode(data: Any, format: str = "json") -> bytes:
+    """
+    Encode JSON serializable data.
+
+    "json" is canonical: sorted keys, no whitespace, UTF-8. Equal data
+    always encodes to the same bytes, so the output can be hashed or used
+    as a cache key. "msgpack" is a smaller, faster binary form.
+
+    Raises:
+        ImportError: msgpack is requested but not installed
+        ValueError: Unknown format
+    """
+    if format == "json":
+        return json.dumps(data, sort_keys=True, separators=(",", ":"),
+                          ensure_ascii=False).encode("utf-8")
+    if format == "msgpack":
+        if msgpack is None:
+            raise ImportError("The msgpack format requires msgpack, pip install msgpack")
+        return msgpack.packb(data, use_bin_type=True)
+
+    raise ValueError("Unknown format %s, expected %s" % (format, " or ".join(SERIALIZATION_FORMATS)))
+
+
+def decode(payload: bytes, format: str = "json") -> Any:
+    """
+    Decode the output of encode.
+    """
+    if format == "json":
+        return json.loads(payload)
+    if format == "msgpack":
+        if msgpack is None:
+            raise ImportError("The msgpack format requires msgpack, pip install msgpack")
+        return msgpack.unpackb(payload, raw=False)
+
+    raise ValueError("Unknown format %s, expected %s" % (format, " or ".join(SERIALIZATION_FORMATS)))
+
+
+def serialize_summary(summary: Dict[str, Any], format: str = "json") -> bytes:
+    """
+    Return a summary (see new_summary) as bytes of the given format.
+    """
+    return encode(summary_to_dict(summary), format)
+
+
+def deserialize_summary(payload: bytes, format: str = "json") -> Dict[str, Any]:
+    """
+    Rebuild a summary from the output of serialize_summary.
+    """
+    return summary_from_dict(decode(payload, format))
+
+
+def result_to_dict(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return a JSON serializable copy of a list_metrics style result.
+
+    The "Summary", "Sketches" and "HeavyHitters" are converted to their
+    dictionary forms, the other keys (e.g. "Metrics") are kept as they are.
+    """
+    data = dict(result)
+    data["Summary"] = summary_to_dict(result["Summary"])
+    for key in ("Sketches", "HeavyHitters"):
+        if key in result:
+            data[key] = result[key].to_dict()
+
+    return data
+
+
+def result_from_dict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rebuild a result from the output of result_to_dict.
+    """
+    result = dict(data)
+    result["Summary"] = summary_from_dict(data["Summary"])
+    if "Sketches" in data:
+        result["Sketches"] = cw_metric_sketch.SketchSummary.from_dict(data["Sketches"])
+    if "HeavyHitters" in data:
+        result["HeavyHitters"] = cw_metric_sketch.HeavyHitters.from_dict(data["HeavyHitters"])
+
+    return result
+
+
+def serialize_result(result: Dict[str, Any], format: str = "json") -> bytes:
+    """
+    Return a list_metrics style result as bytes of the given format.
+    """
+    return encode(result_to_dict(result), format)
+
+
+def deserialize_result(payload: bytes, format: str = "json") -> Dict[str, Any]:
+    """
+    Rebuild a result from the output of serialize_result.
+    """
+    return result_from_dict(decode(payload, format))
+
+
+def summary_log_record(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return the compact figures of a summary for logging.
+
+    Unlike the summary itself, the record does not grow with the number
+    of metric names.
+    """
+    accounts = {key: value for key, value in summary.items() if key != "TotalMetricCount"}
+    return {
+        "TotalMetricCount": summary["TotalMetricCount"],
+        "AccountCount": len(accounts),
+        "NamespaceCount": len({namespace for value in accounts.values()
+                               for namespace in value["MetricCountByNamespace"]}),
+        "MetricCountByAccount": {accountId: value["TotalMetricCount"]
+                                 for accountId, value in accounts.items()}
+    }
+
+
+def log_record(event: str, **fields) -> None:
+    """
+    Write a structured log record as one canonical JSON line.
+    """
+    print(encode(dict(fields, Event=event)).decode("utf-8"))
+
+
+_sessions = {}
+_clients = {}
+_identities = {}
+_clientsLock = threading.Lock()
+
+
+def _get_session(profileName: Optional[str]):
+    # Callers hold _clientsLock.
+    if profileName not in _sessions:
+        _sessions[profileName] = botocore.session.Session(profile=profileName)
+    return _sessions[profileName]
+
+
+def get_client(region: str, profileName: Optional[str] = None):
+    """
+    Return the CloudWatch client of a region, created once per process.
+
+    A warm Lambda container reuses the client, with its credentials and
+    open connections, across invocations. Clients are thread safe, so every
+    helper and thread of the region shares it.
+
+    The client is built on a botocore session: importing boto3 also loads
+    s3transfer, which roughly doubles the import time and is not needed.
+    """
+    key = (profileName, region)
+    with _clientsLock:
+        if key not in _clients:
+            session = _get_session(profileName)
+            # Throttling and transient failures are retried by the rate
+            # limiters, which back off for all threads at once, rather than
+            # blindly by each call (see cw_metric_ratelimit). Short
+            # timeouts fail a stuck connection well before the function
+            # times out.
+            config = Config(retries={"mode": "standard", "total_max_attempts": 1},
+                            connect_timeout=5,
+                            read_timeout=30,
+                            tcp_keepalive=True,
+                            max_pool_connections=MAX_POOL_CONNECTIONS)
+            _clients[key] = session.create_client("cloudwatch", region_name=region, config=config)
+
+        return _clients[key]
+
+
+def get_caller_identity(region: str, profileName: Optional[str] = None) -> str:
+    """
+    Return the ARN of the credentials of a profile, looked up once per process.
+
+    Profiles of different accounts or roles see different metrics, so the
+    ARN is part of every scan cache key (see cw_metric_cache).
+    """
+    with _clientsLock:
+        if profileName not in _identities:
+            config = Config(connect_timeout=5, read_timeout=10)
+            client = _get_session(profileName).create_client("sts", region_name=region, config=config)
+            _identities[profileName] = client.get_caller_identity()["Arn"]
+
+        return _identities[profileName]
+
 
 class CloudWatch():
-    def __init__(self, profileName=None, region="us-east-1"):
+    def __init__(self, profileName=None, region="us-east-1", client=None, limiters=None,
+                 instrumentation=None, identity=None):
         """
         Initialize CloudWatch Helper class.
+
+        Args:
+            profileName: AWS profile to use (default: environment credentials)
+            region: AWS region
+            client: Pre-built CloudWatch client. Used as is when given,
+                    for example to pass a stand-in in tests. Defaults to
+                    the client of the region shared by the process (see
+                    get_client).
+            limiters: Operation name -> cw_metric_ratelimit.AdaptiveRateLimiter.
+                      Defaults to the limiters shared by the region. Operations
+                      without a limiter (e.g. limiters={}) are not rate limited.
+            instrumentation: cw_metric_instrument.Instrumentation recording API
+                             latency, retries and page counts (default: off)
+            identity: ARN of the caller, part of the scan cache keys.
+                      Defaults to the ARN of the profile credentials, looked
+                      up on the first cached scan (see get_caller_identity).
         """
+        self.profileName = profileName
+        self.region = region
+        self._identity = identity
+        self.instrumentation = instrumentation or cw_metric_instrument.NullInstrumentation()
+        if limiters is None:
+            limiters = cw_metric_ratelimit.get_limiters(region)
+        self.limiters = limiters
 
-        if profileName is not None:
-            session = boto3.Session(profile_name=profileName, region_name=region)
-        else:
-            session = boto3.Session(region_name=region)
+        if client is None:
+            client = get_client(region, profileName=profileName)
+        self.client = client
+
+    def identity(self) -> Dict[str, Optional[str]]:
+        """
+        Return the profile name and caller ARN the helper lists metrics as.
+        """
+        if self._identity is None:
+            self._identity = get_caller_identity(self.region, profileName=self.profileName)
+        return {"Profile": self.profileName, "Arn": self._identity}
+
+    def _call(self, operation: str, **kwargs):
+        """
+        Call a CloudWatch client operation through its rate limiter.
+        """
+        fn = getattr(self.client, operation)
+        limiter = self.limiters.get(operation)
+        instrumentation = self.instrumentation
+        if not instrumentation.enabled:
+            if limiter is None:
+                return fn(**kwargs)
+            return limiter.call(fn, **kwargs)
+
+        attempts = [0]
+
+        def attempt(**kwargs):
+            attempts[0] += 1
+            start = time.perf_counter()
+            try:
+                response = fn(**kwargs)
+            except Exception:
+                instrumentation.record_attempt(operation, time.perf_counter() - start, error=True)
+                raise
+            instrumentation.record_attempt(operation, time.perf_counter() - start)
+            return response
+
+        try:
+            if limiter is None:
+                return attempt(**kwargs)
+            return limiter.call(attempt, **kwargs)
+        finally:
+            instrumentation.record_call(operation, attempts[0])
 
-        self.client = session.client("cloudwatch")
+    def rate_limit_stats(self) -> Dict[str, Any]:
+        """
+        Return the throttle, retry and wait counters per operation.
+        """
+        return {operation: limiter.stats() for operation, limiter in self.limiters.items()}
+
+    def iter_metric_pages(self, next_token: Optional[str] = None, on_page=None, **filters):
+        """
+        Page through ListMetrics across all linked accounts.
+
+        Only one page is held at a time, so callers can fold the pages
+        into counters without retaining the whole inventory.
+
+        Args:
+            next_token: NextToken to resume a previous pass from
+            on_page: Called with the NextToken of the following page (None
+                     after the last page) once the caller has processed a
+                     page, before the next one is requested. Paging stops
+                     if it returns False.
+            filters: Extra ListMetrics parameters (e.g. Namespace, OwningAccount).
+                     "ExcludeNamespaces" (see build_shards) drops the metrics
+                     of those namespaces from the pages.
 
-    def list_metrics(self):
+        Yields:
+            (metrics, owningAccounts) tuple per page
+        """
         kwargs = {
             "IncludeLinkedAccounts": True
         }
-        result = {
-            "Metrics": [],
-            "Summary": {
-                "TotalMetricCount": 0
-            }
-        }
+        kwargs.update(filters)
+        excluded = set(kwargs.pop("ExcludeNamespaces", ()))
 
         done = False
-        nextToken = None
+        nextToken = next_token
         while not done:
             if nextToken is None:
-                data = self.client.list_metrics(**kwargs)
+                data = self._call("list_metrics", **kwargs)
+            else:
+                data = self._call("list_metrics", **kwargs, NextToken=nextToken)
+
+            self.instrumentation.count("ListMetricsPages")
+            self.instrumentation.count("MetricsListed", len(data["Metrics"]))
+            if excluded:
+                kept = [(metric, accountId) for metric, accountId in zip(data["Metrics"], data["OwningAccounts"])
+                        if metric["Namespace"] not in excluded]
+                yield [metric for metric, _ in kept], [accountId for _, accountId in kept]
             else:
-                data = self.client.list_metrics(**kwargs, NextToken=nextToken)
-
-            # mesh account id into metric
-            idx = 0
-            owningAccounts = data["OwningAccounts"]
-            for metric in data["Metrics"]:
-                accountId = owningAccounts[idx]
-                metric["aws.accountId"] = accountId
-                idx += 1
-                if result["Summary"].get(accountId, None) is None:
-                    result["Summary"][accountId] = {}
-                    result["Summary"][accountId]["TotalMetricCount"] = 0
-                    result["Summary"][accountId]["MetricCountByNamespace"] = defaultdict(int)
-                    result["Summary"][accountId]["UniqueMetricNames"] = set()
-
-                result["Summary"]["TotalMetricCount"] += 1
-                result["Summary"][accountId]["TotalMetricCount"] += 1
-                result['Summary'][accountId]['UniqueMetricNames'].add(metric['MetricName'])
-                result["Summary"][accountId]["MetricCountByNamespace"][metric["Namespace"]] += 1
-
-                result["Metrics"].append(metric)
+                yield data["Metrics"], data["OwningAccounts"]
 
             if "NextToken" in data.keys():
                 nextToken = data["NextToken"]
             else:
+                nextToken = None
+                done = True
+            if on_page is not None and on_page(nextToken) is False:
                 done = True
 
+    def list_metrics(self, include_metrics=True, sketches=False, heavy_hitters=0,
+                     cache=None, **filters):
+        """
+        List metrics across all linked accounts and summarize them per account.
+
+        Args:
+            include_metrics: Keep every metric (tagged with "aws.accountId") in
+                             result["Metrics"]. When False only the summary is
+                             built and memory use does not grow with the
+                             number of metrics.
+            sketches: Estimate unique metric names, dimension sets and
+                      dimension values with HyperLogLog sketches, returned in
+                      result["Sketches"], instead of keeping the exact
+                      "UniqueMetricNames" sets in the summary.
+            heavy_hitters: When set, build a fixed memory report of the top
+                           heavy_hitters metric names, dimension keys and
+                           namespaces per account, returned in
+                           result["HeavyHitters"] (cw_metric_sketch.HeavyHitters)
+            cache: cw_metric_cache.ScanCache. A result cached for the same
+                   identity, region, filters and options is returned without paging
+                   ListMetrics, otherwise the new result is cached.
+            filters: Extra ListMetrics parameters (e.g. Namespace, OwningAccount)
+
+        Returns:
+            Dictionary with the "Summary" and, if requested, the "Metrics" list,
+            the "Sketches" (cw_metric_sketch.SketchSummary) and "HeavyHitters"
+        """
+        if cache is not None:
+            key = cache.key(self.identity(), self.region, filters,
+                            {"IncludeMetrics": include_metrics,
+                             "Sketches": sketches,
+                             "HeavyHitters": heavy_hitters})
+            result = cache.get(key)
+            if result is None:
+                result = self.list_metrics(include_metrics=include_metrics, sketches=sketches,
+                                           heavy_hitters=heavy_hitters, **filters)
+                cache.put(key, result)
+            return result
+
+        result = {
+            "Summary": new_summary()
+        }
+        if include_metrics:
+            result["Metrics"] = []
+        if sketches:
+            result["Sketches"] = cw_metric_sketch.SketchSummary()
+        if heavy_hitters:
+            result["HeavyHitters"] = cw_metric_sketch.HeavyHitters(top=heavy_hitters)
+
+        for metrics, owningAccounts in self.iter_metric_pages(**filters):
+            add_page_to_summary(result["Summary"], metrics, owningAccounts,
+                                unique_names=not sketches)
+            if sketches:
+                result["Sketches"].add_page(metrics, owningAccounts)
+            if heavy_hitters:
+                result["HeavyHitters"].add_page(metrics, owningAccounts)
+
+            if include_metrics:
+                # mesh account id into metric
+                for metric, accountId in zip(metrics, owningAccounts):
+                    metric["aws.accountId"] = accountId
+                    result["Metrics"].append(metric)
+
+        return result
+
+    def list_metrics_resumable(self, store, remaining_ms,
+                               checkpoint_key: str = "checkpoint/scan",
+                               safety_margin_ms: int = 5000,
+                               checkpoint_every: int = 50,
+                               sketches: bool = False,
+                               **filters) -> Dict[str, Any]:
+        """
+        Summarize metrics within a time budget, resuming across invocations.
+
+        Pages are folded into the summary until the remaining time drops
+        below the safety margin plus the slowest page seen so far. The
+        NextToken and the partial summary are then saved to the store and
+        the next call picks up from there. The checkpoint is also saved every
+        checkpoint_every pages, so a killed invocation loses little work.
+        Once the last page is read the checkpoint is removed.
+
+        Args:
+            store: cw_metric_store.MetricStore holding the checkpoint
+            remaining_ms: Function returning the milliseconds left, e.g.
+                          the Lambda context get_remaining_time_in_millis
+            checkpoint_key: Store key of the checkpoint
+            safety_margin_ms: Time kept free for publishing and saving
+            checkpoint_every: Pages between periodic checkpoints
+            sketches: Use cardinality sketches (see list_metrics)
+            filters: Extra ListMetrics parameters
+
+        Returns:
+            Dictionary with "Complete" (True once a full pass is done), the
+            "Summary" (partial while not complete), "Sketches" if requested,
+            and the "PageCount" of the pass so far
+        """
+        # A checkpoint of other filters or another summary mode cannot be
+        # resumed: a sketch summary has no unique metric name sets.
+        checkpoint = store.get(checkpoint_key)
+        if checkpoint is not None and (checkpoint.get("Filters") != filters or
+                                       checkpoint.get("SketchMode") != sketches):
+            checkpoint = None
+
+        if checkpoint is not None:
+            summary = summary_from_dict(checkpoint["Summary"])
+            sketchSummary = None
+            if sketches and checkpoint.get("Sketches") is not None:
+                sketchSummary = cw_metric_sketch.SketchSummary.from_dict(checkpoint["Sketches"])
+            nextToken = checkpoint["NextToken"]
+            pageCount = checkpoint["PageCount"]
+        else:
+            summary = new_summary()
+            sketchSummary = None
+            nextToken = None
+            pageCount = 0
+        if sketches and sketchSummary is None:
+            sketchSummary = cw_metric_sketch.SketchSummary()
+
+        def save():
+            checkpoint = {
+                "Filters": filters,
+                "SketchMode": sketches,
+                "NextToken": nextToken,
+                "PageCount": pageCount,
+                "Summary": summary_to_dict(summary),
+                "Sketches": sketchSummary.to_dict() if sketches else None
+            }
+            store.put(checkpoint_key, checkpoint)
+
+        def result(complete):
+            ret = {
+                "Complete": complete,
+                "Summary": summary,
+                "PageCount": pageCount
+            }
+            if sketches:
+                ret["Sketches"] = sketchSummary
+            return ret
+
+        # Every call reads at least one page, so the scan always progresses.
+        slowestPageMs = 0
+        requested = time.monotonic()
+        stopped = False
+
+        def onPage(token):
+            nonlocal nextToken, pageCount, requested, stopped
+            nextToken = token
+            pageCount += 1
+            if token is None:
+                return True
+            if remaining_ms() < safety_margin_ms + slowestPageMs:
+                save()
+                stopped = True
+                return False
+            if pageCount % checkpoint_every == 0:
+                save()
+            requested = time.monotonic()
+            return True
+
+        while True:
+            try:
+                for metrics, owningAccounts in self.iter_metric_pages(next_token=nextToken,
+                                                                      on_page=onPage, **filters):
+                    slowestPageMs = max(slowestPageMs, (time.monotonic() - requested) * 1000)
+                    add_page_to_summary(summary, metrics, owningAccounts, unique_names=not sketches)
+                    if sketches:
+                        sketchSummary.add_page(metrics, owningAccounts)
+                break
+            except ClientError as err:
+                if nextToken is None or err.response.get("Error", {}).get("Code") != "InvalidNextToken":
+                    raise
+                # The saved token expired, start the pass over.
+                summary = new_summary()
+                sketchSummary = cw_metric_sketch.SketchSummary() if sketches else None
+                nextToken = None
+                pageCount = 0
+                store.delete(checkpoint_key)
+                requested = time.monotonic()
+
+        if stopped:
+            return result(False)
+
+        store.delete(checkpoint_key)
+        return result(True)
+
+    @staticmethod
+    def build_shards(account_ids: Optional[List[str]] = None,
+                     namespaces: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """
+        Split a ListMetrics scan into independent partitions.
+
+        Each shard is a dict of ListMetrics filters: one per account, per
+        namespace, or per account and namespace pair. Without accounts or
+        namespaces there is a single shard covering everything.
+
+        ListMetrics cannot filter on the namespaces not listed, so sharding
+        by namespace adds a catch-all shard (per account, if given) that
+        pages without a namespace filter and drops the listed namespaces
+        ("ExcludeNamespaces", see iter_metric_pages). The shards together
+        always cover every metric, at the cost of paging the listed
+        namespaces twice.
+
+        Args:
+            account_ids: Owning account ids to shard on
+            namespaces: Namespaces to shard on
+
+        Returns:
+            List of shard filter dictionaries
+        """
+        accountFilters = [{"OwningAccount": accountId} for accountId in account_ids or []]
+        namespaceFilters = [{"Namespace": namespace} for namespace in namespaces or []]
+
+        if not namespaceFilters:
+            return accountFilters or [{}]
+
+        return [dict(accountFilter, **namespaceFilter)
+                for accountFilter in accountFilters or [{}]
+                for namespaceFilter in namespaceFilters + [{"ExcludeNamespaces": list(namespaces)}]]
+
+    def list_metrics_sharded(self, account_ids: Optional[List[str]] = None,
+                             namespaces: Optional[List[str]] = None,
+                             max_workers: int = 8,
+                             sketches: bool = False,
+                             heavy_hitters: int = 0,
+                             cache=None) -> Dict[str, Any]:
+        """
+        Summarize metrics by paging independent shards concurrently.
+
+        The scan is split with build_shards and every shard is paged on a
+        bounded thread pool. The partial summaries are merged into the same
+        "Summary" shape list_metrics returns. Metrics are not retained.
+
+        Args:
+            account_ids: Owning account ids to shard on
+            namespaces: Namespaces to shard on
+            max_workers: Maximum number of shards paged at the same time
+            sketches: Use cardinality sketches (see list_metrics)
+            heavy_hitters: Build the heavy hitter report (see list_metrics)
+            cache: Cache of the shard results (see list_metrics)
+
+        Returns:
+            Dictionary with the merged "Summary", the "ShardCount" and, if
+            requested, the merged "Sketches" and "HeavyHitters"
+        """
+        shards = self.build_shards(account_ids=account_ids, namespaces=namespaces)
+
+        def scan(shard):
+            return self.list_metrics(include_metrics=False, sketches=sketches,
+                                     heavy_hitters=heavy_hitters, cache=cache, **shard)
+
+        workers = max(1, min(max_workers, len(shards)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            partials = list(executor.map(scan, shards))
+
+        result = {
+            "Summary": merge_summaries([partial["Summary"] for partial in partials]),
+            "ShardCount": len(shards)
+        }
+        if sketches:
+            result["Sketches"] = cw_metric_sketch.SketchSummary()
+            for partial in partials:
+                result["Sketches"].merge(partial["Sketches"])
+        if heavy_hitters:
+            result["HeavyHitters"] = cw_metric_sketch.HeavyHitters(top=heavy_hitters)
+            for partial in partials:
+                result["HeavyHitters"].merge(partial["HeavyHitters"])
+
         return result
 
     def put_metric_data(self, namespace: str, 
@@ -87,13 +755,14 @@ class CloudWatch():
             'Value': value,
             'Unit': unit
         }
-        print("BRD: dimensions: ", dimensions)
-        print("BRD: metric data: ", metric_data)
+        log_record("PutMetricData", Namespace=namespace, MetricName=metric_name,
+                   Value=value, Unit=unit, Dimensions=dimensions or [])
 
         if dimensions:
             metric_data['Dimensions'] = dimensions
         
-        response = self.client.put_metric_data(
+        response = self._call(
+            "put_metric_data",
             Namespace=namespace,
             MetricData=[metric_data]
         )
@@ -110,9 +779,139 @@ class CloudWatch():
             }
         }
 
+    @staticmethod
+    def build_metric_datum(metric_name: str, value: float,
+                           unit: str = 'Count',
+                           dimensions: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        """
+        Build a single MetricDatum entry for put_metric_data_batch.
 
+        Args:
+            metric_name: Name of the metric
+            value: Value of the metric
+            unit: Unit of the metric
+            dimensions: List of dimensions for the metric
 
+        Returns:
+            MetricDatum dictionary
+        """
+        metric_data = {
+            'MetricName': metric_name,
+            'Value': value,
+            'Unit': unit
+        }
+        if dimensions:
+            metric_data['Dimensions'] = dimensions
 
+        return metric_data
 
+    @staticmethod
+    def batch_metric_data(metric_data: List[Dict[str, Any]],
+                          batch_size: int = MAX_METRIC_DATA_PER_CALL,
+                          max_batch_bytes: int = MAX_METRIC_DATA_BYTES) -> List[List[Dict[str, Any]]]:
+        """
+        Pack MetricDatum entries into the largest batches PutMetricData accepts.
+
+        A batch is closed when it reaches batch_size entries or when adding
+        the next entry would take its estimated payload over max_batch_bytes.
+
+        Args:
+            metric_data: List of MetricDatum dictionaries
+            batch_size: Maximum number of entries per batch
+            max_batch_bytes: Maximum estimated payload size per batch
+
+        Returns:
+            List of batches, each a list of MetricDatum dictionaries
+        """
+        batches = []
+        batch = []
+        batchBytes = 0
+        for datum in metric_data:
+            datumBytes = len(json.dumps(datum, default=str))
+            if batch and (len(batch) >= batch_size or
+                          batchBytes + datumBytes > max_batch_bytes):
+                batches.append(batch)
+                batch = []
+                batchBytes = 0
+
+            batch.append(datum)
+            batchBytes += datumBytes
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def put_metric_data_batch(self, namespace: str,
+                              metric_data: List[Dict[str, Any]],
+                              max_workers: int = 4,
+                              batch_size: int = MAX_METRIC_DATA_PER_CALL,
+                              max_batch_bytes: int = MAX_METRIC_DATA_BYTES) -> Dict[str, Any]:
+        """
+        Push many datapoints to CloudWatch in batched, concurrent calls.
 
+        The datapoints are packed into as few PutMetricData calls as the API
+        limits allow and the calls are sent on a bounded thread pool. A
+        failed batch is recorded in the result and does not stop the others.
 
+        Args:
+            namespace: Namespace for the metrics
+            metric_data: List of MetricDatum dictionaries (see build_metric_datum)
+            max_workers: Maximum number of concurrent PutMetricData calls
+            batch_size: Maximum number of entries per call
+            max_batch_bytes: Maximum estimated payload size per call
+
+        Returns:
+            Dictionary with the overall status, success/failure counts and
+            the per-batch results
+        """
+        batches = self.batch_metric_data(metric_data,
+                                         batch_size=batch_size,
+                                         max_batch_bytes=max_batch_bytes)
+
+        def send(batchIndex, batch):
+            try:
+                response = self._call(
+                    "put_metric_data",
+                    Namespace=namespace,
+                    MetricData=batch
+                )
+                return {
+                    'BatchIndex': batchIndex,
+                    'Status': 'Success',
+                    'MetricCount': len(batch),
+                    'Response': response
+                }
+            except Exception as err:
+                return {
+                    'BatchIndex': batchIndex,
+                    'Status': 'Failure',
+                    'MetricCount': len(batch),
+                    'Error': str(err)
+                }
+
+        results = []
+        if batches:
+            workers = max(1, min(max_workers, len(batches)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(send, range(len(batches)), batches))
+
+        failureCount = len([r for r in results if r['Status'] != 'Success'])
+        if failureCount == 0:
+            status = 'Success'
+        elif failureCount == len(results):
+            status = 'Failure'
+        else:
+            status = 'PartialFailure'
+
+        self.instrumentation.count("MetricDataPublished",
+                                   sum(r['MetricCount'] for r in results if r['Status'] == 'Success'))
+
+        return {
+            'Status': status,
+            'Namespace': namespace,
+            'BatchCount': len(results),
+            'SuccessCount': len(results) - failureCount,
+            'FailureCount': failureCount,
+            'Batches': results
+        }
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Queryable on-disk index of a metric inventory.
+
+MetricIndex loads a ListMetrics scan into a local SQLite database, so
+ad-hoc inventory questions ("all metrics with dimension InstanceId in
+account X", "namespaces that exist in only one account") are answered by
+indexed queries instead of a new scan or a pass over millions of metric
+dictionaries.
+
+Strings are normalized into one table each for accounts, namespaces,
+metric names, dimension names and dimension values. A metric is a row of
+ids, and its dimensions are rows of the metric_dimensions table. Pages
+are bulk inserted with executemany in transactions of batch_size metrics,
+and the lookup indexes are built once after the load, which is much
+faster than maintaining them row by row.
+
+SQLite assigns the string ids (INSERT OR IGNORE, then SELECT id). A
+bounded LRU cache per string table keeps the ids of recently used
+strings, so memory stays flat however many distinct dimension values a
+scan has, while the few accounts, namespaces and names never leave it.
+"""
+
+import sqlite3
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterator, List, Optional, Any
+
+import cw_metric_helper
+
+
+SCHEMA_VERSION = 1
+# Metrics per insert when loading from something other than ListMetrics pages.
+PAGE_SIZE = 500
+# Strings per table in the id cache.
+DEFAULT_CACHE_SIZE = 65536
+# Strings per id lookup, under the SQLite limit of 999 bound parameters.
+LOOKUP_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS accounts (id INTEGER PRIMARY KEY, account_id TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS namespaces (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS metric_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS dimension_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS dimension_values (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    account INTEGER NOT NULL REFERENCES accounts (id),
+    namespace INTEGER NOT NULL REFERENCES namespaces (id),
+    name INTEGER NOT NULL REFERENCES metric_names (id)
+);
+CREATE TABLE IF NOT EXISTS metric_dimensions (
+    metric INTEGER NOT NULL REFERENCES metrics (id),
+    name INTEGER NOT NULL REFERENCES dimension_names (id),
+    value INTEGER NOT NULL REFERENCES dimension_values (id)
+);
+"""
+
+# Lookup paths: by account (and namespace), by namespace and metric name,
+# by dimension name (and value), and the dimensions of a metric.
+INDEXES = """
+CREATE INDEX IF NOT EXISTS metrics_account_namespace ON metrics (account, namespace);
+CREATE INDEX IF NOT EXISTS metrics_namespace_name ON metrics (namespace, name);
+CREATE INDEX IF NOT EXISTS metric_dimensions_name_value ON metric_dimensions (name, value);
+CREATE INDEX IF NOT EXISTS metric_dimensions_metric ON metric_dimensions (metric);
+"""
+
+# Table and column holding each kind of string.
+STRING_TABLES = {
+    "accounts": ("accounts", "account_id"),
+    "namespaces": ("namespaces", "name"),
+    "names": ("metric_names", "name"),
+    "dimensionNames": ("dimension_names", "name"),
+    "dimensionValues": ("dimension_values", "value"),
+}
+
+
+class MetricIndex():
+    def __init__(self, path: str = ":memory:", batch_size: int = 10000,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        """
+        Open (or create) an index database.
+
+        Args:
+            path: SQLite database file, or ":memory:"
+            batch_size: Metrics inserted per transaction while loading
+            cache_size: Strings per table whose ids are cached in memory
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+        # String -> id, least recently used first.
+        self._ids = {attribute: OrderedDict() for attribute in STRING_TABLES}
+        self._nextMetricId = self.connection.execute(
+                "SELECT COALESCE(MAX(id), -1) + 1 FROM metrics").fetchone()[0]
+        self._pending = 0
+
+    @classmethod
+    def scan(cls, cwHelper, path: str = ":memory:", batch_size: int = 10000,
+             **filters) -> "MetricIndex":
+        """
+        Build an index from a ListMetrics scan, one page at a time.
+
+        Args:
+            cwHelper: cw_metric_helper.CloudWatch instance
+            path: SQLite database file, or ":memory:"
+            batch_size: Metrics inserted per transaction
+            filters: Extra ListMetrics parameters
+
+        Returns:
+            MetricIndex instance, with the lookup indexes built
+        """
+        index = cls(path, batch_size=batch_size)
+        index.clear()
+        for metrics, owningAccounts in cwHelper.iter_metric_pages(**filters):
+            index.add_page(metrics, owningAccounts)
+        index.finish(region=cwHelper.region)
+
+        return index
+
+    @classmethod
+    def from_inventory(cls, inventory, path: str = ":memory:",
+                       batch_size: int = 10000) -> "MetricIndex":
+        """
+        Build an index from a cw_metric_inventory.MetricInventory.
+        """
+        index = cls(path, batch_size=batch_size)
+        index.clear()
+        metrics = []
+        for metric in inventory.iter_metrics():
+            metrics.append(metric)
+            if len(metrics) == PAGE_SIZE:
+                index.add_page(metrics, [metric["aws.accountId"] for metric in metrics])
+                metrics = []
+        index.add_page(metrics, [metric["aws.accountId"] for metric in metrics])
+        index.finish()
+
+        return index
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def clear(self) -> None:
+        """
+        Remove every metric and string, keeping the schema.
+
+        The lookup indexes are dropped too, so a reload inserts into bare
+        tables. finish builds them again.
+        """
+        with self.connection:
+            for (name,) in self.connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall():
+                self.connection.execute("DROP INDEX %s" % name)
+            for table in ("metric_dimensions", "metrics", "meta") + \
+                    tuple(table for table, _ in STRING_TABLES.values()):
+                self.connection.execute("DELETE FROM %s" % table)
+        self._ids = {attribute: OrderedDict() for attribute in STRING_TABLES}
+        self._nextMetricId = 0
+        self._pending = 0
+
+    def _intern(self, attribute: str, values) -> Dict[str, int]:
+        """
+        Return the ids of strings, inserting the ones not in the database.
+
+        Args:
+            attribute: Kind of string (key of STRING_TABLES)
+            values: Strings to look up
+
+        Returns:
+            Dictionary of string -> id for every value
+        """
+        cache = self._ids[attribute]
+        ids = {}
+        missing = []
+        for value in dict.fromkeys(values):
+            stringId = cache.get(value)
+            if stringId is None:
+                missing.append(value)
+            else:
+                cache.move_to_end(value)
+                ids[value] = stringId
+
+        table, column = STRING_TABLES[attribute]
+        if missing:
+            self.connection.executemany("INSERT OR IGNORE INTO %s (%s) VALUES (?)" % (table, column),
+                                        [(value,) for value in missing])
+        for start in range(0, len(missing), LOOKUP_CHUNK):
+            chunk = missing[start:start + LOOKUP_CHUNK]
+            ids.update((value, stringId) for stringId, value in self.connection.execute(
+                    "SELECT id, %s FROM %s WHERE %s IN (%s)" %
+                    (column, table, column, ",".join("?" * len(chunk))), chunk))
+        for value in missing:
+            cache[value] = ids[value]
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+        return ids
+
+    def add_page(self, metrics: List[Dict[str, Any]], owningAccounts: List[str]) -> None:
+        """
+        Insert the metrics of one ListMetrics page.
+
+        Rows go into the open transaction, which is committed once
+        batch_size metrics are pending.
+        """
+        dimensions = [metric.get("Dimensions", []) for metric in metrics]
+        accountIds = self._intern("accounts", owningAccounts)
+        namespaceIds = self._intern("namespaces", [metric["Namespace"] for metric in metrics])
+        nameIds = self._intern("names", [metric["MetricName"] for metric in metrics])
+        dimensionNameIds = self._intern("dimensionNames", [dimension["Name"] for metricDimensions in dimensions
+                                                           for dimension in metricDimensions])
+        dimensionValueIds = self._intern("dimensionValues", [dimension["Value"] for metricDimensions in dimensions
+                                                             for dimension in metricDimensions])
+
+        metricRows = []
+        dimensionRows = []
+        for metric, accountId, metricDimensions in zip(metrics, owningAccounts, dimensions):
+            metricId = self._nextMetricId
+            self._nextMetricId += 1
+            metricRows.append((metricId, accountIds[accountId], namespaceIds[metric["Namespace"]],
+                               nameIds[metric["MetricName"]]))
+            for dimension in metricDimensions:
+                dimensionRows.append((metricId, dimensionNameIds[dimension["Name"]],
+                                      dimensionValueIds[dimension["Value"]]))
+
+        self.connection.executemany(
+                "INSERT INTO metrics (id, account, namespace, name) VALUES (?, ?, ?, ?)", metricRows)
+        self.connection.executemany(
+                "INSERT INTO metric_dimensions (metric, name, value) VALUES (?, ?, ?)", dimensionRows)
+
+        self._pending += len(metricRows)
+        if self._pending >= self.batch_size:
+            self.connection.commit()
+            self._pending = 0
+
+    def finish(self, region: Optional[str] = None) -> None:
+        """
+        Commit the load, build the lookup indexes and record the scan.
+        """
+        meta = {"SchemaVersion": str(SCHEMA_VERSION), "ScanTime": str(int(time.time()))}
+        if region is not None:
+            meta["Region"] = region
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                        meta.items())
+            self.connection.executescript(INDEXES)
+            self.connection.execute("ANALYZE")
+        self._pending = 0
+
+    def meta(self) -> Dict[str, str]:
+        """
+        Return the scan metadata (schema version, scan time, region).
+        """
+        return dict(self.connection.execute("SELECT key, value FROM meta"))
+
+    def query(self, sql: str, params=()) -> List[tuple]:
+        """
+        Run a read-only SQL query against the index tables.
+        """
+        return self.connection.execute(sql, params).fetchall()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM metrics").fetchone()[0]
+
+    def count_by_account(self) -> Dict[str, int]:
+        """
+        Return the number of metrics per account.
+        """
+        return dict(self.connection.execute(
+                "SELECT a.account_id, COUNT(*) FROM metrics m "
+                "JOIN accounts a ON a.id = m.account GROUP BY m.account"))
+
+    def count_by_namespace(self, accountId: Optional[str] = None) -> Dict[str, int]:
+        """
+        Return the number of metrics per namespace, optionally for one account.
+        """
+        sql = "SELECT n.name, COUNT(*) FROM metrics m JOIN namespaces n ON n.id = m.namespace"
+        params = ()
+        if accountId is not None:
+            sql += " WHERE m.account = (SELECT id FROM accounts WHERE account_id = ?)"
+            params = (accountId,)
+
+        return dict(self.connection.execute(sql + " GROUP BY m.namespace", params))
+
+    def single_account_namespaces(self) -> Dict[str, str]:
+        """
+        Return the namespaces that exist in only one account, with that account.
+        """
+        return dict(self.connection.execute(
+                "SELECT n.name, a.account_id FROM "
+                "(SELECT namespace, MIN(account) AS account FROM metrics "
+                " GROUP BY namespace HAVING COUNT(DISTINCT account) = 1) s "
+                "JOIN namespaces n ON n.id = s.namespace "
+                "JOIN accounts a ON a.id = s.account"))
+
+    def count_by_dimension_value(self, dimensionName: str,
+                                 namespace: Optional[str] = None) -> Dict[str, int]:
+        """
+        Return the number of metrics per value of a dimension.
+
+        Args:
+            dimensionName: Dimension name, e.g. "InstanceId"
+            namespace: Only count metrics of this namespace
+        """
+        sql = ("SELECT v.value, COUNT(*) FROM metric_dimensions d "
+               "JOIN dimension_values v ON v.id = d.value "
+               "WHERE d.name = (SELECT id FROM dimension_names WHERE name = ?)")
+        params = [dimensionName]
+        if namespace is not None:
+            sql += (" AND d.metric IN (SELECT id FROM metrics WHERE namespace = "
+                    "(SELECT id FROM namespaces WHERE name = ?))")
+            params.append(namespace)
+
+        return dict(self.connection.execute(sql + " GROUP BY d.value", params))
+
+    def find_metrics(self, accountId: Optional[str] = None,
+                     namespace: Optional[str] = None,
+                     metricName: Optional[str] = None,
+                     dimensionName: Optional[str] = None,
+                     dimensionValue: Optional[str] = None,
+                     limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the metrics matching every given filter.
+
+        Args:
+            accountId: Owning account id
+            namespace: Namespace
+            metricName: Metric name
+            dimensionName: Only metrics with this dimension
+            dimensionValue: Only metrics with this dimension value (with
+                            dimensionName, or in any dimension without it)
+            limit: Maximum number of metrics
+
+        Yields:
+            ListMetrics style metric dictionaries (with "aws.accountId")
+        """
+        where = []
+        params = []
+        for column, table, key, value in (("account", "accounts", "account_id", accountId),
+                                          ("namespace", "namespaces", "name", namespace),
+                                          ("name", "metric_names", "name", metricName)):
+            if value is not None:
+                where.append("m.%s = (SELECT id FROM %s WHERE %s = ?)" % (column, table, key))
+                params.append(value)
+
+        if dimensionName is not None or dimensionValue is not None:
+            dimensionWhere = []
+            if dimensionName is not None:
+                dimensionWhere.append("name = (SELECT id FROM dimension_names WHERE name = ?)")
+                params.append(dimensionName)
+            if dimensionValue is not None:
+                dimensionWhere.append("value = (SELECT id FROM dimension_values WHERE value = ?)")
+                params.append(dimensionValue)
+            where.append("m.id IN (SELECT metric FROM metric_dimensions WHERE %s)" %
+                         " AND ".join(dimensionWhere))
+
+        sql = ("SELECT m.id, a.account_id, n.name, mn.name FROM metrics m "
+               "JOIN accounts a ON a.id = m.account "
+               "JOIN namespaces n ON n.id = m.namespace "
+               "JOIN metric_names mn ON mn.id = m.name")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY m.id"
+        if limit is not None:
+            sql += " LIMIT %d" % int(limit)
+
+        dimensionCursor = self.connection.cursor()
+        for metricId, accountId, namespace, metricName in self.connection.execute(sql, params):
+            dimensions = dimensionCursor.execute(
+                    "SELECT dn.name, dv.value FROM metric_dimensions d "
+                    "JOIN dimension_names dn ON dn.id = d.name "
+                    "JOIN dimension_values dv ON dv.id = d.value "
+                    "WHERE d.metric = ? ORDER BY d.rowid", (metricId,))
+            yield {
+                "Namespace": namespace,
+                "MetricName": metricName,
+                "Dimensions": [{"Name": name, "Value": value} for name, value in dimensions],
+                "aws.accountId": accountId
+            }
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return the index as a list_metrics style summary.
+        """
+        summary = cw_metric_helper.new_summary()
+        for accountId, namespace, count in self.connection.execute(
+                "SELECT a.account_id, n.name, COUNT(*) FROM metrics m "
+                "JOIN accounts a ON a.id = m.account "
+                "JOIN namespaces n ON n.id = m.namespace "
+                "GROUP BY m.account, m.namespace"):
+            if accountId not in summary:
+                summary[accountId] = {
+                    "TotalMetricCount": 0,
+                    "MetricCountByNamespace": defaultdict(int),
+                    "UniqueMetricNames": set()
+                }
+            summary[accountId]["TotalMetricCount"] += count
+            summary[accountId]["MetricCountByNamespace"][namespace] = count
+            summary["TotalMetricCount"] += count
+
+        for accountId, name in self.connection.execute(
+                "SELECT DISTINCT a.account_id, mn.name FROM metrics m "
+                "JOIN accounts a ON a.id = m.account "
+                "JOIN metric_names mn ON mn.id = m.name"):
+            summary[accountId]["UniqueMetricNames"].add(name)
+
+        return summary
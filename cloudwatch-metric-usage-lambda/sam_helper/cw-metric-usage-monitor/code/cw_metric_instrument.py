@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Self instrumentation of the metric usage monitor.
+
+Instrumentation records where the time of a run goes: wall time per
+handler phase (scan, aggregate, publish), a latency histogram and the
+attempt/retry/error counts per CloudWatch operation, and counters such as
+ListMetrics pages and metrics seen. Histograms have fixed log spaced
+buckets, so recording is a lock and a few increments and memory does not
+grow with the number of calls.
+
+The recorded figures are turned into MetricDatum dictionaries by
+metric_data and published after the usage metrics. NullInstrumentation has
+the same interface and records nothing, for runs with instrumentation off.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any
+
+
+# Upper bounds of the latency buckets in milliseconds, the last bucket is open.
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+PERCENTILES = (50, 90, 99)
+
+
+class LatencyHistogram():
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS_MS):
+        """
+        Initialize an empty histogram.
+
+        Args:
+            buckets: Ascending bucket upper bounds in milliseconds
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, milliseconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def percentile(self, percent: float) -> float:
+        """
+        Return the upper bound of the bucket holding the given percentile.
+
+        Values in the open last bucket are reported as the maximum seen.
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = self.count * percent / 100.0
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if idx == len(self.buckets):
+                    return self.max
+                return min(float(self.buckets[idx]), self.max)
+
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "Count": self.count,
+            "AvgMs": round(self.total / self.count, 3) if self.count else 0.0,
+            "MaxMs": round(self.max, 3),
+            "Buckets": {("<=%s" % bound): count
+                        for bound, count in zip(self.buckets, self.counts) if count}
+        }
+        if self.counts[-1]:
+            result["Buckets"][">%s" % self.buckets[-1]] = self.counts[-1]
+        for percent in PERCENTILES:
+            result["P%dMs" % percent] = round(self.percentile(percent), 3)
+
+        return result
+
+
+class Instrumentation():
+    def __init__(self, clock=time.perf_counter):
+        """
+        Initialize the recorder.
+
+        Args:
+            clock: Clock function returning seconds (for tests)
+        """
+        self.clock = clock
+        self.phases = {}
+        self.operations = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time a block as the named phase. Repeated phases add up.
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def _operation(self, operation: str) -> Dict[str, Any]:
+        if operation not in self.operations:
+            self.operations[operation] = {
+                "Calls": 0,
+                "Attempts": 0,
+                "Retries": 0,
+                "Errors": 0,
+                "Latency": LatencyHistogram()
+            }
+
+        return self.operations[operation]
+
+    def record_attempt(self, operation: str, seconds: float, error: bool = False) -> None:
+        """
+        Record one API attempt, including the ones retried after throttling.
+        """
+        with self._lock:
+            stats = self._operation(operation)
+            stats["Attempts"] += 1
+            if error:
+                stats["Errors"] += 1
+            stats["Latency"].add(seconds * 1000.0)
+
+    def record_call(self, operation: str, attempts: int) -> None:
+        """
+        Record one API call made of the given number of attempts.
+        """
+        with self._lock:
+            stats = self._operation(operation)
+            stats["Calls"] += 1
+            stats["Retries"] += max(0, attempts - 1)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Return everything recorded as a JSON serializable dictionary.
+        """
+        with self._lock:
+            return {
+                "Phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+                "Operations": {operation: dict(stats, Latency=stats["Latency"].to_dict())
+                               for operation, stats in self.operations.items()},
+                "Counters": dict(self.counters)
+            }
+
+    def metric_data(self, dimensions: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, Any]]:
+        """
+        Return the recorded figures as MetricDatum dictionaries.
+
+        Phases are published as "PhaseDuration" with a phase dimension,
+        operations as call/retry/error counts and latency percentiles with
+        an operation dimension, and counters under their own names.
+        """
+        dimensions = dimensions or []
+
+        def datum(name, value, unit, extra=None):
+            metricDatum = {"MetricName": name, "Value": value, "Unit": unit}
+            if dimensions or extra:
+                metricDatum["Dimensions"] = dimensions + (extra or [])
+            return metricDatum
+
+        report = self.report()
+        metricData = []
+        for name, seconds in report["Phases"].items():
+            metricData.append(datum("PhaseDuration", seconds, "Seconds",
+                                    [{"Name": "phase", "Value": name}]))
+
+        for operation, stats in report["Operations"].items():
+            extra = [{"Name": "operation", "Value": operation}]
+            for name in ("Calls", "Retries", "Errors"):
+                metricData.append(datum("Api%s" % name, stats[name], "Count", extra))
+            for percent in PERCENTILES:
+                metricData.append(datum("ApiLatencyP%d" % percent,
+                                        stats["Latency"]["P%dMs" % percent], "Milliseconds", extra))
+            metricData.append(datum("ApiLatencyMax", stats["Latency"]["MaxMs"], "Milliseconds", extra))
+
+        for name, value in report["Counters"].items():
+            metricData.append(datum(name, value, "Count"))
+
+        return metricData
+
+
+class NullInstrumentation(Instrumentation):
+    """
+    Instrumentation that records nothing.
+    """
+    @property
+    def enabled(self) -> bool:
+        return False
+
+    @contextmanager
+    def phase(self, name: str):
+        yield
+
+    def record_attempt(self, operation: str, seconds: float, error: bool = False) -> None:
+        pass
+
+    def record_call(self, operation: str, attempts: int) -> None:
+        pass
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
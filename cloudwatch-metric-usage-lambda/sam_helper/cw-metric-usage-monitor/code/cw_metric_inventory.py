@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Metric inventory structures.
+
+MetricInventory is a compact, column oriented store of ListMetrics results.
+Namespace, metric name, dimension name/value and account strings are
+interned into integer ids and every metric is a row in array backed
+columns, instead of a boto3 dictionary per metric.
+
+IncrementalInventory avoids rebuilding the inventory on every run. A full
+ListMetrics scan returns every metric that received data in the last two
+weeks. Between two 5 minute runs only a few of them change, so
+IncrementalInventory keeps a snapshot of the known metrics in a
+MetricStore and only pages the metrics reported by ListMetrics with
+RecentlyActive=PT3H. The snapshot is a MetricInventory whose rows are
+grouped by the time bucket the metric was last seen active in, oldest
+first. Metrics not seen active within the retention window are expired
+by dropping whole buckets, and a periodic full scan reconciles the
+snapshot with what CloudWatch actually returns. The snapshot also keeps
+the summary counts (metrics per account and namespace, metrics per
+account and metric name) and a run only applies the metrics it added and
+removed to them.
+"""
+
+import base64
+import json
+import sys
+import time
+import zlib
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Any
+
+import cw_metric_helper
+
+
+# ListMetrics stops returning metrics that had no datapoints for two weeks.
+METRIC_RETENTION_SECONDS = 14 * 24 * 3600
+# The only RecentlyActive window ListMetrics supports.
+RECENTLY_ACTIVE = "PT3H"
+SNAPSHOT_VERSION = 3
+# Width of the last seen time buckets of the snapshot.
+SNAPSHOT_BUCKET_SECONDS = 3600
+INVENTORY_VERSION = 2
+# Columns of a MetricInventory, serialized as zlib compressed little endian
+# uint32 arrays (version 1: uncompressed).
+INVENTORY_COLUMNS = ("accountCol", "namespaceCol", "nameCol", "dimStart", "dimNameCol", "dimValueCol")
+INVENTORY_TABLES = ("accounts", "namespaces", "names", "dimensionNames", "dimensionValues")
+
+
+def metric_key(accountId: str, metric: Dict[str, Any]) -> str:
+    """
+    Return a canonical string identifying a metric of an account.
+
+    Args:
+        accountId: Owning account id
+        metric: Metric dictionary from a ListMetrics response
+
+    Returns:
+        Key string, stable regardless of dimension order
+    """
+    dimensions = sorted([dimension["Name"], dimension["Value"]]
+                        for dimension in metric.get("Dimensions", []))
+    return json.dumps([accountId, metric["Namespace"], metric["MetricName"], dimensions],
+                      separators=(",", ":"))
+
+
+def decode_metric_key(key: str) -> Dict[str, Any]:
+    """
+    Rebuild the metric dictionary (with "aws.accountId") from a metric key.
+    """
+    accountId, namespace, metricName, dimensions = json.loads(key)
+    return {
+        "Namespace": namespace,
+        "MetricName": metricName,
+        "Dimensions": [{"Name": name, "Value": value} for name, value in dimensions],
+        "aws.accountId": accountId
+    }
+
+
+class StringTable():
+    """
+    Interns strings into dense integer ids.
+    """
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, value: str) -> int:
+        stringId = self.ids.get(value)
+        if stringId is None:
+            stringId = len(self.strings)
+            self.ids[value] = stringId
+            self.strings.append(value)
+
+        return stringId
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, stringId: int) -> str:
+        return self.strings[stringId]
+
+
+class MetricInventory():
+    def __init__(self):
+        """
+        Initialize an empty inventory.
+
+        Row i of the inventory is account/namespace/name column i, and its
+        dimensions are entries dimStart[i]:dimStart[i + 1] of the dimension
+        name and value columns.
+        """
+        self.accounts = StringTable()
+        self.namespaces = StringTable()
+        self.names = StringTable()
+        self.dimensionNames = StringTable()
+        self.dimensionValues = StringTable()
+
+        self.accountCol = array("I")
+        self.namespaceCol = array("I")
+        self.nameCol = array("I")
+        self.dimStart = array("I", [0])
+        self.dimNameCol = array("I")
+        self.dimValueCol = array("I")
+
+    @classmethod
+    def scan(cls, cwHelper, **filters) -> "MetricInventory":
+        """
+        Build an inventory from a ListMetrics scan, one page at a time.
+
+        Args:
+            cwHelper: cw_metric_helper.CloudWatch instance
+            filters: Extra ListMetrics parameters
+
+        Returns:
+            MetricInventory instance
+        """
+        inventory = cls()
+        for metrics, owningAccounts in cwHelper.iter_metric_pages(**filters):
+            inventory.add_page(metrics, owningAccounts)
+
+        return inventory
+
+    def add(self, accountId: str, metric: Dict[str, Any]) -> None:
+        """
+        Append one metric of a ListMetrics response.
+        """
+        self.accountCol.append(self.accounts.intern(accountId))
+        self.namespaceCol.append(self.namespaces.intern(metric["Namespace"]))
+        self.nameCol.append(self.names.intern(metric["MetricName"]))
+        for dimension in metric.get("Dimensions", []):
+            self.dimNameCol.append(self.dimensionNames.intern(dimension["Name"]))
+            self.dimValueCol.append(self.dimensionValues.intern(dimension["Value"]))
+        self.dimStart.append(len(self.dimNameCol))
+
+    def add_page(self, metrics: List[Dict[str, Any]], owningAccounts: List[str]) -> None:
+        """
+        Append the metrics of one ListMetrics page.
+        """
+        for metric, accountId in zip(metrics, owningAccounts):
+            self.add(accountId, metric)
+
+    def extend(self, other: "MetricInventory", rows) -> None:
+        """
+        Append rows of another inventory, interning their strings here.
+
+        Only the strings of the copied rows end up in the string tables.
+        """
+        ids = {table: [None] * len(getattr(other, table)) for table in INVENTORY_TABLES}
+
+        def remap(table, stringId):
+            newId = ids[table][stringId]
+            if newId is None:
+                newId = ids[table][stringId] = getattr(self, table).intern(getattr(other, table)[stringId])
+            return newId
+
+        for row in rows:
+            self.accountCol.append(remap("accounts", other.accountCol[row]))
+            self.namespaceCol.append(remap("namespaces", other.namespaceCol[row]))
+            self.nameCol.append(remap("names", other.nameCol[row]))
+            for idx in range(other.dimStart[row], other.dimStart[row + 1]):
+                self.dimNameCol.append(remap("dimensionNames", other.dimNameCol[idx]))
+                self.dimValueCol.append(remap("dimensionValues", other.dimValueCol[idx]))
+            self.dimStart.append(len(self.dimNameCol))
+
+    def row_key(self, row: int) -> tuple:
+        """
+        Return the identity of a row as a tuple of string ids.
+        """
+        start, end = self.dimStart[row], self.dimStart[row + 1]
+        return (self.accountCol[row], self.namespaceCol[row], self.nameCol[row],
+                tuple(sorted(zip(self.dimNameCol[start:end], self.dimValueCol[start:end]))))
+
+    def intern_key(self, accountId: str, metric: Dict[str, Any]) -> tuple:
+        """
+        Return the row_key a metric has, or would have, in this inventory.
+        """
+        return (self.accounts.intern(accountId),
+                self.namespaces.intern(metric["Namespace"]),
+                self.names.intern(metric["MetricName"]),
+                tuple(sorted((self.dimensionNames.intern(dimension["Name"]),
+                              self.dimensionValues.intern(dimension["Value"]))
+                             for dimension in metric.get("Dimensions", []))))
+
+    def __len__(self):
+        return len(self.accountCol)
+
+    def count_by_account(self) -> Dict[str, int]:
+        """
+        Return the number of metrics per account.
+        """
+        counts = [0] * len(self.accounts)
+        for accountIdx in self.accountCol:
+            counts[accountIdx] += 1
+
+        return {self.accounts[idx]: count for idx, count in enumerate(counts) if count}
+
+    def count_by_namespace(self, accountId: Optional[str] = None) -> Dict[str, int]:
+        """
+        Return the number of metrics per namespace, optionally for one account.
+        """
+        counts = [0] * len(self.namespaces)
+        if accountId is None:
+            for namespaceIdx in self.namespaceCol:
+                counts[namespaceIdx] += 1
+        else:
+            accountIdx = self.accounts.ids.get(accountId)
+            for rowAccount, namespaceIdx in zip(self.accountCol, self.namespaceCol):
+                if rowAccount == accountIdx:
+                    counts[namespaceIdx] += 1
+
+        return {self.namespaces[idx]: count for idx, count in enumerate(counts) if count}
+
+    def metric(self, row: int) -> Dict[str, Any]:
+        """
+        Rebuild the ListMetrics dictionary (with "aws.accountId") of a row.
+        """
+        start, end = self.dimStart[row], self.dimStart[row + 1]
+        return {
+            "Namespace": self.namespaces[self.namespaceCol[row]],
+            "MetricName": self.names[self.nameCol[row]],
+            "Dimensions": [{"Name": self.dimensionNames[self.dimNameCol[idx]],
+                            "Value": self.dimensionValues[self.dimValueCol[idx]]}
+                           for idx in range(start, end)],
+            "aws.accountId": self.accounts[self.accountCol[row]]
+        }
+
+    def iter_metrics(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the dictionary view of every metric, built on demand.
+        """
+        for row in range(len(self)):
+            yield self.metric(row)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return a JSON serializable representation of the inventory.
+
+        String tables are lists and every column is the base64 of its
+        zlib compressed, little endian uint32 array, so (de)serializing
+        costs a copy per column rather than a dictionary per metric. Ids
+        repeat a lot (few accounts, namespaces and names), the columns
+        compress well.
+        """
+        data = {"Version": INVENTORY_VERSION}
+        for table in INVENTORY_TABLES:
+            data[table] = list(getattr(self, table).strings)
+        for column in INVENTORY_COLUMNS:
+            values = getattr(self, column)
+            if sys.byteorder != "little":
+                values = array("I", values)
+                values.byteswap()
+            data[column] = base64.b64encode(zlib.compress(values.tobytes(), 1)).decode("ascii")
+
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MetricInventory":
+        if data.get("Version") not in (1, INVENTORY_VERSION):
+            raise ValueError("Unsupported inventory version %s" % data.get("Version"))
+
+        inventory = cls()
+        for table in INVENTORY_TABLES:
+            for value in data[table]:
+                getattr(inventory, table).intern(value)
+        for column in INVENTORY_COLUMNS:
+            values = array("I")
+            payload = base64.b64decode(data[column])
+            values.frombytes(zlib.decompress(payload) if data["Version"] > 1 else payload)
+            if sys.byteorder != "little":
+                values.byteswap()
+            setattr(inventory, column, values)
+
+        return inventory
+
+    def serialize(self, format: str = "json") -> bytes:
+        """
+        Return the inventory as bytes (see cw_metric_helper.encode).
+        """
+        return cw_metric_helper.encode(self.to_dict(), format)
+
+    @classmethod
+    def deserialize(cls, payload: bytes, format: str = "json") -> "MetricInventory":
+        return cls.from_dict(cw_metric_helper.decode(payload, format))
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return the inventory as a list_metrics style summary.
+        """
+        summary = cw_metric_helper.new_summary()
+        namespaceCounts = defaultdict(lambda: defaultdict(int))
+        uniqueNames = defaultdict(set)
+        for accountIdx, namespaceIdx, nameIdx in zip(self.accountCol, self.namespaceCol, self.nameCol):
+            namespaceCounts[accountIdx][namespaceIdx] += 1
+            uniqueNames[accountIdx].add(nameIdx)
+
+        for accountIdx, counts in namespaceCounts.items():
+            accountSummary = {
+                "TotalMetricCount": sum(counts.values()),
+                "MetricCountByNamespace": defaultdict(int),
+                "UniqueMetricNames": {self.names[idx] for idx in uniqueNames[accountIdx]}
+            }
+            for namespaceIdx, count in counts.items():
+                accountSummary["MetricCountByNamespace"][self.namespaces[namespaceIdx]] = count
+            summary[self.accounts[accountIdx]] = accountSummary
+            summary["TotalMetricCount"] += accountSummary["TotalMetricCount"]
+
+        return summary
+
+
+class IncrementalInventory():
+    def __init__(self, cwHelper, store,
+                 snapshot_key: str = "inventory/snapshot",
+                 full_scan_interval: int = 24 * 3600,
+                 retention: int = METRIC_RETENTION_SECONDS,
+                 bucket_seconds: int = SNAPSHOT_BUCKET_SECONDS):
+        """
+        Initialize the incremental inventory.
+
+        Args:
+            cwHelper: cw_metric_helper.CloudWatch instance used to page ListMetrics
+            store: cw_metric_store.MetricStore holding the snapshot
+            snapshot_key: Store key of the snapshot
+            full_scan_interval: Seconds between full reconciliation scans
+            retention: Seconds after which a metric not seen active is removed
+            bucket_seconds: Width of the last seen time buckets. A metric
+                            expires once the end of its bucket is retention
+                            seconds old, so up to bucket_seconds late.
+        """
+        self.cwHelper = cwHelper
+        self.store = store
+        self.snapshot_key = snapshot_key
+        self.full_scan_interval = full_scan_interval
+        self.retention = retention
+        self.bucket_seconds = bucket_seconds
+
+    def _scan(self, known: MetricInventory, **filters):
+        """
+        Page ListMetrics into a MetricInventory of the metrics seen.
+
+        Returns:
+            (seen inventory, {known.row_key: seen row}, page count). Strings
+            of new metrics are interned into known, so their keys compare.
+        """
+        seen = MetricInventory()
+        seenRows = {}
+        pageCount = 0
+        for metrics, owningAccounts in self.cwHelper.iter_metric_pages(**filters):
+            pageCount += 1
+            for metric, accountId in zip(metrics, owningAccounts):
+                key = known.intern_key(accountId, metric)
+                if key not in seenRows:
+                    seenRows[key] = len(seen)
+                    seen.add(accountId, metric)
+
+        return seen, seenRows, pageCount
+
+    def _load(self) -> Dict[str, Any]:
+        snapshot = self.store.get(self.snapshot_key)
+        if snapshot is None or snapshot.get("Version") != SNAPSHOT_VERSION or \
+                snapshot["BucketSeconds"] != self.bucket_seconds:
+            return {"Version": SNAPSHOT_VERSION, "LastFullScan": None,
+                    "BucketSeconds": self.bucket_seconds, "Buckets": [],
+                    "Inventory": MetricInventory(), "Counts": {}}
+
+        snapshot["Inventory"] = MetricInventory.from_dict(snapshot["Inventory"])
+        return snapshot
+
+    def update(self, now: Optional[float] = None, full_scan: bool = False) -> Dict[str, Any]:
+        """
+        Bring the snapshot up to date and return the summary and deltas.
+
+        A full scan is done when there is no snapshot yet, when the last
+        full scan is older than full_scan_interval, or when full_scan is
+        set. Otherwise only recently active metrics are paged.
+
+        Args:
+            now: Current time in epoch seconds (default: time.time())
+            full_scan: Force a full scan
+
+        Returns:
+            Dictionary with the "Summary" (list_metrics shape), the "Added"
+            and "Removed" metric keys, "FullScan" and the "PageCount"
+        """
+        now = int(now if now is not None else time.time())
+        snapshot = self._load()
+        known = snapshot["Inventory"]
+        doFullScan = full_scan or snapshot["LastFullScan"] is None or \
+            now - snapshot["LastFullScan"] >= self.full_scan_interval
+
+        if doFullScan:
+            seen, seenRows, pageCount = self._scan(known)
+            expiredRows = len(known)
+            snapshot["LastFullScan"] = now
+        else:
+            seen, seenRows, pageCount = self._scan(known, RecentlyActive=RECENTLY_ACTIVE)
+            # Buckets are oldest first, the expired rows are a prefix.
+            expiredRows = 0
+            for bucket, rowCount in snapshot["Buckets"]:
+                if now - (bucket + 1) * self.bucket_seconds < self.retention:
+                    break
+                expiredRows += rowCount
+
+        # Rows seen again move to the current bucket, expired ones go.
+        keptRows = []
+        removedRows = []
+        buckets = []
+        addedRows = dict.fromkeys(seenRows.values())
+        start = 0
+        for bucket, rowCount in snapshot["Buckets"]:
+            keptCount = 0
+            for row in range(start, start + rowCount):
+                seenRow = seenRows.get(known.row_key(row))
+                if seenRow is not None:
+                    addedRows.pop(seenRow, None)
+                elif row < expiredRows:
+                    removedRows.append(row)
+                else:
+                    keptRows.append(row)
+                    keptCount += 1
+            start += rowCount
+            if keptCount:
+                buckets.append([bucket, keptCount])
+        currentBucket = now // self.bucket_seconds
+        if buckets and buckets[-1][0] == currentBucket:
+            buckets[-1][1] += len(seen)
+        elif len(seen):
+            buckets.append([currentBucket, len(seen)])
+
+        added = [seen.metric(row) for row in addedRows]
+        removed = [known.metric(row) for row in removedRows]
+        self.apply_counts(snapshot["Counts"], added, removed)
+
+        inventory = MetricInventory()
+        inventory.extend(known, keptRows)
+        inventory.extend(seen, range(len(seen)))
+        snapshot["Inventory"] = inventory.to_dict()
+        snapshot["Buckets"] = buckets
+        self.store.put(self.snapshot_key, snapshot)
+
+        return {
+            "Summary": self.summary_from_counts(snapshot["Counts"]),
+            "Added": [metric_key(metric["aws.accountId"], metric) for metric in added],
+            "Removed": [metric_key(metric["aws.accountId"], metric) for metric in removed],
+            "FullScan": doFullScan,
+            "PageCount": pageCount
+        }
+
+    @staticmethod
+    def apply_counts(counts: Dict[str, Any], added: List[Dict[str, Any]],
+                     removed: List[Dict[str, Any]]) -> None:
+        """
+        Update snapshot counts in place with added and removed metrics.
+
+        Args:
+            counts: Account id -> {"Namespaces": {namespace: count},
+                    "MetricNames": {metric name: count}}
+            added: Metrics (with "aws.accountId") new to the snapshot
+            removed: Metrics (with "aws.accountId") dropped from the snapshot
+        """
+        for metrics, delta in ((added, 1), (removed, -1)):
+            for metric in metrics:
+                accountId = metric["aws.accountId"]
+                accountCounts = counts.setdefault(accountId, {"Namespaces": {}, "MetricNames": {}})
+                for field, value in (("Namespaces", metric["Namespace"]), ("MetricNames", metric["MetricName"])):
+                    count = accountCounts[field].get(value, 0) + delta
+                    if count:
+                        accountCounts[field][value] = count
+                    else:
+                        del accountCounts[field][value]
+                if not accountCounts["Namespaces"]:
+                    del counts[accountId]
+
+    @staticmethod
+    def summary_from_counts(counts: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build a list_metrics style summary from snapshot counts.
+        """
+        summary = cw_metric_helper.new_summary()
+        for accountId, accountCounts in counts.items():
+            accountSummary = {
+                "TotalMetricCount": sum(accountCounts["Namespaces"].values()),
+                "MetricCountByNamespace": defaultdict(int, accountCounts["Namespaces"]),
+                "UniqueMetricNames": set(accountCounts["MetricNames"])
+            }
+            summary[accountId] = accountSummary
+            summary["TotalMetricCount"] += accountSummary["TotalMetricCount"]
+
+        return summary
+
+    @staticmethod
+    def summary(keys) -> Dict[str, Any]:
+        """
+        Build a list_metrics style summary from an iterable of metric keys.
+        """
+        summary = cw_metric_helper.new_summary()
+        for key in keys:
+            metric = decode_metric_key(key)
+            cw_metric_helper.add_page_to_summary(summary, [metric], [metric["aws.accountId"]])
+
+        return summary
+
+    def metric_keys(self) -> List[str]:
+        """
+        Return the metric keys of the stored snapshot.
+        """
+        return [metric_key(metric["aws.accountId"], metric)
+                for metric in self._load()["Inventory"].iter_metrics()]
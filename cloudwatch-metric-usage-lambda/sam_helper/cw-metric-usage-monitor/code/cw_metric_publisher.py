@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Publishing backends for the metric usage summary.
+
+ApiPublisher sends the datapoints with PutMetricData. EmfPublisher writes
+them to stdout as CloudWatch Embedded Metric Format (EMF) log events, which
+CloudWatch Logs turns into metrics asynchronously without any API call from
+the function. Both take the MetricDatum dictionaries built by
+cw_metric_helper.CloudWatch.build_metric_datum.
+"""
+
+import json
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any
+
+
+# EMF allows at most 100 metrics per directive, 100 values per metric
+# and 30 dimensions per dimension set.
+MAX_EMF_METRICS_PER_EVENT = 100
+MAX_EMF_VALUES_PER_METRIC = 100
+
+
+class MetricPublisher():
+    """
+    Interface of a publishing backend.
+    """
+    def publish(self, namespace: str, metric_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Publish MetricDatum dictionaries under namespace.
+
+        Returns:
+            Dictionary with the "Status", "BatchCount", "SuccessCount",
+            "FailureCount" and per-batch "Batches" results
+        """
+        raise NotImplementedError
+
+
+class ApiPublisher(MetricPublisher):
+    def __init__(self, cwHelper, max_workers: int = 4):
+        """
+        Publish through batched, concurrent PutMetricData calls.
+
+        Args:
+            cwHelper: cw_metric_helper.CloudWatch instance
+            max_workers: Maximum number of concurrent PutMetricData calls
+        """
+        self.cwHelper = cwHelper
+        self.max_workers = max_workers
+
+    def publish(self, namespace: str, metric_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return self.cwHelper.put_metric_data_batch(namespace=namespace,
+                                                   metric_data=metric_data,
+                                                   max_workers=self.max_workers)
+
+
+class EmfPublisher(MetricPublisher):
+    def __init__(self, stream=None):
+        """
+        Publish as Embedded Metric Format JSON lines.
+
+        Args:
+            stream: File object the log events are written to (default: sys.stdout)
+        """
+        self.stream = stream
+
+    @staticmethod
+    def build_events(namespace: str, metric_data: List[Dict[str, Any]],
+                     timestamp: int = None) -> List[Dict[str, Any]]:
+        """
+        Pack MetricDatum dictionaries into as few EMF log events as possible.
+
+        Datapoints with the same dimensions share an event. Up to 100
+        distinct metrics go into one event, and repeated datapoints of
+        the same metric are sent as a value array.
+
+        Args:
+            namespace: Namespace for the metrics
+            metric_data: List of MetricDatum dictionaries
+            timestamp: Event timestamp in epoch milliseconds (default: now)
+
+        Returns:
+            List of EMF log event dictionaries
+        """
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+
+        groups = OrderedDict()
+        for datum in metric_data:
+            dimensions = tuple((dimension["Name"], dimension["Value"])
+                               for dimension in datum.get("Dimensions", []))
+            groups.setdefault(dimensions, []).append(datum)
+
+        events = []
+        for dimensions, data in groups.items():
+            event = None
+            for datum in data:
+                name = datum["MetricName"]
+                if event is not None and name in event and \
+                        len(event[name]) < MAX_EMF_VALUES_PER_METRIC:
+                    event[name].append(datum["Value"])
+                    continue
+
+                if event is None or name in event or \
+                        len(event["_aws"]["CloudWatchMetrics"][0]["Metrics"]) >= MAX_EMF_METRICS_PER_EVENT:
+                    event = OrderedDict()
+                    event["_aws"] = {
+                        "Timestamp": timestamp,
+                        "CloudWatchMetrics": [{
+                            "Namespace": namespace,
+                            "Dimensions": [[dimensionName for dimensionName, _ in dimensions]],
+                            "Metrics": []
+                        }]
+                    }
+                    for dimensionName, dimensionValue in dimensions:
+                        event[dimensionName] = dimensionValue
+                    events.append(event)
+
+                event["_aws"]["CloudWatchMetrics"][0]["Metrics"].append(
+                    {"Name": name, "Unit": datum.get("Unit", "None")})
+                event[name] = [datum["Value"]]
+
+        # Single values are written as scalars.
+        for event in events:
+            for metric in event["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+                if len(event[metric["Name"]]) == 1:
+                    event[metric["Name"]] = event[metric["Name"]][0]
+
+        return events
+
+    def publish(self, namespace: str, metric_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        stream = self.stream or sys.stdout
+        events = self.build_events(namespace, metric_data)
+        for event in events:
+            stream.write(json.dumps(event, separators=(",", ":")) + "\n")
+        stream.flush()
+
+        # Each log event is a batch. Writing to stdout does not fail per event.
+        return {
+            'Status': 'Success',
+            'Namespace': namespace,
+            'BatchCount': len(events),
+            'SuccessCount': len(events),
+            'FailureCount': 0,
+            'Batches': []
+        }
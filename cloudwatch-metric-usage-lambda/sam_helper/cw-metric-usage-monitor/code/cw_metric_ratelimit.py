@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Client side rate limiting for CloudWatch API calls.
+
+AdaptiveRateLimiter combines a token bucket (calls per second) with a
+limit on calls in flight. Both adapt AIMD style: every successful call
+raises them a little, every throttling response cuts them by a factor.
+Throttled calls are retried with full jitter exponential backoff, and so
+are transient failures (5xx responses, timeouts, dropped connections),
+which do not lower the limits. The clients are created without botocore
+retries, so every retry goes through the limiter. The
+limiters are shared per region and operation, so all threads (shards,
+regions, publishing) of a process draw from the same budget.
+"""
+
+import random
+import threading
+import time
+from typing import Dict, Any
+
+import botocore.exceptions
+
+
+THROTTLE_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "TooManyRequestsException",
+    "SlowDown",
+}
+
+TRANSIENT_ERROR_CODES = {
+    "InternalFailure",
+    "InternalError",
+    "InternalServiceError",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+
+# Default CloudWatch TPS quotas per account and region.
+DEFAULT_QUOTAS = {
+    "list_metrics": 25,
+    "put_metric_data": 500,
+}
+
+
+def is_throttle_error(err: Exception) -> bool:
+    """
+    Return True if err is a throttling response.
+
+    A response is judged by its error code and HTTP 429 only. The message
+    is only looked at for errors without an error code, as other errors
+    (e.g. a validation error) may quote a throttling message.
+    """
+    response = getattr(err, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        if code in THROTTLE_ERROR_CODES:
+            return True
+        if response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 429:
+            return True
+        if code:
+            return False
+
+    message = str(err)
+    return "Throttling" in message or "Rate exceeded" in message
+
+
+def is_transient_error(err: Exception) -> bool:
+    """
+    Return True if err is a server side or connection failure worth retrying.
+    """
+    if isinstance(err, (botocore.exceptions.ConnectionError,
+                        botocore.exceptions.HTTPClientError)):
+        return True
+
+    response = getattr(err, "response", None)
+    if isinstance(response, dict):
+        if response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES:
+            return True
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+
+    return False
+
+
+class AdaptiveRateLimiter():
+    def __init__(self, rate: float, burst: float = None,
+                 min_rate: float = 1.0, max_rate: float = None,
+                 concurrency: int = 8, max_concurrency: int = None,
+                 rate_increase: float = None, backoff_factor: float = 0.5,
+                 max_attempts: int = 6, base_delay: float = 0.1, max_delay: float = 5.0,
+                 sleep=time.sleep, clock=time.monotonic):
+        """
+        Initialize the limiter.
+
+        Args:
+            rate: Initial calls per second
+            burst: Token bucket size (default: rate)
+            min_rate: Lowest rate after throttling
+            max_rate: Highest rate reached by additive increase (default: rate)
+            concurrency: Initial number of calls in flight
+            max_concurrency: Highest number of calls in flight (default: concurrency)
+            rate_increase: Rate added per successful call (default: 1% of max_rate)
+            backoff_factor: Factor applied to rate and concurrency on a throttle
+            max_attempts: Attempts per call, including the first
+            base_delay: Backoff base in seconds
+            max_delay: Backoff cap in seconds
+            sleep: Sleep function (for tests)
+            clock: Monotonic clock function (for tests)
+        """
+        self.max_rate = max_rate or rate
+        self.min_rate = min(min_rate, self.max_rate)
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.rate_increase = rate_increase if rate_increase is not None else self.max_rate / 100.0
+        self.max_concurrency = max_concurrency or concurrency
+        self.concurrency = float(concurrency)
+        self.backoff_factor = backoff_factor
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.clock = clock
+
+        self._tokens = self.burst
+        self._lastRefill = clock()
+        self._inFlight = 0
+        self._lock = threading.Lock()
+        self._slotFree = threading.Condition(self._lock)
+
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    def _acquire_token(self) -> None:
+        # Reserve the token right away, going into debt if the bucket is
+        # empty, and sleep until the debt is paid off. Callers are served
+        # in arrival order.
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._lastRefill) * self.rate)
+            self._lastRefill = now
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+            self.wait_seconds += wait
+
+        if wait > 0:
+            self.sleep(wait)
+
+    def _acquire_slot(self) -> None:
+        with self._slotFree:
+            start = self.clock()
+            while self._inFlight >= max(1, int(self.concurrency)):
+                self._slotFree.wait(timeout=1.0)
+            self._inFlight += 1
+            self.wait_seconds += self.clock() - start
+
+    def _release_slot(self) -> None:
+        with self._slotFree:
+            self._inFlight -= 1
+            self._slotFree.notify()
+
+    def _on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.rate_increase)
+            self.concurrency = min(self.max_concurrency,
+                                   self.concurrency + 1.0 / max(1.0, self.concurrency))
+
+    def _on_throttle(self) -> None:
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+            self.concurrency = max(1.0, self.concurrency * self.backoff_factor)
+            self._tokens = min(self._tokens, 0.0)
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call fn under the limiter, retrying throttled and transient failures.
+
+        Raises:
+            The last error when it is neither a throttle nor transient, or
+            the call still fails after max_attempts attempts
+        """
+        attempt = 0
+        while True:
+            self._acquire_token()
+            self._acquire_slot()
+            try:
+                with self._lock:
+                    self.calls += 1
+                result = fn(*args, **kwargs)
+            except Exception as err:
+                self._release_slot()
+                attempt += 1
+                throttled = is_throttle_error(err)
+                if not throttled and not is_transient_error(err):
+                    with self._lock:
+                        self.failures += 1
+                    raise
+
+                if throttled:
+                    self._on_throttle()
+                if attempt >= self.max_attempts:
+                    with self._lock:
+                        self.failures += 1
+                    raise
+
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                with self._lock:
+                    self.retries += 1
+                    self.wait_seconds += delay
+                self.sleep(delay)
+                continue
+
+            self._release_slot()
+            self._on_success()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the limiter counters and current limits.
+        """
+        with self._lock:
+            return {
+                "Calls": self.calls,
+                "Throttles": self.throttles,
+                "Retries": self.retries,
+                "Failures": self.failures,
+                "WaitSeconds": round(self.wait_seconds, 3),
+                "Rate": round(self.rate, 2),
+                "Concurrency": int(self.concurrency)
+            }
+
+
+_limiters = {}
+_limitersLock = threading.Lock()
+
+
+def new_limiters(quotas: Dict[str, float] = None) -> Dict[str, AdaptiveRateLimiter]:
+    """
+    Return a new limiter per CloudWatch operation.
+
+    Args:
+        quotas: Operation name -> calls per second (default: DEFAULT_QUOTAS)
+    """
+    quotas = quotas or DEFAULT_QUOTAS
+    return {operation: AdaptiveRateLimiter(rate=quota) for operation, quota in quotas.items()}
+
+
+def get_limiters(region: str) -> Dict[str, AdaptiveRateLimiter]:
+    """
+    Return the limiters shared by every CloudWatch helper of a region.
+    """
+    with _limitersLock:
+        if region not in _limiters:
+            _limiters[region] = new_limiters()
+
+        return _limiters[region]
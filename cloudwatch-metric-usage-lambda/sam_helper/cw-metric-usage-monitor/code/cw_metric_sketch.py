@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Bounded memory sketches for metric inventory aggregation.
+
+HyperLogLog estimates the number of distinct values it has seen with a
+fixed number of registers (2 ** precision bytes) and a relative error of
+about 1.04 / sqrt(2 ** precision). Two sketches with the same precision
+merge losslessly by taking the register wise maximum, so sketches built by
+parallel shards or successive incremental scans can be combined.
+
+SpaceSaving keeps the approximate top items of a weighted stream in a fixed
+number of counters. Every reported count over-estimates the true count by
+at most its reported error.
+"""
+
+import base64
+import hashlib
+import heapq
+import math
+from collections import defaultdict
+from typing import Dict, List, Any
+
+
+DEFAULT_PRECISION = 12
+# Per dimension key value sketches are more numerous, keep them smaller.
+DEFAULT_VALUE_PRECISION = 10
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog():
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        """
+        Initialize an empty HyperLogLog sketch.
+
+        Args:
+            precision: Number of index bits, 4 to 16. Uses 2 ** precision bytes.
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16, got %s" % precision)
+
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: str) -> None:
+        """
+        Add a string value to the sketch.
+        """
+        hashValue = _hash64(value)
+        index = hashValue >> (64 - self.precision)
+        remaining = hashValue & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """
+        Merge another sketch of the same precision into this one.
+
+        Returns:
+            This sketch
+        """
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches with precision %d and %d" %
+                             (self.precision, other.precision))
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        """
+        Return the estimated number of distinct values added.
+        """
+        registerCount = len(self.registers)
+        if registerCount == 16:
+            alpha = 0.673
+        elif registerCount == 32:
+            alpha = 0.697
+        elif registerCount == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / registerCount)
+
+        estimate = alpha * registerCount * registerCount / \
+            sum(2.0 ** -register for register in self.registers)
+
+        # Small range correction: linear counting while registers are empty.
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * registerCount and zeros:
+            estimate = registerCount * math.log(registerCount / zeros)
+
+        return int(round(estimate))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return a JSON serializable representation of the sketch.
+        """
+        return {
+            "Precision": self.precision,
+            "Registers": base64.b64encode(bytes(self.registers)).decode("ascii")
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HyperLogLog":
+        sketch = cls(precision=data["Precision"])
+        sketch.registers = bytearray(base64.b64decode(data["Registers"]))
+        return sketch
+
+
+class CardinalitySketch():
+    def __init__(self, precision: int = DEFAULT_PRECISION,
+                 value_precision: int = DEFAULT_VALUE_PRECISION):
+        """
+        Cardinality sketches of one group of metrics (an account or a namespace).
+
+        Tracks distinct metric names, distinct dimension sets and distinct
+        values per dimension key.
+        """
+        self.precision = precision
+        self.value_precision = value_precision
+        self.metricNames = HyperLogLog(precision)
+        self.dimensionSets = HyperLogLog(precision)
+        self.dimensionValues = defaultdict(lambda: HyperLogLog(self.value_precision))
+
+    def add(self, metric: Dict[str, Any]) -> None:
+        dimensions = sorted((dimension["Name"], dimension["Value"])
+                            for dimension in metric.get("Dimensions", []))
+        self.metricNames.add(metric["MetricName"])
+        self.dimensionSets.add("\x1e".join("%s\x1f%s" % pair for pair in dimensions))
+        for name, value in dimensions:
+            self.dimensionValues[name].add(value)
+
+    def merge(self, other: "CardinalitySketch") -> "CardinalitySketch":
+        self.metricNames.merge(other.metricNames)
+        self.dimensionSets.merge(other.dimensionSets)
+        for name, sketch in other.dimensionValues.items():
+            self.dimensionValues[name].merge(sketch)
+
+        return self
+
+    def estimates(self) -> Dict[str, Any]:
+        return {
+            "UniqueMetricNames": self.metricNames.count(),
+            "UniqueDimensionSets": self.dimensionSets.count(),
+            "UniqueDimensionValues": {name: sketch.count()
+                                      for name, sketch in sorted(self.dimensionValues.items())}
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "MetricNames": self.metricNames.to_dict(),
+            "DimensionSets": self.dimensionSets.to_dict(),
+            "DimensionValues": {name: sketch.to_dict()
+                                for name, sketch in self.dimensionValues.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CardinalitySketch":
+        metricNames = HyperLogLog.from_dict(data["MetricNames"])
+        dimensionValues = {name: HyperLogLog.from_dict(value)
+                           for name, value in data["DimensionValues"].items()}
+        valuePrecision = DEFAULT_VALUE_PRECISION
+        if dimensionValues:
+            valuePrecision = next(iter(dimensionValues.values())).precision
+
+        sketch = cls(precision=metricNames.precision, value_precision=valuePrecision)
+        sketch.metricNames = metricNames
+        sketch.dimensionSets = HyperLogLog.from_dict(data["DimensionSets"])
+        sketch.dimensionValues.update(dimensionValues)
+        return sketch
+
+
+class SketchSummary():
+    def __init__(self, precision: int = DEFAULT_PRECISION,
+                 value_precision: int = DEFAULT_VALUE_PRECISION):
+        """
+        Per account and per account/namespace cardinality sketches.
+
+        Args:
+            precision: HyperLogLog precision of the name and dimension set sketches
+            value_precision: HyperLogLog precision of the per dimension key sketches
+        """
+        self.precision = precision
+        self.value_precision = value_precision
+        self.accounts = {}
+        self.namespaces = {}
+
+    def _group(self, groups: Dict, key) -> CardinalitySketch:
+        sketch = groups.get(key)
+        if sketch is None:
+            sketch = CardinalitySketch(self.precision, self.value_precision)
+            groups[key] = sketch
+
+        return sketch
+
+    def add_page(self, metrics: List[Dict[str, Any]], owningAccounts: List[str]) -> None:
+        """
+        Fold one ListMetrics page into the sketches.
+        """
+        for metric, accountId in zip(metrics, owningAccounts):
+            self._group(self.accounts, accountId).add(metric)
+            self._group(self.namespaces, (accountId, metric["Namespace"])).add(metric)
+
+    def merge(self, other: "SketchSummary") -> "SketchSummary":
+        """
+        Merge the sketches of another summary into this one.
+
+        Returns:
+            This summary
+        """
+        for accountId, sketch in other.accounts.items():
+            self._group(self.accounts, accountId).merge(sketch)
+        for key, sketch in other.namespaces.items():
+            self._group(self.namespaces, key).merge(sketch)
+
+        return self
+
+    def estimates(self) -> Dict[str, Any]:
+        """
+        Return the estimated cardinalities per account and per namespace.
+        """
+        result = {}
+        for accountId, sketch in self.accounts.items():
+            result[accountId] = sketch.estimates()
+            result[accountId]["Namespaces"] = {}
+        for (accountId, namespace), sketch in self.namespaces.items():
+            result[accountId]["Namespaces"][namespace] = sketch.estimates()
+
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return a JSON serializable representation of all sketches.
+        """
+        return {
+            "Accounts": {accountId: sketch.to_dict()
+                         for accountId, sketch in self.accounts.items()},
+            "Namespaces": [[accountId, namespace, sketch.to_dict()]
+                           for (accountId, namespace), sketch in self.namespaces.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SketchSummary":
+        summary = cls()
+        for accountId, value in data["Accounts"].items():
+            summary.accounts[accountId] = CardinalitySketch.from_dict(value)
+        for accountId, namespace, value in data["Namespaces"]:
+            summary.namespaces[(accountId, namespace)] = CardinalitySketch.from_dict(value)
+        if summary.accounts:
+            sketch = next(iter(summary.accounts.values()))
+            summary.precision = sketch.precision
+            summary.value_precision = sketch.value_precision
+
+        return summary
+
+
+class SpaceSaving():
+    def __init__(self, capacity: int = 100):
+        """
+        Initialize a Space-Saving heavy hitter counter.
+
+        Args:
+            capacity: Number of counters kept. Items with a true count above
+                      total / capacity are guaranteed to be tracked.
+        """
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Min heap of (count, item). Entries go stale when a count grows,
+        # they are skipped when popped and the heap is rebuilt when large.
+        self._heap = []
+
+    def _rebuild(self):
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def add(self, item, weight: int = 1) -> None:
+        """
+        Count weight occurrences of item.
+        """
+        if item in self.counts:
+            self.counts[item] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = weight
+            self.errors[item] = 0
+        else:
+            # Replace the smallest counter; its count is the new item's error.
+            evicted, minCount = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[item] = minCount + weight
+            self.errors[item] = minCount
+
+        heapq.heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild()
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """
+        Merge another counter into this one, keeping the top capacity items.
+
+        Returns:
+            This counter
+        """
+        # An item missing from a full counter may have occurred up to that
+        # counter's minimum count, which bounds the error of the merge.
+        selfMin = min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+        otherMin = min(other.counts.values()) if len(other.counts) >= other.capacity else 0
+
+        counts = {}
+        errors = {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = self.counts.get(item, selfMin) + other.counts.get(item, otherMin)
+            errors[item] = self.errors.get(item, selfMin) + other.errors.get(item, otherMin)
+
+        top = heapq.nlargest(self.capacity, counts.items(), key=lambda entry: entry[1])
+        self.counts = dict(top)
+        self.errors = {item: errors[item] for item in self.counts}
+        self._rebuild()
+        return self
+
+    def top(self, n: int = 10) -> List[Any]:
+        """
+        Return up to n (item, count, error) tuples, largest count first.
+        """
+        top = heapq.nlargest(n, self.counts.items(), key=lambda entry: entry[1])
+        return [(item, count, self.errors[item]) for item, count in top]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "Capacity": self.capacity,
+            "Items": [[item, count, self.errors[item]] for item, count in self.counts.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SpaceSaving":
+        counter = cls(capacity=data["Capacity"])
+        for item, count, error in data["Items"]:
+            if isinstance(item, list):
+                item = tuple(item)
+            counter.counts[item] = count
+            counter.errors[item] = error
+        counter._rebuild()
+        return counter
+
+
+class HeavyHitters():
+    def __init__(self, top: int = 10, capacity: int = None,
+                 value_precision: int = DEFAULT_VALUE_PRECISION):
+        """
+        Fixed memory top-K report of what drives metric cardinality.
+
+        Tracks the metric names with the most series, the dimension keys
+        with the most distinct values and the largest namespaces per account.
+
+        Distinct values are estimated with a HyperLogLog per tracked
+        dimension key. A key that is evicted and tracked again restarts its
+        sketch, so its distinct value count can be underestimated.
+
+        Args:
+            top: Number of entries reported per list
+            capacity: Counters kept per list (default: 10 * top)
+            value_precision: HyperLogLog precision of the dimension value sketches
+        """
+        self.top = top
+        self.capacity = capacity or 10 * top
+        self.value_precision = value_precision
+        self.metricNames = SpaceSaving(self.capacity)
+        self.dimensionKeys = SpaceSaving(self.capacity)
+        self.dimensionValues = {}
+        self.namespaces = {}
+
+    def add_page(self, metrics: List[Dict[str, Any]], owningAccounts: List[str]) -> None:
+        """
+        Fold one ListMetrics page into the counters.
+        """
+        for metric, accountId in zip(metrics, owningAccounts):
+            self.metricNames.add((metric["Namespace"], metric["MetricName"]))
+
+            namespaces = self.namespaces.get(accountId)
+            if namespaces is None:
+                namespaces = SpaceSaving(self.capacity)
+                self.namespaces[accountId] = namespaces
+            namespaces.add(metric["Namespace"])
+
+            for dimension in metric.get("Dimensions", []):
+                self.dimensionKeys.add(dimension["Name"])
+                sketch = self.dimensionValues.get(dimension["Name"])
+                if sketch is None:
+                    sketch = HyperLogLog(self.value_precision)
+                    self.dimensionValues[dimension["Name"]] = sketch
+                sketch.add(dimension["Value"])
+
+            # Only keep value sketches of tracked keys.
+            if len(self.dimensionValues) > self.capacity:
+                for name in list(self.dimensionValues):
+                    if name not in self.dimensionKeys.counts:
+                        del self.dimensionValues[name]
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        """
+        Merge the counters of another report into this one.
+
+        Returns:
+            This report
+        """
+        self.metricNames.merge(other.metricNames)
+        self.dimensionKeys.merge(other.dimensionKeys)
+        for name, sketch in other.dimensionValues.items():
+            if name in self.dimensionValues:
+                self.dimensionValues[name].merge(sketch)
+            else:
+                self.dimensionValues[name] = HyperLogLog.from_dict(sketch.to_dict())
+        for name in list(self.dimensionValues):
+            if name not in self.dimensionKeys.counts:
+                del self.dimensionValues[name]
+        for accountId, counter in other.namespaces.items():
+            if accountId in self.namespaces:
+                self.namespaces[accountId].merge(counter)
+            else:
+                self.namespaces[accountId] = SpaceSaving.from_dict(counter.to_dict())
+
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "Top": self.top,
+            "Capacity": self.capacity,
+            "ValuePrecision": self.value_precision,
+            "MetricNames": self.metricNames.to_dict(),
+            "DimensionKeys": self.dimensionKeys.to_dict(),
+            "DimensionValues": {name: sketch.to_dict() for name, sketch in self.dimensionValues.items()},
+            "Namespaces": {accountId: counter.to_dict() for accountId, counter in self.namespaces.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HeavyHitters":
+        heavyHitters = cls(top=data["Top"], capacity=data["Capacity"],
+                           value_precision=data["ValuePrecision"])
+        heavyHitters.metricNames = SpaceSaving.from_dict(data["MetricNames"])
+        heavyHitters.dimensionKeys = SpaceSaving.from_dict(data["DimensionKeys"])
+        heavyHitters.dimensionValues = {name: HyperLogLog.from_dict(sketch)
+                                        for name, sketch in data["DimensionValues"].items()}
+        heavyHitters.namespaces = {accountId: SpaceSaving.from_dict(counter)
+                                   for accountId, counter in data["Namespaces"].items()}
+        return heavyHitters
+
+    def report(self, top: int = None) -> Dict[str, Any]:
+        """
+        Return the top entries of every list.
+        """
+        top = top or self.top
+        dimensionKeys = sorted(((name, sketch.count(), self.dimensionKeys.counts.get(name, 0))
+                                for name, sketch in self.dimensionValues.items()),
+                               key=lambda entry: entry[1], reverse=True)[:top]
+        return {
+            "TopMetricNames": [{"Namespace": namespace, "MetricName": name,
+                                "SeriesCount": count, "Error": error}
+                               for (namespace, name), count, error in self.metricNames.top(top)],
+            "TopDimensionKeys": [{"Name": name, "DistinctValues": distinct, "SeriesCount": series}
+                                 for name, distinct, series in dimensionKeys],
+            "TopNamespacesByAccount": {
+                accountId: [{"Namespace": namespace, "MetricCount": count, "Error": error}
+                            for namespace, count, error in counter.top(top)]
+                for accountId, counter in self.namespaces.items()
+            }
+        }
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Key/value stores used to persist state between runs of the metric
+usage monitor (inventory snapshots, scan checkpoints).
+
+Values are JSON serializable dictionaries. LocalFileStore keeps them on
+the local filesystem (tests, local runs, /tmp of a warm Lambda container),
+S3Store keeps them in an S3 bucket so they survive cold starts.
+"""
+
+import json
+import os
+import tempfile
+from typing import Dict, Optional, Any
+
+import botocore.session
+from botocore.config import Config
+
+
+class MetricStore():
+    """
+    Interface of a store. Keys are "/" separated strings.
+    """
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the value stored under key, or None if there is none.
+        """
+        raise NotImplementedError
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        Store value under key, replacing any previous value.
+        """
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """
+        Remove key from the store. Missing keys are ignored.
+        """
+        raise NotImplementedError
+
+
+class LocalFileStore(MetricStore):
+    def __init__(self, basePath: str):
+        """
+        Initialize a store that keeps one JSON file per key under basePath.
+
+        Args:
+            basePath: Directory holding the files. Created if missing.
+        """
+        self.basePath = basePath
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.basePath, *key.split("/")) + ".json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "r") as fHandle:
+                return json.load(fHandle)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        path = self._path(key)
+        dirName = os.path.dirname(path)
+        os.makedirs(dirName, exist_ok=True)
+
+        # Write to a temporary file first so a reader never sees a
+        # partially written value.
+        fd, tmpPath = tempfile.mkstemp(dir=dirName, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fHandle:
+                json.dump(value, fHandle, separators=(",", ":"))
+            os.replace(tmpPath, path)
+        except Exception:
+            os.unlink(tmpPath)
+            raise
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3Store(MetricStore):
+    def __init__(self, bucket: str, prefix: str = "", region: str = "us-east-1", client=None):
+        """
+        Initialize a store that keeps one JSON object per key in an S3 bucket.
+
+        Args:
+            bucket: Bucket name
+            prefix: Key prefix for all objects
+            region: AWS region of the bucket
+            client: Pre-built S3 client
+        """
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        if client is None:
+            # A botocore client, as for CloudWatch: boto3 is not needed.
+            config = Config(retries={"mode": "standard"}, connect_timeout=5, read_timeout=30)
+            client = botocore.session.Session().create_client("s3", region_name=region, config=config)
+        self.client = client
+
+    def _objectKey(self, key: str) -> str:
+        if self.prefix:
+            return "%s/%s.json" % (self.prefix, key)
+        return "%s.json" % key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._objectKey(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+        return json.loads(response["Body"].read())
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        self.client.put_object(Bucket=self.bucket,
+                               Key=self._objectKey(key),
+                               Body=json.dumps(value, separators=(",", ":")).encode("utf-8"),
+                               ContentType="application/json")
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._objectKey(key))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cold import benchmark of the Lambda handler module.
+
+Imports app.py in fresh interpreters, the way a cold Lambda container
+does, and reports the import time measured by python -X importtime and
+the slowest modules it pulls in. Run from the project directory:
+
+    python -m tests.benchmark.benchmark_cold_import --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CODE_DIR = os.path.join(PROJECT_DIR, "code")
+
+
+def import_once(module, prewarm):
+    """
+    Import module in a new interpreter.
+
+    Returns:
+        (wall milliseconds, {module name: cumulative import microseconds},
+         [direct imports of module])
+    """
+    env = dict(os.environ)
+    env.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+    if prewarm:
+        # Take the Lambda init path, which also creates the clients.
+        env["AWS_LAMBDA_FUNCTION_NAME"] = "benchmark"
+        env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                             cwd=CODE_DIR, env=env, capture_output=True, text=True, check=True)
+    wallMs = (time.perf_counter() - start) * 1000.0
+
+    cumulative = {}
+    children = []
+    # Lines look like "import time:  self [us] | cumulative | <indent>name".
+    # A module's own line comes after the lines of the modules it imports.
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulativeUs, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        cumulative[name] = int(cumulativeUs)
+        if depth == 1:
+            children.append(name)
+        elif depth == 0 and name != module:
+            children = []
+
+    return wallMs, cumulative, children
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters to import in")
+    parser.add_argument("--module", default="app", help="module to import")
+    parser.add_argument("--prewarm", action="store_true",
+                        help="take the Lambda init path, which also creates the CloudWatch clients")
+    parser.add_argument("--top", type=int, default=10, help="slowest direct imports to show")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    runs = [import_once(args.module, args.prewarm) for _ in range(args.runs)]
+    importMs = [cumulative[args.module] / 1000.0 for _, cumulative, _ in runs]
+    wallMs = [wall for wall, _, _ in runs]
+
+    # Per module figures of the run with the median import time.
+    medianRun = sorted(runs, key=lambda run: run[1][args.module])[len(runs) // 2]
+    slowest = sorted(((name, medianRun[1][name] / 1000.0) for name in medianRun[2]),
+                     key=lambda entry: entry[1], reverse=True)[:args.top]
+
+    result = {
+        "Module": args.module,
+        "Runs": args.runs,
+        "Prewarm": args.prewarm,
+        "ImportMsMedian": round(statistics.median(importMs), 1),
+        "ImportMsMin": round(min(importMs), 1),
+        "ImportMsMax": round(max(importMs), 1),
+        "WallMsMedian": round(statistics.median(wallMs), 1),
+        "SlowestImports": [{"Module": name, "Ms": round(ms, 1)} for name, ms in slowest]
+    }
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print("%s: import median %.1f ms (min %.1f, max %.1f), process wall median %.1f ms, %d runs" %
+          (args.module, result["ImportMsMedian"], result["ImportMsMin"], result["ImportMsMax"],
+           result["WallMsMedian"], args.runs))
+    for entry in result["SlowestImports"]:
+        print("  %8.1f ms  %s" % (entry["Ms"], entry["Module"]))
+
+
+if __name__ == "__main__":
+    main()
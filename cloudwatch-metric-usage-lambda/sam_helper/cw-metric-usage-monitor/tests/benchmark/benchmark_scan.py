@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Offline throughput and memory benchmark of the metric usage monitor.
+
+Every scenario runs in its own process against SyntheticCloudWatchClient,
+so peak RSS is measured per scenario. Run from the project directory:
+
+    python -m tests.benchmark.benchmark_scan --metrics 1000000 --latency-ms 20
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from unittest import mock
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "code"))
+sys.path.insert(0, PROJECT_DIR)
+
+import app  # noqa: E402
+import cw_metric_distributed  # noqa: E402
+import cw_metric_helper  # noqa: E402
+import cw_metric_index  # noqa: E402
+import cw_metric_inventory  # noqa: E402
+import cw_metric_ratelimit  # noqa: E402
+from tests.unit.fake_cloudwatch import SyntheticCloudWatchClient  # noqa: E402
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def run_list_metrics(client, args):
+    cw_metric_helper.CloudWatch(client=client).list_metrics(include_metrics=True)
+
+
+def run_summary_only(client, args):
+    cw_metric_helper.CloudWatch(client=client).list_metrics(include_metrics=False)
+
+
+def run_sketches(client, args):
+    cw_metric_helper.CloudWatch(client=client).list_metrics(include_metrics=False, sketches=True)
+
+
+def run_sharded(client, args):
+    cw_metric_helper.CloudWatch(client=client).list_metrics_sharded(
+        account_ids=client.accounts, max_workers=args.workers)
+
+
+def synthetic_worker(clientArgs, request):
+    cwHelper = cw_metric_helper.CloudWatch(client=SyntheticCloudWatchClient(**clientArgs),
+                                           region=request["region"], limiters={})
+    return cw_metric_distributed.run_shard(cwHelper, request)
+
+
+def run_distributed(client, args):
+    executor = cw_metric_distributed.LocalExecutor(
+        max_workers=args.workers, worker=functools.partial(synthetic_worker, client.args))
+    cw_metric_distributed.coordinate(cw_metric_helper.CloudWatch(client=client), executor,
+                                     account_ids=client.accounts)
+
+
+def run_inventory(client, args):
+    cw_metric_inventory.MetricInventory.scan(cw_metric_helper.CloudWatch(client=client))
+
+
+def run_index(client, args):
+    cw_metric_index.MetricIndex.scan(cw_metric_helper.CloudWatch(client=client)).close()
+
+
+def run_handler(client, args, publisher):
+    with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session, \
+            open(os.devnull, "w") as devNull, mock.patch("sys.stdout", devNull):
+        session.return_value.create_client.return_value = client
+        app.lambda_handler({"publisher": publisher}, None)
+
+
+SCENARIOS = {
+    "list_metrics": run_list_metrics,
+    "summary_only": run_summary_only,
+    "sketches": run_sketches,
+    "sharded": run_sharded,
+    "distributed": run_distributed,
+    "inventory": run_inventory,
+    "index": run_index,
+    "handler_api": lambda client, args: run_handler(client, args, "api"),
+    "handler_emf": lambda client, args: run_handler(client, args, "emf"),
+}
+
+
+def run_scenario(name, args, queue):
+    if not args.rate_limit:
+        # Measure the scan itself, not the CloudWatch TPS quotas.
+        cw_metric_ratelimit.DEFAULT_QUOTAS = {operation: 1000000
+                                              for operation in cw_metric_ratelimit.DEFAULT_QUOTAS}
+    clientArgs = dict(metric_count=args.metrics,
+                      account_count=args.accounts,
+                      namespace_count=args.namespaces,
+                      namespace_skew=args.skew,
+                      dimension_fanout=args.fanout,
+                      latency=args.latency_ms / 1000.0,
+                      page_size=args.page_size)
+    client = SyntheticCloudWatchClient(**clientArgs)
+    # Worker processes build their own client from the same arguments.
+    client.args = clientArgs
+    baseRss = peak_rss_mb()
+    start = time.perf_counter()
+    SCENARIOS[name](client, args)
+    elapsed = time.perf_counter() - start
+
+    queue.put({
+        "Scenario": name,
+        "Seconds": round(elapsed, 3),
+        "Pages": client.list_calls,
+        "PagesPerSec": round(client.list_calls / elapsed, 1),
+        "MetricsPerSec": round(args.metrics / elapsed, 1),
+        "PeakRssMB": round(peak_rss_mb(), 1),
+        "BaseRssMB": round(baseRss, 1),
+        "PutMetricDataCalls": len(client.put_calls)
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--metrics", type=int, default=200000, help="number of metrics")
+    parser.add_argument("--accounts", type=int, default=20, help="number of owning accounts")
+    parser.add_argument("--namespaces", type=int, default=30, help="number of namespaces")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf skew of namespace sizes")
+    parser.add_argument("--fanout", type=int, default=2, help="dimensions per metric")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency per API call")
+    parser.add_argument("--page-size", type=int, default=500, help="metrics per ListMetrics page")
+    parser.add_argument("--workers", type=int, default=8, help="workers of the sharded scan")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="pace API calls at the real CloudWatch TPS quotas")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated scenarios (%s)" % ", ".join(SCENARIOS))
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.scenarios.split(","):
+        if name not in SCENARIOS:
+            parser.error("unknown scenario %s" % name)
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_scenario, args=(name, args, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+
+    columns = ["Scenario", "Seconds", "Pages", "PagesPerSec", "MetricsPerSec",
+               "PeakRssMB", "PutMetricDataCalls"]
+    print("  ".join("%14s" % column for column in columns))
+    for result in results:
+        print("  ".join("%14s" % result[column] for column in columns))
+
+
+if __name__ == "__main__":
+    main()
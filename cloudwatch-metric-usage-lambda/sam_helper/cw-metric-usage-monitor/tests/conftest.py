@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# The Lambda code imports its sibling modules by plain name
+# (e.g. "import cw_metric_helper"), as it does in the deployed package.
+CODE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code")
+if CODE_DIR not in sys.path:
+    sys.path.insert(0, CODE_DIR)
+
+import pytest  # noqa: E402
+
+import cw_metric_helper  # noqa: E402
+import cw_metric_ratelimit  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiters(monkeypatch):
+    """
+    Give every test its own shared limiters, with quotas high enough that
+    the local stand-ins are not paced at the real CloudWatch TPS.
+    """
+    monkeypatch.setattr(cw_metric_ratelimit, "_limiters", {})
+    monkeypatch.setattr(cw_metric_ratelimit, "DEFAULT_QUOTAS",
+                        {operation: 100000 for operation in cw_metric_ratelimit.DEFAULT_QUOTAS})
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients(monkeypatch):
+    """
+    Do not let the per-process clients (and patched sessions) of one test
+    leak into the next.
+    """
+    monkeypatch.setattr(cw_metric_helper, "_sessions", {})
+    monkeypatch.setattr(cw_metric_helper, "_clients", {})
+    monkeypatch.setattr(cw_metric_helper, "_identities", {})
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for the boto3 CloudWatch client, so the helper can be
+tested without an AWS account.
+"""
+
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+class FakeCloudWatchClient():
+    def __init__(self, metrics=None, page_size=500, fail_put_calls=None,
+                 recently_active=None, throttle_calls=None, error_calls=None,
+                 arn="arn:aws:iam::111111111111:role/monitor"):
+        """
+        Args:
+            metrics: List of (accountId, metric dict) tuples served by list_metrics
+            recently_active: Subset of metrics served when RecentlyActive is set
+                             (default: all metrics)
+            page_size: Number of metrics returned per list_metrics page
+            fail_put_calls: Set of put_metric_data call indexes (0 based) that raise
+            throttle_calls: Set of call indexes (0 based, all operations) answered
+                            with a Throttling error
+            error_calls: Call index (0 based, all operations) -> error code
+                         answered with a 500 error, e.g. InternalFailure
+            arn: Caller ARN returned by get_caller_identity, when the
+                 client stands in for STS too
+        """
+        self.metrics = metrics or []
+        self.page_size = page_size
+        self.fail_put_calls = fail_put_calls or set()
+        self.recently_active = recently_active
+        self.throttle_calls = throttle_calls or set()
+        self.error_calls = error_calls or {}
+        self.arn = arn
+        self.list_calls = 0
+        self.put_calls = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _maybe_throttle(self, operation):
+        with self._lock:
+            callIndex = self.calls
+            self.calls += 1
+        if callIndex in self.throttle_calls:
+            raise ClientError({"Error": {"Code": "Throttling", "Message": "Rate exceeded"}},
+                              operation)
+        if callIndex in self.error_calls:
+            raise ClientError({"Error": {"Code": self.error_calls[callIndex], "Message": "Injected"},
+                               "ResponseMetadata": {"HTTPStatusCode": 500}}, operation)
+
+    def _select(self, kwargs):
+        """
+        Apply the OwningAccount and Namespace filters of a ListMetrics call.
+        """
+        metrics = self.metrics
+        if kwargs.get("RecentlyActive") and self.recently_active is not None:
+            metrics = self.recently_active
+
+        owningAccount = kwargs.get("OwningAccount")
+        namespace = kwargs.get("Namespace")
+        if owningAccount is None and namespace is None:
+            return metrics
+
+        return [(accountId, metric) for accountId, metric in metrics
+                if (owningAccount is None or accountId == owningAccount) and
+                (namespace is None or metric["Namespace"] == namespace)]
+
+    def get_caller_identity(self):
+        return {"Account": self.arn.split(":")[4], "Arn": self.arn}
+
+    def list_metrics(self, **kwargs):
+        self._maybe_throttle("ListMetrics")
+        with self._lock:
+            self.list_calls += 1
+        metrics = self._select(kwargs)
+        start = int(kwargs.get("NextToken", 0))
+        page = metrics[start:start + self.page_size]
+        data = {
+            "Metrics": [dict(metric) for _, metric in page],
+            "OwningAccounts": [accountId for accountId, _ in page]
+        }
+        if start + self.page_size < len(metrics):
+            data["NextToken"] = str(start + self.page_size)
+
+        return data
+
+    def put_metric_data(self, Namespace, MetricData):
+        self._maybe_throttle("PutMetricData")
+        with self._lock:
+            callIndex = len(self.put_calls)
+            self.put_calls.append({"Namespace": Namespace, "MetricData": MetricData})
+        if callIndex in self.fail_put_calls:
+            raise ClientError({"Error": {"Code": "InvalidParameterValue",
+                                         "Message": "The value for MetricData is invalid"}},
+                              "PutMetricData")
+
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def make_metrics(count, accounts=("111111111111", "222222222222"),
+                 namespaces=("AWS/EC2", "Custom/App")):
+    """
+    Build a deterministic list of (accountId, metric) tuples.
+    """
+    metrics = []
+    for idx in range(count):
+        metric = {
+            "Namespace": namespaces[idx % len(namespaces)],
+            "MetricName": "metric-%d" % (idx % 7),
+            "Dimensions": [{"Name": "InstanceId", "Value": "i-%08d" % idx}]
+        }
+        metrics.append((accounts[idx % len(accounts)], metric))
+
+    return metrics
+
+
+class SyntheticCloudWatchClient(FakeCloudWatchClient):
+    def __init__(self, metric_count=100000, account_count=10, namespace_count=20,
+                 namespace_skew=1.0, metric_names=50, dimension_fanout=2,
+                 latency=0.0, page_size=500, active_every=1, fail_put_calls=None):
+        """
+        CloudWatch stand-in serving a generated inventory.
+
+        Metrics are built from their index on demand, so the stand-in uses no
+        memory per metric and does not distort memory measurements.
+
+        Args:
+            metric_count: Total number of metrics
+            account_count: Number of owning accounts, assigned round robin
+            namespace_count: Number of namespaces
+            namespace_skew: Zipf exponent of the namespace sizes (0: uniform)
+            metric_names: Number of distinct metric names per namespace
+            dimension_fanout: Number of dimensions per metric
+            latency: Seconds slept per API call
+            page_size: Number of metrics returned per list_metrics page
+            active_every: Every Nth metric is returned when RecentlyActive is set
+            fail_put_calls: Set of put_metric_data call indexes (0 based) that raise
+        """
+        super().__init__(page_size=page_size, fail_put_calls=fail_put_calls)
+        self.metric_count = metric_count
+        self.account_count = account_count
+        self.metric_names = metric_names
+        self.dimension_fanout = dimension_fanout
+        self.latency = latency
+        self.active_every = active_every
+        self.accounts = ["%012d" % (100000000000 + idx) for idx in range(account_count)]
+        self.namespaces = ["Namespace%02d" % idx for idx in range(namespace_count)]
+
+        # Namespaces own contiguous index ranges sized by their Zipf weight.
+        weights = [1.0 / (idx + 1) ** namespace_skew for idx in range(namespace_count)]
+        total = sum(weights)
+        self.namespace_bounds = {}
+        start = 0
+        for idx, namespace in enumerate(self.namespaces):
+            end = metric_count if idx == namespace_count - 1 else \
+                min(metric_count, start + int(round(metric_count * weights[idx] / total)))
+            self.namespace_bounds[namespace] = (start, end)
+            start = end
+
+    def namespace_of(self, index):
+        for namespace, (start, end) in self.namespace_bounds.items():
+            if start <= index < end:
+                return namespace
+
+    def metric(self, index):
+        """
+        Return the (accountId, metric dict) of a metric index.
+        """
+        nameIdx = index % self.metric_names
+        resource = index // self.metric_names
+        dimensions = [{"Name": "Dim%d" % dimIdx, "Value": "r%d-%d" % (dimIdx, resource >> dimIdx)}
+                      for dimIdx in range(self.dimension_fanout)]
+        metric = {
+            "Namespace": self.namespace_of(index),
+            "MetricName": "Metric%03d" % nameIdx,
+            "Dimensions": dimensions
+        }
+        return self.accounts[index % self.account_count], metric
+
+    def _indexes(self, kwargs, start):
+        low, high = 0, self.metric_count
+        if kwargs.get("Namespace") is not None:
+            low, high = self.namespace_bounds.get(kwargs["Namespace"], (0, 0))
+        low = max(low, start)
+
+        step = 1
+        if kwargs.get("OwningAccount") is not None:
+            if kwargs["OwningAccount"] not in self.accounts:
+                return range(0)
+            accountIdx = self.accounts.index(kwargs["OwningAccount"])
+            step = self.account_count
+            low += (accountIdx - low) % step
+
+        if kwargs.get("RecentlyActive") and self.active_every > 1:
+            return (idx for idx in range(low, high, step) if idx % self.active_every == 0)
+
+        return range(low, high, step)
+
+    def list_metrics(self, **kwargs):
+        self._maybe_throttle("ListMetrics")
+        with self._lock:
+            self.list_calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        page = []
+        nextIndex = None
+        for index in self._indexes(kwargs, int(kwargs.get("NextToken", 0))):
+            if len(page) == self.page_size:
+                nextIndex = index
+                break
+            page.append(self.metric(index))
+
+        data = {
+            "Metrics": [metric for _, metric in page],
+            "OwningAccounts": [accountId for accountId, _ in page]
+        }
+        if nextIndex is not None:
+            data["NextToken"] = str(nextIndex)
+
+        return data
+
+    def put_metric_data(self, Namespace, MetricData):
+        if self.latency:
+            time.sleep(self.latency)
+
+        return super().put_metric_data(Namespace, MetricData)
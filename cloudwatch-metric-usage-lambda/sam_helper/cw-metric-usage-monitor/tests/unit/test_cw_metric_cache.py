@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+import cw_metric_cache
+import cw_metric_helper
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestScanCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.client = FakeCloudWatchClient(metrics=make_metrics(500), page_size=100)
+        self.cwHelper = cw_metric_helper.CloudWatch(client=self.client, identity=self.client.arn)
+
+    def test_hit_within_ttl(self):
+        cache = cw_metric_cache.ScanCache(ttl=60, clock=self.clock)
+
+        first = self.cwHelper.list_metrics(include_metrics=False, cache=cache)
+        second = self.cwHelper.list_metrics(include_metrics=False, cache=cache)
+        self.assertIs(first, second)
+        self.assertEqual(self.client.list_calls, 5)
+
+        # Other options or filters are separate entries.
+        self.cwHelper.list_metrics(include_metrics=False, sketches=True, cache=cache)
+        self.cwHelper.list_metrics(include_metrics=False, cache=cache, OwningAccount="111111111111")
+        self.assertEqual(cache.stats(), {"Hits": 1, "Misses": 3, "Entries": 3})
+
+        self.clock.now += 61
+        self.cwHelper.list_metrics(include_metrics=False, cache=cache)
+        self.assertEqual(self.client.list_calls, 18)
+
+    def test_lru_eviction(self):
+        cache = cw_metric_cache.ScanCache(ttl=60, max_entries=2, clock=self.clock)
+        for key in ("a", "b"):
+            cache.put(key, {"Summary": {}})
+        cache.get("a")
+        cache.put("c", {"Summary": {}})
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+
+    def test_file_tier_shared_between_caches(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            writer = cw_metric_cache.ScanCache(ttl=60, path=tmpDir, clock=self.clock)
+            expected = self.cwHelper.list_metrics(include_metrics=False, sketches=True, cache=writer)
+
+            reader = cw_metric_cache.ScanCache(ttl=60, path=tmpDir, clock=self.clock)
+            result = self.cwHelper.list_metrics(include_metrics=False, sketches=True, cache=reader)
+            self.assertEqual(result["Summary"], expected["Summary"])
+            self.assertEqual(result["Sketches"].estimates(), expected["Sketches"].estimates())
+            self.assertEqual(self.client.list_calls, 5)
+
+            self.clock.now += 61
+            self.assertIsNone(cw_metric_cache.ScanCache(ttl=60, path=tmpDir, clock=self.clock).get(
+                cw_metric_cache.ScanCache.key(self.cwHelper.identity(), "us-east-1", {}, {})))
+
+    def test_profiles_do_not_share_entries(self):
+        cache = cw_metric_cache.ScanCache(ttl=60, clock=self.clock)
+        clients = {"prod": FakeCloudWatchClient(metrics=make_metrics(300), arn="arn:aws:iam::111111111111:role/a"),
+                   "dev": FakeCloudWatchClient(metrics=make_metrics(40), arn="arn:aws:iam::222222222222:role/a")}
+
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session:
+            session.side_effect = lambda profile: mock.Mock(**{"create_client.return_value": clients[profile]})
+            totals = {profile: cw_metric_helper.CloudWatch(profileName=profile).list_metrics(
+                include_metrics=False, cache=cache)["Summary"]["TotalMetricCount"]
+                for profile in ("prod", "dev", "prod", "dev")}
+
+        self.assertEqual(totals, {"prod": 300, "dev": 40})
+        self.assertEqual([client.list_calls for client in clients.values()], [1, 1])
+        self.assertEqual(cache.stats(), {"Hits": 2, "Misses": 2, "Entries": 2})
+
+    def test_sharded_scan_caches_per_shard(self):
+        cache = cw_metric_cache.ScanCache(ttl=60, clock=self.clock)
+        accounts = ["111111111111", "222222222222"]
+        self.cwHelper.list_metrics_sharded(account_ids=accounts, cache=cache)
+        calls = self.client.list_calls
+        result = self.cwHelper.list_metrics_sharded(account_ids=accounts[:1], cache=cache)
+
+        self.assertEqual(self.client.list_calls, calls)
+        self.assertEqual(result["Summary"]["TotalMetricCount"], 250)
+
+
+class TestHandlerReuse(unittest.TestCase):
+    def test_client_and_cache_reused_across_invocations(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(100))
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session, \
+                mock.patch.dict(os.environ, {"SCAN_CACHE_TTL": "60"}), \
+                mock.patch.object(app, "_scanCache", None), \
+                mock.patch("sys.stdout"):
+            session.return_value.create_client.return_value = client
+            for _ in range(3):
+                app.lambda_handler({"instrumentation": False}, None)
+
+        self.assertEqual(session.call_count, 1)
+        self.assertEqual(client.list_calls, 1)
+        self.assertEqual(len(client.put_calls), 3)
+
+    def test_startup_profile_logged_once(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(10))
+        stream = io.StringIO()
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session, \
+                mock.patch.dict(os.environ, {"STARTUP_PROFILE": "true"}), \
+                mock.patch.object(app, "_startup", {"ImportSeconds": 0.2}), \
+                mock.patch("sys.stdout", stream):
+            session.return_value.create_client.return_value = client
+            for _ in range(2):
+                app.lambda_handler({"instrumentation": False}, None)
+
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([record for record in records if record["Event"] == "Startup"],
+                         [{"Event": "Startup", "ImportSeconds": 0.2}])
+
+    def test_optional_modules_not_imported(self):
+        # The default scan path must not pay for pyarrow, sqlite3 or multiprocessing,
+        # and the modules of optional features load when used.
+        code = ("import sys, app; "
+                "print(sorted(name for name in ('pyarrow', 'sqlite3', 'multiprocessing', 'boto3', "
+                "'cw_metric_cache', 'cw_metric_cost', 'cw_metric_inventory', 'cw_metric_publisher', "
+                "'cw_metric_store') if name in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(app.__file__),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
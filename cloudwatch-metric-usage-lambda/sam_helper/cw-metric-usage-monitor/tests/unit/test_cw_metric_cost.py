@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+import cw_metric_cost
+import cw_metric_helper
+import cw_metric_inventory
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+class TestCostEstimate(unittest.TestCase):
+    def test_tiered_cost(self):
+        tiers = cw_metric_cost.DEFAULT_PRICE_TABLE["CustomMetricTiers"]
+        self.assertEqual(cw_metric_cost.tiered_cost(0, tiers), 0)
+        self.assertAlmostEqual(cw_metric_cost.tiered_cost(100, tiers), 30.0)
+        self.assertAlmostEqual(cw_metric_cost.tiered_cost(10000, tiers), 3000.0)
+        self.assertAlmostEqual(cw_metric_cost.tiered_cost(20000, tiers), 4000.0)
+        self.assertAlmostEqual(cw_metric_cost.tiered_cost(1000010, tiers),
+                               3000.0 + 24000.0 + 37500.0 + 0.2)
+
+    def test_estimate_splits_vended_and_custom(self):
+        counts = {
+            "111111111111": {"AWS/EC2": 500, "Custom/App": 15000, "Custom/Web": 5000},
+            "222222222222": {"AWS/Lambda": 10}
+        }
+        estimate = cw_metric_cost.estimate_costs(counts)
+
+        account = estimate["Accounts"]["111111111111"]
+        self.assertEqual(account["CustomMetricCount"], 20000)
+        self.assertEqual(account["VendedMetricCount"], 500)
+        self.assertEqual(account["MonthlyCost"], 4000.0)
+        self.assertEqual(account["Namespaces"]["Custom/App"]["MonthlyCost"], 3000.0)
+        self.assertEqual(account["Namespaces"]["Custom/Web"]["MonthlyCost"], 1000.0)
+        self.assertEqual(account["Namespaces"]["AWS/EC2"]["MonthlyCost"], 0.0)
+        self.assertEqual(estimate["Accounts"]["222222222222"]["MonthlyCost"], 0.0)
+        self.assertEqual(estimate["TotalMonthlyCost"], 4000.0)
+
+    def test_inventory_counts_match_summary(self):
+        cwHelper = cw_metric_helper.CloudWatch(client=FakeCloudWatchClient(metrics=make_metrics(300)))
+        inventory = cw_metric_inventory.MetricInventory.scan(cwHelper)
+
+        self.assertEqual(cw_metric_cost.counts_from_inventory(inventory),
+                         cw_metric_cost.counts_from_summary(inventory.summary()))
+
+    def test_price_table_file(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, "prices.json")
+            with open(path, "w") as priceFile:
+                json.dump({"CustomMetricTiers": [{"UpTo": None, "PricePerMetric": 0.5}]}, priceFile)
+            priceTable = cw_metric_cost.load_price_table(path)
+
+        self.assertEqual(priceTable["Currency"], "USD")
+        estimate = cw_metric_cost.estimate_costs({"1": {"Custom/App": 10}}, priceTable)
+        self.assertEqual(estimate["TotalMonthlyCost"], 5.0)
+
+    def test_handler_publishes_costs(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(100))
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session, \
+                mock.patch("sys.stdout"):
+            session.return_value.create_client.return_value = client
+            ret = app.lambda_handler({"costs": True, "instrumentation": False}, None)
+
+        costs = json.loads(ret["body"])["costs"]["us-east-1"]
+        # make_metrics puts AWS/EC2 in the first account, Custom/App in the second.
+        self.assertEqual(costs["Accounts"]["111111111111"]["MonthlyCost"], 0.0)
+        self.assertEqual(costs["Accounts"]["222222222222"]["MonthlyCost"], 15.0)
+        names = [datum["MetricName"] for datum in client.put_calls[0]["MetricData"]]
+        self.assertEqual(names.count("EstimatedMonthlyCost"), 2)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import io
+import json
+import unittest
+from unittest import mock
+
+import app
+import cw_metric_distributed
+import cw_metric_helper
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+METRICS = make_metrics(1000)
+
+
+def fake_worker(request):
+    # Runs in a worker process, with its own client.
+    cwHelper = cw_metric_helper.CloudWatch(client=FakeCloudWatchClient(metrics=METRICS, page_size=100),
+                                           region=request["region"], limiters={})
+    return cw_metric_distributed.run_shard(cwHelper, request)
+
+
+class InlineExecutor(cw_metric_distributed.ShardExecutor):
+    def map(self, requests):
+        return [fake_worker(request) for request in requests]
+
+
+class FakeOamClient():
+    def __init__(self, monitoringAccount, sourceAccounts):
+        self.sinkArn = "arn:aws:oam:us-east-1:%s:sink/sink-id" % monitoringAccount
+        self.linkArns = ["arn:aws:oam:us-east-1:%s:link/link-%d" % (accountId, index)
+                         for index, accountId in enumerate(sourceAccounts)]
+
+    def list_sinks(self, **kwargs):
+        return {"Items": [{"Arn": self.sinkArn}]}
+
+    def list_attached_links(self, SinkIdentifier, NextToken=None):
+        # One link per page.
+        index = int(NextToken or 0)
+        page = {"Items": [{"LinkArn": self.linkArns[index]}] if self.linkArns else []}
+        if index + 1 < len(self.linkArns):
+            page["NextToken"] = str(index + 1)
+        return page
+
+
+class TestDistributedScan(unittest.TestCase):
+    def setUp(self):
+        self.cwHelper = cw_metric_helper.CloudWatch(
+            client=FakeCloudWatchClient(metrics=METRICS, page_size=100))
+        self.expected = self.cwHelper.list_metrics(include_metrics=False)["Summary"]
+
+    def test_local_executor_matches_serial_scan(self):
+        executor = cw_metric_distributed.LocalExecutor(max_workers=2, worker=fake_worker)
+        result = cw_metric_distributed.coordinate(self.cwHelper, executor,
+                                                  account_ids=["111111111111", "222222222222"],
+                                                  namespaces=["AWS/EC2", "Custom/App"])
+
+        # Two namespace shards and a catch-all shard per account.
+        self.assertEqual(result["ShardCount"], 6)
+        self.assertEqual(result["Summary"], self.expected)
+
+    def test_discovers_accounts(self):
+        oamClient = FakeOamClient("111111111111", ["222222222222"])
+        result = cw_metric_distributed.coordinate(self.cwHelper, InlineExecutor(), sketches=True,
+                                                  oam_client=oamClient)
+
+        self.assertEqual(result["ShardCount"], 2)
+        self.assertEqual(result["PageCount"], 10)
+        self.assertEqual(result["Summary"]["TotalMetricCount"], 1000)
+        self.assertAlmostEqual(result["Sketches"].estimates()["111111111111"]["UniqueMetricNames"],
+                               7, delta=1)
+
+    def test_discover_accounts_pages_links(self):
+        oamClient = FakeOamClient("111111111111", ["333333333333", "222222222222"])
+        self.assertEqual(cw_metric_distributed.discover_accounts("us-east-1", client=oamClient),
+                         ["111111111111", "222222222222", "333333333333"])
+
+        oamClient.sinkArn = None
+        oamClient.list_sinks = lambda **kwargs: {"Items": []}
+        self.assertRaises(ValueError, cw_metric_distributed.discover_accounts, "us-east-1",
+                          client=oamClient)
+
+    def test_merge_is_associative(self):
+        requests = [{"region": "us-east-1", "shard": {"OwningAccount": accountId}, "sketches": True}
+                    for accountId in ("111111111111", "222222222222")]
+        requests.append({"region": "us-east-1", "shard": {"Namespace": "Missing"}, "sketches": True})
+        a, b, c = [fake_worker(request) for request in requests]
+        merge = cw_metric_distributed.merge_partials
+
+        left = merge([merge([a, b]), c])
+        right = merge([a, merge([b, c])])
+        self.assertEqual(left, right)
+        self.assertEqual(merge([left, cw_metric_distributed.new_partial()]), left)
+        # Partials survive a JSON round trip, e.g. through a Lambda response.
+        self.assertEqual(merge([json.loads(json.dumps(partial)) for partial in (a, b, c)]), left)
+
+    def test_lambda_executor(self):
+        partial = fake_worker({"region": "us-east-1", "shard": {}})
+        client = mock.Mock()
+        client.invoke.return_value = {"Payload": io.BytesIO(json.dumps(partial).encode())}
+        executor = cw_metric_distributed.LambdaExecutor("monitor", client=client)
+
+        self.assertEqual(executor.map([{"region": "us-east-1", "shard": {}}]), [partial])
+        payload = json.loads(client.invoke.call_args[1]["Payload"])
+        self.assertEqual(payload["mode"], "worker")
+
+        client.invoke.return_value = {"FunctionError": "Unhandled",
+                                      "Payload": io.BytesIO(b'{"errorMessage": "boom"}')}
+        with self.assertRaisesRegex(RuntimeError, "boom"):
+            executor.map([{"region": "us-east-1", "shard": {}}])
+
+    def test_handler_worker_mode(self):
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session:
+            session.return_value.create_client.return_value = FakeCloudWatchClient(metrics=METRICS)
+            partial = app.lambda_handler({"mode": "worker", "region": "us-east-1",
+                                          "shard": {"OwningAccount": "111111111111"}}, None)
+
+        self.assertEqual(partial["Summary"]["TotalMetricCount"], 500)
+        self.assertEqual(partial["ShardCount"], 1)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+import cw_metric_export
+import cw_metric_helper
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+if cw_metric_export.pyarrow is not None:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+
+@unittest.skipIf(cw_metric_export.pyarrow is None, "pyarrow is not installed")
+class TestInventoryExport(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.metrics = make_metrics(250)
+        self.cwHelper = cw_metric_helper.CloudWatch(
+            client=FakeCloudWatchClient(metrics=self.metrics, page_size=100))
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_parquet_row_groups_span_pages(self):
+        path = os.path.join(self.tmpDir.name, "metrics.parquet")
+        result = cw_metric_export.export_scan(self.cwHelper, path, row_group_size=120)
+
+        self.assertEqual(result["Export"]["BatchCount"], 3)
+        parquetFile = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual([parquetFile.metadata.row_group(index).num_rows for index in range(3)],
+                         [120, 120, 10])
+        self.assertEqual(parquetFile.read().column("metric_name").to_pylist(),
+                         [metric["MetricName"] for _, metric in self.metrics])
+
+    def test_parquet_export(self):
+        path = os.path.join(self.tmpDir.name, "nested", "metrics.parquet")
+        result = cw_metric_export.export_scan(self.cwHelper, path)
+
+        self.assertEqual(result["Export"]["BatchCount"], 1)
+        self.assertEqual(result["Export"]["RowCount"], 250)
+        self.assertEqual(result["Summary"]["TotalMetricCount"], 250)
+
+        parquetFile = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(parquetFile.metadata.num_row_groups, 1)
+        table = parquetFile.read()
+        self.assertTrue(pyarrow.types.is_dictionary(table.schema.field("namespace").type))
+        rows = table.to_pylist()
+        accountId, metric = self.metrics[0]
+        self.assertEqual(rows[0]["account_id"], accountId)
+        self.assertEqual(rows[0]["metric_name"], metric["MetricName"])
+        self.assertEqual(rows[0]["dimensions"],
+                         [{"name": "InstanceId", "value": metric["Dimensions"][0]["Value"]}])
+        self.assertEqual(rows[0]["region"], "us-east-1")
+
+    def test_arrow_stream(self):
+        path = os.path.join(self.tmpDir.name, "metrics.arrows")
+        cw_metric_export.export_scan(self.cwHelper, path, format="arrow")
+
+        with pyarrow.ipc.open_stream(path) as reader:
+            batches = list(reader)
+        self.assertEqual([batch.num_rows for batch in batches], [100, 100, 50])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            cw_metric_export.InventoryWriter(os.path.join(self.tmpDir.name, "x"), format="csv")
+
+    def test_handler_export(self):
+        client = FakeCloudWatchClient(metrics=self.metrics)
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session, \
+                mock.patch.dict(os.environ, {"EXPORT_PATH": self.tmpDir.name}), \
+                mock.patch("sys.stdout"):
+            session.return_value.create_client.return_value = client
+            app.lambda_handler({"export": True, "instrumentation": False}, None)
+
+        paths = glob.glob(os.path.join(self.tmpDir.name, "metrics-us-east-1-*.parquet"))
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(pyarrow.parquet.read_metadata(paths[0]).num_rows, 250)
+        self.assertEqual(len(client.put_calls), 1)
+
+
+class TestMissingPyarrow(unittest.TestCase):
+    def test_export_fails_before_scanning(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(10))
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+        with mock.patch.object(cw_metric_export, "pyarrow", None):
+            with self.assertRaisesRegex(ImportError, "requires pyarrow"):
+                cw_metric_export.export_scan(cwHelper, os.path.join(tempfile.gettempdir(), "x.parquet"))
+
+        self.assertEqual(client.list_calls, 0)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+import cw_metric_helper
+import cw_metric_instrument
+import cw_metric_store
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, SyntheticCloudWatchClient, make_metrics
+
+
+class TestPutMetricDataBatch(unittest.TestCase):
+    def _metric_data(self, count):
+        return [cw_metric_helper.CloudWatch.build_metric_datum(
+                    metric_name="testmetric",
+                    value=idx,
+                    dimensions=[{"Name": "accountId", "Value": "%012d" % idx}])
+                for idx in range(count)]
+
+    def test_batches_are_packed_to_limit(self):
+        client = FakeCloudWatchClient()
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        ret = cwHelper.put_metric_data_batch(namespace="testnamespace",
+                                             metric_data=self._metric_data(2500))
+
+        self.assertEqual(ret["Status"], "Success")
+        self.assertEqual(ret["BatchCount"], 3)
+        sizes = sorted(len(call["MetricData"]) for call in client.put_calls)
+        self.assertEqual(sizes, [500, 1000, 1000])
+
+    def test_batches_respect_payload_size(self):
+        batches = cw_metric_helper.CloudWatch.batch_metric_data(
+            self._metric_data(100), max_batch_bytes=1000)
+
+        self.assertTrue(len(batches) > 1)
+        self.assertEqual(sum(len(batch) for batch in batches), 100)
+
+    def test_failed_batch_does_not_fail_run(self):
+        client = FakeCloudWatchClient(fail_put_calls={0})
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        ret = cwHelper.put_metric_data_batch(namespace="testnamespace",
+                                             metric_data=self._metric_data(2500),
+                                             max_workers=1)
+
+        self.assertEqual(ret["Status"], "PartialFailure")
+        self.assertEqual(ret["SuccessCount"], 2)
+        self.assertEqual(ret["FailureCount"], 1)
+        self.assertIn("InvalidParameterValue", ret["Batches"][0]["Error"])
+
+    def test_empty_input(self):
+        cwHelper = cw_metric_helper.CloudWatch(client=FakeCloudWatchClient())
+        ret = cwHelper.put_metric_data_batch(namespace="testnamespace", metric_data=[])
+        self.assertEqual(ret["Status"], "Success")
+        self.assertEqual(ret["BatchCount"], 0)
+
+
+class TestListMetrics(unittest.TestCase):
+    def test_full_list(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(1200), page_size=500)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        result = cwHelper.list_metrics()
+
+        self.assertEqual(client.list_calls, 3)
+        self.assertEqual(len(result["Metrics"]), 1200)
+        self.assertEqual(result["Metrics"][1]["aws.accountId"], "222222222222")
+        self.assertEqual(result["Summary"]["TotalMetricCount"], 1200)
+        self.assertEqual(result["Summary"]["111111111111"]["TotalMetricCount"], 600)
+        self.assertEqual(
+            result["Summary"]["111111111111"]["MetricCountByNamespace"]["AWS/EC2"], 600)
+        self.assertEqual(len(result["Summary"]["222222222222"]["UniqueMetricNames"]), 7)
+
+    def test_summary_only(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(1200), page_size=500)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        full = cwHelper.list_metrics()
+        result = cwHelper.list_metrics(include_metrics=False)
+
+        self.assertNotIn("Metrics", result)
+        self.assertEqual(result["Summary"], full["Summary"])
+
+
+class TestListMetricsSharded(unittest.TestCase):
+    def test_build_shards(self):
+        build = cw_metric_helper.CloudWatch.build_shards
+        self.assertEqual(build(), [{}])
+        self.assertEqual(build(account_ids=["1", "2"]),
+                         [{"OwningAccount": "1"}, {"OwningAccount": "2"}])
+        self.assertEqual(build(namespaces=["a", "b"]),
+                         [{"Namespace": "a"}, {"Namespace": "b"}, {"ExcludeNamespaces": ["a", "b"]}])
+        self.assertEqual(len(build(account_ids=["1", "2"], namespaces=["a", "b", "c"])), 8)
+
+    def test_sharded_matches_serial(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(3000), page_size=100)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        serial = cwHelper.list_metrics(include_metrics=False)
+        sharded = cwHelper.list_metrics_sharded(
+            account_ids=["111111111111", "222222222222"],
+            namespaces=["AWS/EC2", "Custom/App"])
+
+        self.assertEqual(sharded["ShardCount"], 6)
+        self.assertEqual(sharded["Summary"], serial["Summary"])
+
+    def test_unlisted_namespaces_are_covered(self):
+        metrics = make_metrics(600) + [("333333333333", {"Namespace": "Custom/Other", "MetricName": "m",
+                                                         "Dimensions": []})]
+        cwHelper = cw_metric_helper.CloudWatch(client=FakeCloudWatchClient(metrics=metrics, page_size=100))
+
+        serial = cwHelper.list_metrics(include_metrics=False)
+        for accountIds in (None, ["111111111111", "222222222222", "333333333333"]):
+            sharded = cwHelper.list_metrics_sharded(account_ids=accountIds, namespaces=["AWS/EC2"])
+            self.assertEqual(sharded["Summary"]["TotalMetricCount"], 601)
+            self.assertEqual(sharded["Summary"], serial["Summary"])
+
+    def test_handler_scan_sharded_total_matches_unsharded(self):
+        metrics = make_metrics(600) + [("333333333333", {"Namespace": "Custom/Other", "MetricName": "m",
+                                                         "Dimensions": []})]
+        cwHelper = cw_metric_helper.CloudWatch(client=FakeCloudWatchClient(metrics=metrics, page_size=100))
+        accounts = "111111111111,222222222222,333333333333"
+
+        unsharded = app.scan(cwHelper, {})
+        self.assertNotIn("ShardCount", unsharded)
+        for event, environ, shardCount in (({"namespaces": ["AWS/EC2"]}, {}, 2),
+                                           ({"accountIds": accounts.split(",")}, {}, 3),
+                                           ({}, {"ACCOUNT_IDS": accounts}, 3)):
+            with mock.patch.dict(os.environ, environ):
+                sharded = app.scan(cwHelper, event)
+            self.assertEqual(sharded["ShardCount"], shardCount)
+            self.assertEqual(sharded["Summary"]["TotalMetricCount"], unsharded["Summary"]["TotalMetricCount"])
+            self.assertEqual(sharded["Summary"], unsharded["Summary"])
+
+    def test_merge_is_associative(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(900), page_size=100)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+        partials = [cwHelper.list_metrics(include_metrics=False, **shard)["Summary"]
+                    for shard in cwHelper.build_shards(namespaces=["AWS/EC2", "Custom/App"])]
+
+        merge = cw_metric_helper.merge_summaries
+        self.assertEqual(merge([merge(partials[:1]), partials[1]]),
+                         merge([partials[0], merge(partials[1:])]))
+
+
+class TestSyntheticCloudWatchClient(unittest.TestCase):
+    def test_generated_inventory(self):
+        client = SyntheticCloudWatchClient(metric_count=5000, account_count=3,
+                                           namespace_count=4, namespace_skew=1.0)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        summary = cwHelper.list_metrics(include_metrics=False)["Summary"]
+
+        self.assertEqual(client.list_calls, 10)
+        self.assertEqual(summary["TotalMetricCount"], 5000)
+        self.assertEqual(sorted(summary[accountId]["TotalMetricCount"]
+                                for accountId in client.accounts), [1666, 1667, 1667])
+        sizes = [end - start for start, end in client.namespace_bounds.values()]
+        self.assertEqual(sum(sizes), 5000)
+        self.assertTrue(sizes[0] > sizes[1] > sizes[3])
+
+    def test_filters_match_full_scan(self):
+        client = SyntheticCloudWatchClient(metric_count=3000, account_count=4,
+                                           namespace_count=3, page_size=97)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        serial = cwHelper.list_metrics(include_metrics=False)
+        sharded = cwHelper.list_metrics_sharded(account_ids=client.accounts,
+                                                namespaces=client.namespaces)
+
+        self.assertEqual(sharded["Summary"], serial["Summary"])
+
+
+class TestListMetricsResumable(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.store = cw_metric_store.LocalFileStore(self.tmpDir.name)
+        self.client = FakeCloudWatchClient(metrics=make_metrics(1000), page_size=100)
+        self.cwHelper = cw_metric_helper.CloudWatch(client=self.client)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def budget(self, pages):
+        """
+        Remaining time function allowing the given number of pages.
+        """
+        calls = []
+
+        def remaining_ms():
+            calls.append(1)
+            return 60000 if len(calls) <= pages else 0
+        return remaining_ms
+
+    def test_scan_converges_across_invocations(self):
+        expected = self.cwHelper.list_metrics(include_metrics=False)["Summary"]
+        self.client.list_calls = 0
+
+        # Each invocation reads one page plus three within the budget.
+        results = []
+        for _ in range(3):
+            results.append(self.cwHelper.list_metrics_resumable(self.store, self.budget(3)))
+
+        self.assertEqual([result["PageCount"] for result in results], [4, 8, 10])
+        self.assertEqual([result["Complete"] for result in results], [False, False, True])
+        self.assertEqual(results[-1]["Summary"], expected)
+        self.assertEqual(results[-1]["PageCount"], 10)
+        self.assertEqual(self.client.list_calls, 10)
+        self.assertIsNone(self.store.get("checkpoint/scan"))
+
+    def test_full_budget_completes_in_one_call(self):
+        result = self.cwHelper.list_metrics_resumable(self.store, lambda: 60000, sketches=True)
+
+        self.assertTrue(result["Complete"])
+        self.assertEqual(result["Summary"]["TotalMetricCount"], 1000)
+        self.assertEqual(result["Sketches"].estimates()["111111111111"]["UniqueMetricNames"], 7)
+
+    def test_checkpoint_of_other_summary_mode_is_discarded(self):
+        expected = self.cwHelper.list_metrics(include_metrics=False)["Summary"]
+
+        partial = self.cwHelper.list_metrics_resumable(self.store, self.budget(2), sketches=True)
+        self.assertFalse(partial["Complete"])
+        self.assertEqual(partial["PageCount"], 3)
+
+        # Resuming without sketches needs the unique name sets, start over.
+        result = self.cwHelper.list_metrics_resumable(self.store, lambda: 60000)
+        self.assertTrue(result["Complete"])
+        self.assertEqual(result["PageCount"], 10)
+        self.assertEqual(result["Summary"], expected)
+
+    def test_pages_are_instrumented_and_checkpointed(self):
+        instrumentation = cw_metric_instrument.Instrumentation()
+        cwHelper = cw_metric_helper.CloudWatch(client=self.client, instrumentation=instrumentation)
+
+        result = cwHelper.list_metrics_resumable(self.store, self.budget(4), checkpoint_every=2)
+        self.assertEqual(result["PageCount"], 5)
+        self.assertEqual(instrumentation.counters, {"ListMetricsPages": 5, "MetricsListed": 500})
+        checkpoint = self.store.get("checkpoint/scan")
+        self.assertEqual((checkpoint["PageCount"], checkpoint["NextToken"]), (5, "500"))
+
+        result = cwHelper.list_metrics_resumable(self.store, lambda: 60000)
+        self.assertTrue(result["Complete"])
+        self.assertEqual(instrumentation.counters, {"ListMetricsPages": 10, "MetricsListed": 1000})
+        self.assertEqual(self.client.list_calls, 10)
+
+    def test_summary_dict_round_trip(self):
+        summary = self.cwHelper.list_metrics(include_metrics=False)["Summary"]
+        data = json.loads(json.dumps(cw_metric_helper.summary_to_dict(summary)))
+
+        self.assertEqual(cw_metric_helper.summary_from_dict(data), summary)
+
+
+class TestSerialization(unittest.TestCase):
+    def setUp(self):
+        cwHelper = cw_metric_helper.CloudWatch(client=FakeCloudWatchClient(metrics=make_metrics(300)))
+        self.result = cwHelper.list_metrics(include_metrics=True, sketches=True, heavy_hitters=3)
+        self.result["Summary"] = cwHelper.list_metrics(include_metrics=False)["Summary"]
+
+    def formats(self):
+        if cw_metric_helper.msgpack is None:
+            return ["json"]
+        return list(cw_metric_helper.SERIALIZATION_FORMATS)
+
+    def test_summary_round_trip(self):
+        for format in self.formats():
+            payload = cw_metric_helper.serialize_summary(self.result["Summary"], format)
+            self.assertEqual(cw_metric_helper.deserialize_summary(payload, format),
+                             self.result["Summary"])
+
+    def test_result_round_trip(self):
+        for format in self.formats():
+            result = cw_metric_helper.deserialize_result(
+                cw_metric_helper.serialize_result(self.result, format), format)
+
+            self.assertEqual(result["Summary"], self.result["Summary"])
+            self.assertEqual(result["Metrics"], self.result["Metrics"])
+            self.assertEqual(result["Sketches"].estimates(), self.result["Sketches"].estimates())
+            self.assertEqual(result["HeavyHitters"].report(), self.result["HeavyHitters"].report())
+
+    def test_json_is_canonical(self):
+        summary = self.result["Summary"]
+        reordered = dict(reversed(list(summary.items())))
+        self.assertEqual(cw_metric_helper.serialize_summary(summary),
+                         cw_metric_helper.serialize_summary(reordered))
+        self.assertNotIn(b" ", cw_metric_helper.serialize_summary(summary))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            cw_metric_helper.encode({}, "yaml")
+
+    def test_summary_log_record(self):
+        record = cw_metric_helper.summary_log_record(self.result["Summary"])
+        self.assertEqual(record, {
+            "TotalMetricCount": 300,
+            "AccountCount": 2,
+            "NamespaceCount": 2,
+            "MetricCountByAccount": {"111111111111": 150, "222222222222": 150}
+        })
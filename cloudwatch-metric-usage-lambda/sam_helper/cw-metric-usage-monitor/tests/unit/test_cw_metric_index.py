@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import os
+import tempfile
+import unittest
+
+import cw_metric_helper
+import cw_metric_index
+import cw_metric_inventory
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+class TestMetricIndex(unittest.TestCase):
+    def setUp(self):
+        self.metrics = make_metrics(1000)
+        self.metrics.append(("333333333333", {"Namespace": "Custom/Solo", "MetricName": "solo",
+                                              "Dimensions": [{"Name": "Stage", "Value": "prod"}]}))
+        self.client = FakeCloudWatchClient(metrics=self.metrics, page_size=100)
+        self.cwHelper = cw_metric_helper.CloudWatch(client=self.client)
+        self.index = cw_metric_index.MetricIndex.scan(self.cwHelper, batch_size=250)
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_summary_matches_list_metrics(self):
+        expected = self.cwHelper.list_metrics(include_metrics=False)["Summary"]
+
+        self.assertEqual(len(self.index), 1001)
+        self.assertEqual(self.index.summary(), expected)
+        self.assertEqual(self.index.meta()["Region"], "us-east-1")
+
+    def test_counts(self):
+        self.assertEqual(self.index.count_by_account(),
+                         {"111111111111": 500, "222222222222": 500, "333333333333": 1})
+        self.assertEqual(self.index.count_by_namespace("111111111111"), {"AWS/EC2": 500})
+        self.assertEqual(self.index.single_account_namespaces(),
+                         {"AWS/EC2": "111111111111", "Custom/App": "222222222222",
+                          "Custom/Solo": "333333333333"})
+        self.assertEqual(len(self.index.count_by_dimension_value("InstanceId")), 1000)
+        self.assertEqual(self.index.count_by_dimension_value("Stage", namespace="Custom/Solo"),
+                         {"prod": 1})
+
+    def test_find_metrics(self):
+        found = list(self.index.find_metrics(accountId="222222222222",
+                                             dimensionName="InstanceId"))
+        self.assertEqual(len(found), 500)
+        self.assertTrue(all(metric["aws.accountId"] == "222222222222" for metric in found))
+
+        accountId, metric = self.metrics[7]
+        found = list(self.index.find_metrics(dimensionValue=metric["Dimensions"][0]["Value"]))
+        self.assertEqual(found, [dict(metric, **{"aws.accountId": accountId})])
+
+        self.assertEqual(len(list(self.index.find_metrics(metricName="metric-0", limit=10))), 10)
+        self.assertEqual(list(self.index.find_metrics(namespace="Unknown")), [])
+
+    def test_bounded_string_cache(self):
+        with cw_metric_index.MetricIndex(cache_size=4, batch_size=250) as index:
+            for metrics, owningAccounts in self.cwHelper.iter_metric_pages():
+                index.add_page(metrics, owningAccounts)
+            # Strings evicted from the cache are found in the database again.
+            index.add_page([metric for _, metric in self.metrics[:5]],
+                           [accountId for accountId, _ in self.metrics[:5]])
+            index.finish()
+
+            self.assertTrue(all(len(ids) <= 4 for ids in index._ids.values()))
+            self.assertEqual(index.query("SELECT COUNT(*) FROM dimension_values"), [(1001,)])
+            self.assertEqual(index.count_by_account()["111111111111"], 503)
+            accountId, metric = self.metrics[2]
+            self.assertEqual(list(index.find_metrics(dimensionValue=metric["Dimensions"][0]["Value"])),
+                             [dict(metric, **{"aws.accountId": accountId})] * 2)
+
+    def test_reopen_and_reload(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, "index.db")
+            cw_metric_index.MetricIndex.scan(self.cwHelper, path).close()
+
+            with cw_metric_index.MetricIndex(path) as index:
+                self.assertEqual(index.count_by_account()["333333333333"], 1)
+                self.assertEqual(len(list(index.find_metrics(accountId="333333333333"))), 1)
+
+            # A new scan replaces the previous contents.
+            self.client.metrics = self.metrics[:10]
+            with cw_metric_index.MetricIndex.scan(self.cwHelper, path) as index:
+                self.assertEqual(len(index), 10)
+
+    def test_from_inventory(self):
+        inventory = cw_metric_inventory.MetricInventory.scan(self.cwHelper)
+        with cw_metric_index.MetricIndex.from_inventory(inventory) as index:
+            self.assertEqual(index.summary(), inventory.summary())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+from unittest import mock
+
+import app
+import cw_metric_helper
+import cw_metric_instrument
+import cw_metric_ratelimit
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = cw_metric_instrument.LatencyHistogram()
+        for milliseconds in [3] * 90 + [40] * 9 + [20000]:
+            histogram.add(milliseconds)
+
+        self.assertEqual(histogram.percentile(50), 5)
+        self.assertEqual(histogram.percentile(90), 5)
+        self.assertEqual(histogram.percentile(99), 50)
+        self.assertEqual(histogram.percentile(100), 20000)
+        self.assertEqual(histogram.to_dict()["Buckets"], {"<=5": 90, "<=50": 9, ">10000": 1})
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_api_calls_pages_and_retries(self):
+        instrumentation = cw_metric_instrument.Instrumentation()
+        client = FakeCloudWatchClient(metrics=make_metrics(450), page_size=100, throttle_calls={1})
+        limiters = {"list_metrics": cw_metric_ratelimit.AdaptiveRateLimiter(
+            rate=1000, sleep=lambda seconds: None)}
+        cwHelper = cw_metric_helper.CloudWatch(client=client, limiters=limiters,
+                                               instrumentation=instrumentation)
+
+        cwHelper.list_metrics(include_metrics=False)
+        report = instrumentation.report()
+
+        listMetrics = report["Operations"]["list_metrics"]
+        self.assertEqual(listMetrics["Calls"], 5)
+        self.assertEqual(listMetrics["Attempts"], 6)
+        self.assertEqual(listMetrics["Retries"], 1)
+        self.assertEqual(listMetrics["Errors"], 1)
+        self.assertEqual(listMetrics["Latency"]["Count"], 6)
+        self.assertEqual(report["Counters"], {"ListMetricsPages": 5, "MetricsListed": 450})
+
+    def test_metric_data(self):
+        clock = iter([0.0, 1.5]).__next__
+        instrumentation = cw_metric_instrument.Instrumentation(clock=clock)
+        with instrumentation.phase("scan"):
+            pass
+        instrumentation.record_attempt("list_metrics", 0.004)
+        instrumentation.record_call("list_metrics", 1)
+
+        data = {(datum["MetricName"], datum["Dimensions"][0]["Value"]): datum["Value"]
+                for datum in instrumentation.metric_data()}
+        self.assertEqual(data[("PhaseDuration", "scan")], 1.5)
+        self.assertEqual(data[("ApiCalls", "list_metrics")], 1)
+        self.assertEqual(data[("ApiLatencyP50", "list_metrics")], 4.0)
+
+    def test_handler_publishes_unless_disabled(self):
+        for event, expectedCalls in (({}, 2), ({"instrumentation": True}, 2), ({"instrumentation": False}, 1)):
+            client = FakeCloudWatchClient(metrics=make_metrics(10))
+            enabled = event.get("instrumentation", True)
+            with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session, \
+                    mock.patch.object(cw_metric_helper, "_sessions", {}), \
+                    mock.patch.object(cw_metric_helper, "_clients", {}), \
+                    mock.patch("sys.stdout"):
+                session.return_value.create_client.return_value = client
+                app.lambda_handler(event, None)
+
+            self.assertEqual(len(client.put_calls), expectedCalls)
+            if enabled:
+                names = {datum["MetricName"] for datum in client.put_calls[1]["MetricData"]}
+                self.assertTrue({"PhaseDuration", "ApiCalls", "ListMetricsPages"} <= names)
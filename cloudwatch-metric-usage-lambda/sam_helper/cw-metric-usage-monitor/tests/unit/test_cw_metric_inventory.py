@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import tempfile
+import unittest
+
+import cw_metric_helper
+import cw_metric_inventory
+import cw_metric_store
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+class TestIncrementalInventory(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.store = cw_metric_store.LocalFileStore(self.tmpDir.name)
+        self.metrics = make_metrics(1000)
+        self.client = FakeCloudWatchClient(metrics=self.metrics, page_size=100)
+        cwHelper = cw_metric_helper.CloudWatch(client=self.client)
+        self.inventory = cw_metric_inventory.IncrementalInventory(
+            cwHelper, self.store, full_scan_interval=86400, retention=3600, bucket_seconds=100)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_first_run_is_full_scan(self):
+        result = self.inventory.update(now=1000)
+
+        self.assertTrue(result["FullScan"])
+        self.assertEqual(len(result["Added"]), 1000)
+        self.assertEqual(result["Summary"]["TotalMetricCount"], 1000)
+        self.assertEqual(len(self.inventory.metric_keys()), 1000)
+
+    def test_incremental_run_pages_recently_active_only(self):
+        self.inventory.update(now=1000)
+        newMetric = ("333333333333", {"Namespace": "Custom/New", "MetricName": "m",
+                                      "Dimensions": []})
+        self.client.metrics = self.metrics[100:] + [newMetric]
+        self.client.recently_active = self.metrics[:50] + [newMetric]
+        self.client.list_calls = 0
+
+        result = self.inventory.update(now=2000)
+
+        self.assertFalse(result["FullScan"])
+        self.assertEqual(self.client.list_calls, 1)
+        self.assertEqual(len(result["Added"]), 1)
+        self.assertEqual(result["Removed"], [])
+        self.assertEqual(result["Summary"]["TotalMetricCount"], 1001)
+        self.assertEqual(result["Summary"]["333333333333"]["TotalMetricCount"], 1)
+
+        # Metrics not seen active within the retention window expire.
+        result = self.inventory.update(now=1100 + 3600)
+        self.assertEqual(len(result["Removed"]), 1000 - 50)
+        self.assertEqual(result["Summary"]["TotalMetricCount"], 51)
+
+    def test_full_scan_reconciles(self):
+        self.inventory.update(now=1000)
+        self.client.metrics = self.metrics[10:]
+
+        result = self.inventory.update(now=1000 + 86400)
+
+        self.assertTrue(result["FullScan"])
+        self.assertEqual(len(result["Removed"]), 10)
+        self.assertEqual(result["Summary"], cw_metric_helper.CloudWatch(
+            client=self.client).list_metrics(include_metrics=False)["Summary"])
+
+    def test_expiry_by_last_seen_bucket(self):
+        keys = [cw_metric_inventory.metric_key(accountId, metric) for accountId, metric in self.metrics]
+        self.inventory.update(now=1000)
+        self.client.recently_active = self.metrics[:50]
+        self.inventory.update(now=2000)
+        self.client.recently_active = self.metrics[50:60]
+        self.inventory.update(now=2550)
+        self.client.recently_active = []
+
+        # Bucket [1000, 1100) expires first, then [2000, 2100).
+        result = self.inventory.update(now=1100 + 3600 - 1)
+        self.assertEqual(result["Removed"], [])
+        result = self.inventory.update(now=1100 + 3600)
+        self.assertEqual(sorted(result["Removed"]), sorted(keys[60:]))
+        result = self.inventory.update(now=2100 + 3600)
+        self.assertEqual(sorted(result["Removed"]), sorted(keys[:50]))
+
+        self.assertEqual(sorted(self.inventory.metric_keys()), sorted(keys[50:60]))
+        self.assertEqual(result["Summary"], cw_metric_inventory.IncrementalInventory.summary(keys[50:60]))
+
+    def test_snapshot_is_compact(self):
+        self.inventory.update(now=1000)
+        self.client.recently_active = self.metrics[:50]
+        self.inventory.update(now=2000)
+
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(self.tmpDir.name) for name in names)
+        keySize = sum(len(cw_metric_inventory.metric_key(accountId, metric)) for accountId, metric in self.metrics)
+        # Far smaller than the metric keys alone, let alone a key -> time map.
+        self.assertLess(size, keySize / 3)
+
+    def test_metric_key_round_trip(self):
+        accountId, metric = self.metrics[3]
+        key = cw_metric_inventory.metric_key(accountId, metric)
+        decoded = cw_metric_inventory.decode_metric_key(key)
+
+        self.assertEqual(decoded["aws.accountId"], accountId)
+        self.assertEqual(decoded["Dimensions"], metric["Dimensions"])
+
+
+class TestMetricInventory(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeCloudWatchClient(metrics=make_metrics(1000), page_size=100)
+        self.cwHelper = cw_metric_helper.CloudWatch(client=self.client)
+
+    def test_counts_match_list_metrics(self):
+        inventory = cw_metric_inventory.MetricInventory.scan(self.cwHelper)
+        expected = self.cwHelper.list_metrics(include_metrics=False)["Summary"]
+
+        self.assertEqual(len(inventory), 1000)
+        self.assertEqual(inventory.summary(), expected)
+        self.assertEqual(inventory.count_by_account(),
+                         {"111111111111": 500, "222222222222": 500})
+        self.assertEqual(inventory.count_by_namespace("111111111111"), {"AWS/EC2": 500})
+        self.assertEqual(inventory.count_by_namespace(), {"AWS/EC2": 500, "Custom/App": 500})
+
+    def test_iter_metrics_rebuilds_dicts(self):
+        inventory = cw_metric_inventory.MetricInventory.scan(self.cwHelper)
+        expected = self.cwHelper.list_metrics()["Metrics"]
+
+        self.assertEqual(list(inventory.iter_metrics()), expected)
+        self.assertEqual(len(inventory.names), 7)
+
+    def test_serialize_round_trip(self):
+        inventory = cw_metric_inventory.MetricInventory.scan(self.cwHelper)
+        formats = ["json"] if cw_metric_helper.msgpack is None else ["json", "msgpack"]
+
+        for format in formats:
+            restored = cw_metric_inventory.MetricInventory.deserialize(inventory.serialize(format), format)
+            self.assertEqual(list(restored.iter_metrics()), list(inventory.iter_metrics()))
+            self.assertEqual(restored.summary(), inventory.summary())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import io
+import json
+import unittest
+from unittest import mock
+
+import app
+import cw_metric_helper
+import cw_metric_publisher
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+class TestEmfPublisher(unittest.TestCase):
+    def test_datapoints_packed_per_dimension_set(self):
+        metricData = []
+        for idx in range(250):
+            dimensions = [{"Name": "accountId", "Value": "%012d" % (idx % 2)}]
+            metricData.append(cw_metric_helper.CloudWatch.build_metric_datum(
+                metric_name="m%d" % (idx // 2), value=idx, dimensions=dimensions))
+
+        events = cw_metric_publisher.EmfPublisher.build_events("ns", metricData, timestamp=1)
+
+        # 125 metric names per account, at most 100 metrics per event.
+        self.assertEqual(len(events), 4)
+        directive = events[0]["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(directive["Namespace"], "ns")
+        self.assertEqual(directive["Dimensions"], [["accountId"]])
+        self.assertEqual(len(directive["Metrics"]), 100)
+        self.assertEqual(events[0]["accountId"], "000000000000")
+        self.assertEqual(events[0]["m0"], 0)
+
+    def test_repeated_metric_uses_value_array(self):
+        metricData = [cw_metric_helper.CloudWatch.build_metric_datum("m", value)
+                      for value in range(3)]
+        events = cw_metric_publisher.EmfPublisher.build_events("ns", metricData)
+
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["m"], [0, 1, 2])
+
+    def test_publish_writes_json_lines(self):
+        stream = io.StringIO()
+        metricData = [cw_metric_helper.CloudWatch.build_metric_datum("m", 1)]
+        ret = cw_metric_publisher.EmfPublisher(stream=stream).publish("ns", metricData)
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(ret["Status"], "Success")
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["m"], 1)
+
+
+class TestHandlerPublisher(unittest.TestCase):
+    def test_emf_handler_makes_no_put_calls(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(300), page_size=100)
+        stream = io.StringIO()
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session, \
+                mock.patch("sys.stdout", stream):
+            session.return_value.create_client.return_value = client
+            ret = app.lambda_handler({"publisher": "emf", "instrumentation": False}, None)
+
+        self.assertEqual(ret["statusCode"], 200)
+        self.assertEqual(client.put_calls, [])
+        events = [json.loads(line) for line in stream.getvalue().splitlines()
+                  if line.startswith('{"_aws"')]
+        names = {metric["Name"] for event in events
+                 for metric in event["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+        self.assertEqual(names, {"testmetric", "UniqueMetricNameCount", "MetricCountByNamespace"})
+
+
+class TestHandlerRegions(unittest.TestCase):
+    def test_regions_scanned_and_tagged(self):
+        clients = {
+            "us-east-1": FakeCloudWatchClient(metrics=make_metrics(100)),
+            "eu-west-1": FakeCloudWatchClient(metrics=make_metrics(40))
+        }
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session:
+            session.return_value.create_client.side_effect = \
+                lambda service, region_name, **kwargs: clients[region_name]
+            app.lambda_handler({"regions": ["us-east-1", "eu-west-1"]}, None)
+
+        # Both regions are published through the first region's client.
+        self.assertEqual(clients["eu-west-1"].put_calls, [])
+        data = clients["us-east-1"].put_calls[0]["MetricData"]
+        values = {(datum["Dimensions"][0]["Value"], datum["Dimensions"][1]["Value"]): datum["Value"]
+                  for datum in data}
+        self.assertEqual(values, {("111111111111", "us-east-1"): 50,
+                                  ("222222222222", "us-east-1"): 50,
+                                  ("111111111111", "eu-west-1"): 20,
+                                  ("222222222222", "eu-west-1"): 20})
+
+    def test_failed_region_reported(self):
+        clients = {
+            "us-east-1": FakeCloudWatchClient(metrics=make_metrics(100)),
+            "eu-west-1": mock.Mock(**{"list_metrics.side_effect": RuntimeError("access denied")})
+        }
+        for regions, statusCode in ((["us-east-1", "eu-west-1"], 207), (["eu-west-1"], 500)):
+            with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session, \
+                    mock.patch("sys.stdout"):
+                session.return_value.create_client.side_effect = \
+                    lambda service, region_name, **kwargs: clients[region_name]
+                ret = app.lambda_handler({"regions": regions, "instrumentation": False}, None)
+
+            self.assertEqual(ret["statusCode"], statusCode)
+            self.assertEqual(json.loads(ret["body"])["FailedRegions"],
+                             {"eu-west-1": "RuntimeError: access denied"})
+
+        # The region that worked is still published.
+        regionValues = {datum["Dimensions"][1]["Value"] for datum in clients["us-east-1"].put_calls[0]["MetricData"]}
+        self.assertEqual(regionValues, {"us-east-1"})
+
+    def test_default_region_is_not_tagged(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(10))
+        with mock.patch.object(cw_metric_helper.botocore.session, "Session") as session:
+            session.return_value.create_client.return_value = client
+            app.lambda_handler({}, None)
+
+        for datum in client.put_calls[0]["MetricData"]:
+            self.assertEqual([dimension["Name"] for dimension in datum["Dimensions"]], ["accountId"])
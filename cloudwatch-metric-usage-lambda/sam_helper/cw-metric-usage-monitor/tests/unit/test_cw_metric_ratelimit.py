@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+from botocore.exceptions import ClientError
+
+import cw_metric_helper
+import cw_metric_ratelimit
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def throttle():
+    raise ClientError({"Error": {"Code": "Throttling", "Message": "Rate exceeded"}}, "ListMetrics")
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.fakeClock = FakeClock()
+
+    def limiter(self, **kwargs):
+        return cw_metric_ratelimit.AdaptiveRateLimiter(sleep=self.fakeClock.sleep,
+                                                       clock=self.fakeClock.clock, **kwargs)
+
+    def test_token_bucket_paces_calls(self):
+        limiter = self.limiter(rate=10, burst=1)
+        for _ in range(11):
+            limiter.call(lambda: None)
+
+        # One token up front, then one every 100 ms.
+        self.assertAlmostEqual(self.fakeClock.now, 1.0, places=6)
+        self.assertAlmostEqual(limiter.stats()["WaitSeconds"], 1.0, places=3)
+
+    def test_throttle_backs_off_and_retries(self):
+        limiter = self.limiter(rate=20, concurrency=4)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                throttle()
+            return "ok"
+
+        self.assertEqual(limiter.call(flaky), "ok")
+        stats = limiter.stats()
+        self.assertEqual(stats["Throttles"], 2)
+        self.assertEqual(stats["Retries"], 2)
+        self.assertLess(stats["Rate"], 20)
+        self.assertLess(stats["Concurrency"], 4)
+
+    def test_rate_recovers_after_success(self):
+        limiter = self.limiter(rate=20, rate_increase=1)
+        self.assertRaises(ClientError, limiter.call, throttle)
+        lowered = limiter.rate
+        for _ in range(5):
+            limiter.call(lambda: None)
+
+        self.assertEqual(limiter.rate, min(20, lowered + 5))
+        self.assertEqual(limiter.stats()["Failures"], 1)
+
+    def test_other_errors_are_not_retried(self):
+        limiter = self.limiter(rate=20)
+
+        def fail():
+            raise ValueError("bad request")
+
+        self.assertRaises(ValueError, limiter.call, fail)
+        self.assertEqual(limiter.stats()["Retries"], 0)
+        self.assertEqual(limiter.stats()["Calls"], 1)
+
+
+    def test_throttle_detection_uses_error_codes(self):
+        isThrottle = cw_metric_ratelimit.is_throttle_error
+
+        self.assertTrue(isThrottle(ClientError({"Error": {"Code": "ThrottlingException"}}, "ListMetrics")))
+        self.assertTrue(isThrottle(ClientError({"Error": {"Code": "Unknown"},
+                                                "ResponseMetadata": {"HTTPStatusCode": 429}}, "ListMetrics")))
+        # A coded error quoting a throttling message is not a throttle.
+        self.assertFalse(isThrottle(ClientError({"Error": {"Code": "InvalidParameterValue",
+                                                           "Message": "Rate exceeded is not a valid name"}},
+                                                "PutMetricData")))
+        # Errors without a code fall back to the message.
+        self.assertTrue(isThrottle(RuntimeError("Rate exceeded")))
+        self.assertFalse(isThrottle(RuntimeError("bad request")))
+
+    def test_transient_errors_are_retried_without_backoff_of_limits(self):
+        limiter = self.limiter(rate=20, concurrency=4)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ClientError({"Error": {"Code": "InternalFailure", "Message": "Internal"},
+                                   "ResponseMetadata": {"HTTPStatusCode": 500}}, "ListMetrics")
+            return "ok"
+
+        self.assertEqual(limiter.call(flaky), "ok")
+        stats = limiter.stats()
+        self.assertEqual(stats["Retries"], 1)
+        self.assertEqual(stats["Throttles"], 0)
+        self.assertEqual(stats["Rate"], 20)
+
+
+class TestHelperRateLimiting(unittest.TestCase):
+    def test_list_metrics_retries_throttled_pages(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(1000), page_size=100,
+                                      throttle_calls={0, 3, 4})
+        limiters = cw_metric_ratelimit.new_limiters()
+        for limiter in limiters.values():
+            limiter.sleep = lambda seconds: None
+        cwHelper = cw_metric_helper.CloudWatch(client=client, limiters=limiters)
+
+        summary = cwHelper.list_metrics(include_metrics=False)["Summary"]
+
+        self.assertEqual(summary["TotalMetricCount"], 1000)
+        stats = cwHelper.rate_limit_stats()["list_metrics"]
+        self.assertEqual(stats["Throttles"], 3)
+        self.assertEqual(stats["Calls"], 13)
+
+    def test_list_metrics_survives_internal_failure(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(1000), page_size=100,
+                                      error_calls={2: "InternalFailure"})
+        limiters = cw_metric_ratelimit.new_limiters()
+        for limiter in limiters.values():
+            limiter.sleep = lambda seconds: None
+        cwHelper = cw_metric_helper.CloudWatch(client=client, limiters=limiters)
+
+        summary = cwHelper.list_metrics(include_metrics=False)["Summary"]
+
+        self.assertEqual(summary["TotalMetricCount"], 1000)
+        stats = cwHelper.rate_limit_stats()["list_metrics"]
+        self.assertEqual(stats["Retries"], 1)
+        self.assertEqual(stats["Failures"], 0)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import json
+import unittest
+
+import cw_metric_helper
+import cw_metric_sketch
+from tests.unit.fake_cloudwatch import FakeCloudWatchClient, make_metrics
+
+
+class TestHyperLogLog(unittest.TestCase):
+    def test_estimate_within_error(self):
+        sketch = cw_metric_sketch.HyperLogLog(precision=12)
+        for idx in range(50000):
+            sketch.add("value-%d" % idx)
+            sketch.add("value-%d" % (idx // 2))
+
+        self.assertEqual(len(sketch.registers), 4096)
+        self.assertLess(abs(sketch.count() - 50000) / 50000.0, 0.05)
+
+    def test_small_cardinality(self):
+        sketch = cw_metric_sketch.HyperLogLog()
+        for name in ["a", "b", "c", "a"]:
+            sketch.add(name)
+        self.assertEqual(sketch.count(), 3)
+
+    def test_merge_is_lossless(self):
+        left = cw_metric_sketch.HyperLogLog()
+        right = cw_metric_sketch.HyperLogLog()
+        both = cw_metric_sketch.HyperLogLog()
+        for idx in range(20000):
+            (left if idx % 2 else right).add(str(idx))
+            both.add(str(idx))
+
+        self.assertEqual(left.merge(right).registers, both.registers)
+
+    def test_merge_rejects_precision_mismatch(self):
+        with self.assertRaises(ValueError):
+            cw_metric_sketch.HyperLogLog(10).merge(cw_metric_sketch.HyperLogLog(12))
+
+
+class TestSketchSummary(unittest.TestCase):
+    def test_list_metrics_sketches(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(2000), page_size=100)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        result = cwHelper.list_metrics(include_metrics=False, sketches=True)
+        estimates = result["Sketches"].estimates()
+
+        self.assertNotIn("UniqueMetricNames", result["Summary"]["111111111111"])
+        self.assertEqual(estimates["111111111111"]["UniqueMetricNames"], 7)
+        self.assertAlmostEqual(estimates["111111111111"]["UniqueDimensionSets"], 1000, delta=50)
+        self.assertAlmostEqual(
+            estimates["111111111111"]["UniqueDimensionValues"]["InstanceId"], 1000, delta=50)
+        self.assertEqual(
+            estimates["111111111111"]["Namespaces"]["AWS/EC2"]["UniqueMetricNames"], 7)
+
+    def test_sharded_sketches_match_serial(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(2000), page_size=100)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        serial = cwHelper.list_metrics(include_metrics=False, sketches=True)
+        sharded = cwHelper.list_metrics_sharded(account_ids=["111111111111", "222222222222"],
+                                                sketches=True)
+
+        self.assertEqual(sharded["Summary"], serial["Summary"])
+        self.assertEqual(sharded["Sketches"].estimates(), serial["Sketches"].estimates())
+
+    def test_serialization_round_trip(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(500), page_size=100)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+        sketches = cwHelper.list_metrics(include_metrics=False, sketches=True)["Sketches"]
+
+        data = json.loads(json.dumps(sketches.to_dict()))
+        restored = cw_metric_sketch.SketchSummary.from_dict(data)
+
+        self.assertEqual(restored.estimates(), sketches.estimates())
+
+
+class TestSpaceSaving(unittest.TestCase):
+    def stream(self):
+        # Item i occurs 1000 // (i + 1) times, plus a long tail of singletons.
+        items = []
+        for idx in range(20):
+            items.extend(["item-%d" % idx] * (1000 // (idx + 1)))
+        items.extend("tail-%d" % idx for idx in range(5000))
+        return items
+
+    def test_top_items_found(self):
+        counter = cw_metric_sketch.SpaceSaving(capacity=50)
+        for item in self.stream():
+            counter.add(item)
+
+        top = counter.top(5)
+        self.assertEqual([item for item, _, _ in top], ["item-%d" % idx for idx in range(5)])
+        for item, count, error in top:
+            trueCount = 1000 // (int(item.split("-")[1]) + 1)
+            self.assertTrue(count - error <= trueCount <= count)
+        self.assertEqual(len(counter.counts), 50)
+
+    def test_merge(self):
+        left = cw_metric_sketch.SpaceSaving(capacity=50)
+        right = cw_metric_sketch.SpaceSaving(capacity=50)
+        for idx, item in enumerate(self.stream()):
+            (left if idx % 2 else right).add(item)
+
+        top = left.merge(right).top(3)
+        self.assertEqual([item for item, _, _ in top], ["item-0", "item-1", "item-2"])
+        self.assertEqual(top[0][1], 1000)
+
+
+class TestHeavyHitters(unittest.TestCase):
+    def test_list_metrics_heavy_hitters(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(2100), page_size=100)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        report = cwHelper.list_metrics(include_metrics=False,
+                                       heavy_hitters=3)["HeavyHitters"].report()
+
+        self.assertEqual(len(report["TopMetricNames"]), 3)
+        self.assertEqual(report["TopMetricNames"][0]["SeriesCount"], 150)
+        self.assertEqual(report["TopDimensionKeys"][0]["Name"], "InstanceId")
+        self.assertAlmostEqual(report["TopDimensionKeys"][0]["DistinctValues"], 2100, delta=150)
+        self.assertEqual(report["TopNamespacesByAccount"]["111111111111"],
+                         [{"Namespace": "AWS/EC2", "MetricCount": 1050, "Error": 0}])
+
+    def test_sharded_report_matches_serial(self):
+        client = FakeCloudWatchClient(metrics=make_metrics(2100), page_size=100)
+        cwHelper = cw_metric_helper.CloudWatch(client=client)
+
+        serial = cwHelper.list_metrics(include_metrics=False, heavy_hitters=5)
+        sharded = cwHelper.list_metrics_sharded(account_ids=["111111111111", "222222222222"],
+                                                heavy_hitters=5)
+
+        self.assertEqual(sharded["HeavyHitters"].report()["TopNamespacesByAccount"],
+                         serial["HeavyHitters"].report()["TopNamespacesByAccount"])
+        self.assertEqual(sorted(entry["SeriesCount"] for entry in
+                                sharded["HeavyHitters"].report()["TopMetricNames"]),
+                         sorted(entry["SeriesCount"] for entry in
+                                serial["HeavyHitters"].report()["TopMetricNames"]))
@@ -9,24 +9,39 @@ It allows applications to connect to MCP servers, discover available tools,
 execute tool calls, and process queries through AWS Bedrock models with tool use capabilities.
 
 The library supports both HTTP streaming and standard I/O communication with MCP servers,
-and provides mechanisms for handling server logs and elicitation callbacks.
+and provides mechanisms for handling server logs and elicitation callbacks. A client
+can be connected to several servers at once. Their tools are merged into one tool
+configuration, and every tool call is routed to the server that provides the tool.
 
 Dependencies:
     - boto3: For AWS Bedrock API interactions
     - mcp: Core MCP library for client-server communication
+
+boto3 clients are synchronous. Bedrock calls run on a thread pool owned by
+the client, so the event loop keeps serving MCP sessions and other
+conversations while a model call is in flight.
 """
 
-#import asyncio
+import asyncio
 import boto3
 import json
 import logging
 import os
-from mcp import ClientSession
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from urllib.parse import urlparse
+from botocore.config import Config
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
 from mcp.client.streamable_http import streamablehttp_client
 from mcp.types import ElicitResult as MCPElicitResult
 from mcp.client.session import ElicitationFnT
 from mcp.shared.context import RequestContext
 from mcp.types import ElicitRequestParams
+from mcp.types import ServerNotification, ToolListChangedNotification
 
 
 
@@ -78,6 +93,108 @@ def get_logger(level=logging.INFO,
 
 
 
+class MCPServerConnection():
+    """
+    Connection to one MCP server.
+
+    The transport and session contexts of a server are entered and exited by
+    one task (run), as the anyio based MCP transports require. The task
+    holds the connection open until close is called.
+    """
+
+    def __init__(self, name: str, transport: str, params: dict):
+        """
+        Initialize the connection.
+
+        Args:
+            name (str): Name of the server, unique per client
+            transport (str): "http" (Streamable HTTP) or "stdio"
+            params (dict): Transport parameters, "url" and "headers" for http,
+                "command", "args" and "env" for stdio
+        """
+        self.name = name
+        self.transport = transport
+        self.params = params
+        self.session = None
+
+        # Tool catalog of the server
+        self.tools = None
+        self.toolsFetchedAt = None
+        self.toolsVersion = 0
+        self.toolsLock = asyncio.Lock()
+
+        self._task = None
+        self._closing = asyncio.Event()
+
+    async def run(self, client, ready: asyncio.Future):
+        """
+        Connect, initialize the session and hold it open until close.
+
+        Args:
+            client (MCPClient): Client handling the server callbacks
+            ready (asyncio.Future): Set to this connection once the session is
+                initialized, or to the connection error
+        """
+        async def messageHandler(message):
+            await client.serverMessageHandler(message, serverName=self.name)
+
+        try:
+            async with AsyncExitStack() as stack:
+                if self.transport == "http":
+                    readStream, writeStream, _ = await stack.enter_async_context(
+                        streamablehttp_client(url=self.params["url"],
+                                              headers=self.params.get("headers") or {}))
+                else:
+                    serverParams = StdioServerParameters(command=self.params["command"],
+                                                         args=self.params.get("args") or [],
+                                                         env=self.params.get("env"))
+                    readStream, writeStream = await stack.enter_async_context(stdio_client(serverParams))
+
+                session = await stack.enter_async_context(
+                    ClientSession(readStream,
+                                  writeStream,
+                                  elicitation_callback=client.serverElicitationCallbackHandler,
+                                  logging_callback=client.serverLogHandler,
+                                  message_handler=messageHandler))
+                await session.initialize()
+                self.session = session
+                ready.set_result(self)
+
+                await self._closing.wait()
+        except Exception as err:
+            if not ready.done():
+                ready.set_exception(err)
+            else:
+                client.logger.error("Server %s connection failed: %s" % (self.name, err))
+        finally:
+            self.session = None
+            client.dropServer(self)
+
+    async def connect(self, client, timeout: float = None):
+        """
+        Start the connection task and wait until the session is initialized.
+
+        Raises:
+            asyncio.TimeoutError: The server did not connect within timeout seconds
+            Exception: Connection error of the transport or session
+        """
+        ready = asyncio.get_running_loop().create_future()
+        self._task = asyncio.ensure_future(self.run(client, ready))
+        try:
+            await asyncio.wait_for(asyncio.shield(ready), timeout=timeout)
+        except BaseException:
+            self._task.cancel()
+            raise
+
+    async def close(self):
+        """
+        Close the session and the transport.
+        """
+        self._closing.set()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
 class MCPClient():
     """
     Client implementation for the Model Context Protocol (MCP).
@@ -91,6 +208,11 @@ class MCPClient():
                  modelId="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
                  loggingCallback=None,
                  elicitationCallback=None,
+                 toolCacheTtl=None,
+                 maxToolConcurrency=8,
+                 toolTimeout=60,
+                 maxModelConcurrency=8,
+                 modelReadTimeout=300,
                  verbose=True):
         """
         Initialize MCP Client.
@@ -101,6 +223,17 @@ class MCPClient():
             modelId (str): Bedrock model ID to use for queries
             loggingCallback (callable, optional): Callback function for server logs
             elicitationCallback (callable, optional): Callback function for handling elicitation requests
+            toolCacheTtl (float, optional): Seconds the cached tool catalog stays valid. The
+                catalog is always refreshed when the server sends a tools/list_changed
+                notification (default: None, no expiry)
+            maxToolConcurrency (int): Maximum number of tool calls running at the same
+                time (default: 8)
+            toolTimeout (float, optional): Seconds a tool call may run before it fails
+                with an error result (default: 60, None for no limit)
+            maxModelConcurrency (int): Maximum number of Bedrock calls in flight at the
+                same time, which is also the size of the Bedrock thread pool and HTTP
+                connection pool (default: 8)
+            modelReadTimeout (int): Seconds to wait for data from Bedrock (default: 300)
             verbose (bool): Enable verbose logging if True (default: True)
         """
         self.modelId = modelId
@@ -115,24 +248,126 @@ class MCPClient():
         self.elicitationCallback = elicitationCallback
 
         self.logger = get_logger(name="MCPClient", level=logLevel)
+
+        # Bedrock
+        self.maxModelConcurrency = maxModelConcurrency
+        self.modelReadTimeout = modelReadTimeout
         self.bedrockClient = self.__getBotoBedrockClient()
+        self._bedrockExecutor = ThreadPoolExecutor(max_workers=maxModelConcurrency,
+                                                   thread_name_prefix="bedrock")
+        self._modelSemaphore = asyncio.Semaphore(maxModelConcurrency)
 
-        # MCP Stream
-        self._streamsContext = None
-        self._sessionContext = None
+        # MCP servers by name, in connection order. session is the session of
+        # the first server, for callers that talk to one server directly.
+        self.servers = {}
         self.session = None
+
+        # Tool catalog cache: the merged tools by tool name, and the routes of
+        # tool names to (server name, server tool name).
+        self.toolCacheTtl = toolCacheTtl
+        self._tools = None
+        self._toolConfig = None
+        self._toolRoutes = {}
+
+        # Tool execution
+        self.toolTimeout = toolTimeout
+        self._toolSemaphore = asyncio.Semaphore(maxToolConcurrency)
         self.logger.info("MCP Client Initialized!")
 
     def __getBotoBedrockClient(self):
         """
         Create and return a boto3 client for the Bedrock runtime service.
         
+        The client is shared by the threads of the Bedrock thread pool, so its
+        HTTP connection pool holds a connection per thread and connections are
+        reused across calls.
+
         Returns:
             boto3.client: Configured Bedrock runtime client
         """
+        config = Config(max_pool_connections=self.maxModelConcurrency,
+                        connect_timeout=10,
+                        read_timeout=self.modelReadTimeout,
+                        tcp_keepalive=True,
+                        retries={"mode": "adaptive", "max_attempts": 4})
         session = boto3.Session(region_name=self.region, profile_name=self.profile)
-        client = session.client("bedrock-runtime")
+        client = session.client("bedrock-runtime", config=config)
         return client
+
+    async def converse(self, **kwargs) -> dict:
+        """
+        Call the Bedrock Converse API without blocking the event loop.
+
+        The call runs on the Bedrock thread pool. At most maxModelConcurrency
+        calls are in flight, further callers wait without holding a thread.
+
+        Args:
+            kwargs: Converse API parameters
+
+        Returns:
+            dict: Converse API response
+        """
+        loop = asyncio.get_running_loop()
+        async with self._modelSemaphore:
+            return await loop.run_in_executor(self._bedrockExecutor,
+                                              lambda: self.bedrockClient.converse(**kwargs))
+
+    async def converseStream(self, **kwargs):
+        """
+        Call the Bedrock ConverseStream API and yield its stream events.
+
+        A thread of the Bedrock thread pool reads the event stream and hands
+        the events to the event loop as they arrive. The call holds one of
+        the maxModelConcurrency slots until the stream ends or the caller
+        stops iterating. Stopping closes the event stream, which ends a
+        read that is waiting for the next event.
+
+        Args:
+            kwargs: ConverseStream API parameters
+
+        Yields:
+            dict: ConverseStream events (messageStart, contentBlockDelta, ...)
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        streamEnd = object()
+        stopped = threading.Event()
+        streams = []
+
+        def readStream():
+            try:
+                response = self.bedrockClient.converse_stream(**kwargs)
+                streams.append(response["stream"])
+                # The caller may have stopped before the stream was published.
+                if stopped.is_set():
+                    response["stream"].close()
+                    return
+                for event in response["stream"]:
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+            except Exception as err:
+                if not stopped.is_set():
+                    loop.call_soon_threadsafe(queue.put_nowait, err)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, streamEnd)
+
+        async with self._modelSemaphore:
+            reader = loop.run_in_executor(self._bedrockExecutor, readStream)
+            try:
+                while True:
+                    event = await queue.get()
+                    if event is streamEnd:
+                        break
+                    if isinstance(event, Exception):
+                        raise event
+                    yield event
+            finally:
+                # Close the stream here, the reader may be blocked waiting for an event.
+                stopped.set()
+                for stream in streams:
+                    stream.close()
+                await reader
     
     async def serverLogHandler(self, msg):
         """
@@ -148,6 +383,22 @@ class MCPClient():
         if self.loggingCallback:
             self.loggingCallback(msg.data)
 
+    async def serverMessageHandler(self, message, serverName: str = None):
+        """
+        Handle messages from the MCP server that have no dedicated callback.
+
+        A tools/list_changed notification invalidates the cached tool catalog
+        of the server, so the next query lists its tools again.
+
+        Args:
+            message: Server request responder, notification or exception
+            serverName (str, optional): Name of the server that sent the message
+        """
+        if isinstance(message, ServerNotification) and \
+                isinstance(message.root, ToolListChangedNotification):
+            self.logger.info("Server %s tool list changed" % serverName)
+            self.invalidateToolCache(serverName)
+
     async def serverElicitationCallbackHandler(self, 
                                                requestContext: RequestContext,  
                                                requestParams: ElicitRequestParams):
@@ -196,90 +447,322 @@ class MCPClient():
                                content=userResponse)
 
     async def serverConnectStreamableHttp(self, serverUrl: str = None,
-                                          headers: dict = {}):
+                                          headers: dict = {},
+                                          name: str = None):
         """
         Connect to the MCP Server over Streamable HTTP Transport.
         
         This method establishes a connection to an MCP server using HTTP streaming,
-        sets up the client session, and initializes communication.
+        sets up the client session, and initializes communication. The server
+        is added to the servers of the client.
         
         Args:
             serverUrl (str): URL of the MCP server
             headers (dict): Optional HTTP headers to include in the connection
+            name (str, optional): Name of the server (default: host and port of the URL)
         """
         self.logger.info("Create streamable http Server connection to %s" % serverUrl)
-        self._streamsContext = streamablehttp_client(
-            url=serverUrl,
-            headers=headers or {},
-        )
-        read_stream, write_stream, _ = await self._streamsContext.__aenter__()
-
-        self._sessionContext = ClientSession(read_stream,
-                                             write_stream,
-                                             elicitation_callback=self.serverElicitationCallbackHandler,
-                                             logging_callback=self.serverLogHandler)
+        await self.connectServer({"name": name, "url": serverUrl, "headers": headers})
 
-        self.session: ClientSession = await self._sessionContext.__aenter__()
-
-        await self.session.initialize()
-
-    def serverConnectStdio(serverPath: str, args: str):
+    async def serverConnectStdio(self, serverPath: str, args: str = "",
+                                 name: str = None, env: dict = None):
         """
         Connect to the MCP Server running locally over STDIO.
         
-        This method establishes a connection to a local MCP server using
-        standard input/output for communication.
+        This method starts a local MCP server process and communicates with it
+        over its standard input/output. The server is added to the servers of
+        the client.
         
         Args:
             serverPath (str): Path to the server executable
             args (str): Command-line arguments to pass to the server
-            
-        Note:
-            This method is currently a placeholder and not implemented.
+            name (str, optional): Name of the server (default: file name of serverPath)
+            env (dict, optional): Environment of the server process
+        """
+        self.logger.info("Create stdio Server connection to %s %s" % (serverPath, args))
+        await self.connectServer({"name": name, "command": serverPath,
+                                  "args": args.split() if isinstance(args, str) else args,
+                                  "env": env})
+
+    def _serverName(self, server: dict) -> str:
+        name = server.get("name")
+        if not name:
+            if "url" in server:
+                name = urlparse(server["url"]).netloc or server["url"]
+            else:
+                name = os.path.splitext(os.path.basename(server["command"]))[0]
+
+        # Default names of several servers on the same host or command.
+        uniqueName = name
+        suffix = 2
+        while not server.get("name") and uniqueName in self.servers:
+            uniqueName = "%s-%d" % (name, suffix)
+            suffix += 1
+
+        return uniqueName
+
+    async def connectServer(self, server: dict, timeout: float = None):
+        """
+        Connect to one MCP server and add it to the servers of the client.
+
+        Args:
+            server (dict): Server with an optional "name" and either a "url" (and
+                "headers") for Streamable HTTP or a "command" (and "args", "env")
+                for stdio
+            timeout (float, optional): Seconds to wait for the session to initialize
+
+        Returns:
+            MCPServerConnection: Connection of the server
+
+        Raises:
+            ValueError: A server of the same name is connected already
+        """
+        name = self._serverName(server)
+        if name in self.servers:
+            raise ValueError("MCP server %s is connected already" % name)
+
+        transport = "http" if "url" in server else "stdio"
+        connection = MCPServerConnection(name, transport, server)
+        # Reserve the name while connecting, so parallel connects cannot take it.
+        self.servers[name] = connection
+        try:
+            await connection.connect(self, timeout=timeout)
+        except BaseException:
+            self.servers.pop(name, None)
+            raise
+
+        if self.session is None:
+            self.session = connection.session
+        self.invalidateToolCache()
+        self.logger.info("Connected MCP server %s (%s)" % (name, transport))
+        return connection
+
+    async def connectServers(self, servers: list, timeout: float = 30) -> list:
+        """
+        Connect to many MCP servers in parallel.
+
+        A server that fails or does not connect within timeout seconds is
+        logged and skipped, it does not hold up or fail the other servers.
+
+        Args:
+            servers (list): Server dictionaries (see connectServer)
+            timeout (float, optional): Seconds to wait for each server (default: 30)
+
+        Returns:
+            list: Names of the connected servers
+        """
+        results = await asyncio.gather(*[self.connectServer(server, timeout=timeout)
+                                         for server in servers],
+                                       return_exceptions=True)
+        connected = []
+        for server, result in zip(servers, results):
+            if isinstance(result, BaseException):
+                self.logger.error("Failed to connect MCP server %s: %r" %
+                                  (server.get("name") or server.get("url") or server.get("command"), result))
+                continue
+            connected.append(result.name)
+
+        return connected
+
+    def dropServer(self, connection: MCPServerConnection):
+        """
+        Remove a closed or failed server connection from the client.
+        """
+        if self.servers.get(connection.name) is not connection:
+            return
+
+        del self.servers[connection.name]
+        self.session = next((other.session for other in self.servers.values()
+                             if other.session is not None), None)
+        self.invalidateToolCache()
+
+    def invalidateToolCache(self, serverName: str = None):
+        """
+        Drop the cached tool catalog and tool configuration.
+
+        The next call to listToolNames or createToolConfig lists the tools
+        on the server again.
+
+        Args:
+            serverName (str, optional): Only drop the tools of this server
+                (default: the tools of every server)
+        """
+        for connection in self.servers.values():
+            if serverName is None or connection.name == serverName:
+                connection.toolsVersion += 1
+                connection.tools = None
+                connection.toolsFetchedAt = None
+        self._tools = None
+        self._toolConfig = None
+
+    def _toolCacheValid(self, connection: MCPServerConnection) -> bool:
+        if connection.tools is None:
+            return False
+        if self.toolCacheTtl is None:
+            return True
+        return time.monotonic() - connection.toolsFetchedAt < self.toolCacheTtl
+
+    async def _listServerTools(self, connection: MCPServerConnection, refresh: bool) -> list:
+        """
+        Return the tools of one server from its tool catalog cache.
+
+        Concurrent callers wait for one list_tools request instead of
+        sending their own.
+        """
+        if not refresh and self._toolCacheValid(connection):
+            return connection.tools
+
+        async with connection.toolsLock:
+            # Another caller may have refreshed the catalog while we waited.
+            if not refresh and self._toolCacheValid(connection):
+                return connection.tools
+            if connection.session is None:
+                raise ConnectionError("MCP server %s is not connected" % connection.name)
+
+            version = connection.toolsVersion
+            fetchedAt = time.monotonic()
+            tools = []
+            cursor = None
+            while True:
+                response = await connection.session.list_tools(cursor=cursor)
+                tools.extend(response.tools)
+                cursor = response.nextCursor
+                if not cursor:
+                    break
+
+            self.logger.info("Listed %d tools of server %s" % (len(tools), connection.name))
+            # Only cache the catalog if the tool list did not change
+            # while it was being listed.
+            if version == connection.toolsVersion:
+                connection.tools = tools
+                connection.toolsFetchedAt = fetchedAt
+
+            return tools
+
+    @staticmethod
+    def _bedrockToolName(name: str) -> str:
+        # Bedrock tool names are limited to letters, digits, _ and -.
+        return re.sub(r"[^a-zA-Z0-9_-]", "_", name)[:64]
+
+    def _mergeTools(self, serverTools: list) -> dict:
+        """
+        Merge the tools of all servers under collision safe Bedrock tool names.
+
+        A tool keeps its own name if no other server offers a tool of that
+        name, otherwise it is prefixed with its server name.
+
+        Args:
+            serverTools (list): (server name, list of MCP tools) in server order
+
+        Returns:
+            dict: Tool name -> (server name, MCP tool)
+        """
+        nameCounts = {}
+        for _, tools in serverTools:
+            for tool in tools:
+                toolName = self._bedrockToolName(tool.name)
+                nameCounts[toolName] = nameCounts.get(toolName, 0) + 1
+
+        merged = {}
+        for serverName, tools in serverTools:
+            for tool in tools:
+                toolName = self._bedrockToolName(tool.name)
+                if nameCounts[toolName] > 1:
+                    toolName = self._bedrockToolName("%s__%s" % (serverName, tool.name))
+                uniqueName = toolName
+                suffix = 2
+                while uniqueName in merged:
+                    uniqueName = "%s_%d" % (toolName[:60], suffix)
+                    suffix += 1
+                merged[uniqueName] = (serverName, tool)
+
+        return merged
+
+    async def getTools(self, refresh: bool = False) -> dict:
+        """
+        Return the tools of all MCP servers from the tool catalog cache.
+
+        A server is only asked for its tools when its cache is empty, after
+        a tools/list_changed notification, after the TTL expired or when
+        refresh is set. The servers are asked in parallel, and a server that
+        fails to list its tools is left out until the next call.
+
+        Args:
+            refresh (bool): List the tools on the servers even if the cache is valid
+
+        Returns:
+            dict: Tool name -> (server name, MCP tool), see _mergeTools
+        """
+        connections = list(self.servers.values())
+        if not refresh and self._tools is not None and \
+                all(self._toolCacheValid(connection) for connection in connections):
+            return self._tools
+
+        results = await asyncio.gather(*[self._listServerTools(connection, refresh)
+                                         for connection in connections],
+                                       return_exceptions=True)
+        serverTools = []
+        complete = True
+        for connection, result in zip(connections, results):
+            if isinstance(result, BaseException):
+                self.logger.error("Failed to list tools of server %s: %r" % (connection.name, result))
+                complete = False
+                continue
+            serverTools.append((connection.name, result))
+
+        tools = self._mergeTools(serverTools)
+        toolConfig = self._buildToolConfig(tools)
+        # Keep the routes of the last catalog, so tool calls of a model turn
+        # still resolve after the cache was invalidated.
+        self._toolRoutes.update({toolName: (serverName, tool.name)
+                                 for toolName, (serverName, tool) in tools.items()})
+        if complete and all(connection.tools is not None for connection in connections):
+            self._tools = tools
+            self._toolConfig = toolConfig
+
+        return tools
+
+    async def refreshTools(self) -> dict:
+        """
+        List the tools on the servers and replace the cached tool catalog.
+
+        Returns:
+            dict: Tool name -> (server name, MCP tool)
         """
-        pass
+        self.invalidateToolCache()
+        return await self.getTools(refresh=True)
 
     async def listToolNames(self):
         """
         Return the list of tools available to this MCP client.
         
-        This method queries the connected MCP server for available tools
-        and returns a list of tool objects with name and description.
+        This method returns the tools of the connected MCP servers, from the
+        tool catalog cache, as a list of tool objects with name, description
+        and the server providing the tool.
         
         Returns:
             list: List of dictionaries containing tool names and descriptions
         """
         availableTools = []
-        response = await self.session.list_tools()
-        for tool in response.tools:
+        for toolName, (serverName, tool) in (await self.getTools()).items():
             obj = {}
-            obj["name"] = tool.name
+            obj["name"] = toolName
             obj["description"] = tool.description
+            obj["server"] = serverName
             availableTools.append(obj)
         
         return availableTools
 
-    async def createToolConfig(self) -> str:
+    def _buildToolConfig(self, tools: dict) -> dict:
         """
-        Create a tool configuration for use with Bedrock models.
-        
-        This method queries the MCP server for available tools and formats them
-        into a configuration structure that can be passed to Bedrock models
-        to enable tool use capabilities.
-        
-        Returns:
-            dict: Tool configuration dictionary compatible with Bedrock API
+        Format merged MCP tools as a Bedrock tool configuration.
         """
-        # List tools.
-        response = await self.session.list_tools()
-
-        # Get available tools.
         toolConfig = {
             "tools": []
         }
-        for tool in response.tools:
+        for toolName, (_, tool) in tools.items():
             obj = {"toolSpec": {}}
-            obj["toolSpec"]["name"] = tool.name
+            obj["toolSpec"]["name"] = toolName
             obj["toolSpec"]["description"] = tool.description
             obj["toolSpec"]["inputSchema"] = {
                 "json": {
@@ -299,10 +782,57 @@ class MCPClient():
             toolConfig["tools"].append(obj)
 
         return toolConfig
+
+    async def createToolConfig(self, refresh: bool = False) -> dict:
+        """
+        Create a tool configuration for use with Bedrock models.
+        
+        This method formats the tools of the MCP servers into a configuration
+        structure that can be passed to Bedrock models to enable tool use
+        capabilities. The configuration is built once per tool catalog and
+        cached with it (see getTools).
+        
+        Args:
+            refresh (bool): List the tools on the servers even if the cache is valid
+
+        Returns:
+            dict: Tool configuration dictionary compatible with Bedrock API
+        """
+        tools = await self.getTools(refresh=refresh)
+        if self._toolConfig is not None and tools is self._tools:
+            return self._toolConfig
+
+        return self._buildToolConfig(tools)
+
+    async def callTool(self, toolName: str, toolArgs: dict):
+        """
+        Call a tool on the MCP server that provides it.
+
+        Args:
+            toolName (str): Tool name of the tool configuration
+            toolArgs (dict): Arguments to pass to the tool
+
+        Returns:
+            CallToolResult: Result of the MCP tool call
+
+        Raises:
+            KeyError: No connected server provides the tool
+        """
+        if toolName not in self._toolRoutes:
+            await self.getTools()
+        if toolName not in self._toolRoutes:
+            raise KeyError("Unknown tool %s" % toolName)
+
+        serverName, serverToolName = self._toolRoutes[toolName]
+        connection = self.servers.get(serverName)
+        if connection is None or connection.session is None:
+            raise ConnectionError("MCP server %s of tool %s is not connected" % (serverName, toolName))
+
+        return await connection.session.call_tool(serverToolName, toolArgs)
     
     async def directServerToolCall(self, toolName: str, toolArgs: dict):
         """
-        Call a tool provided by the MCP server directly.
+        Call a tool provided by an MCP server directly.
         
         This method allows direct invocation of server tools without going through
         an LLM. This can be useful in cases where we know what we want to do and 
@@ -318,7 +848,7 @@ class MCPClient():
         self.logger.info("Invoke Server Tool %s (%s)" % (toolName, toolArgs))
         # Execute tool call.
 
-        result = await self.session.call_tool(toolName, toolArgs)
+        result = await self.callTool(toolName, toolArgs)
         resultValue = json.loads(result.content[0].text)
         if resultValue["tool_run_status"] != "success":
             self.logger.error("Tool run status is not successful")
@@ -326,25 +856,105 @@ class MCPClient():
         
         return resultValue["result"]
 
-    async def processQuery(self, query: str, systemPrompt: str, messages: str = []) -> str:
+    async def runTool(self, toolUse: dict) -> dict:
+        """
+        Run the tool of a Bedrock toolUse block and return its toolResult.
+
+        The call waits for a free slot (maxToolConcurrency) and fails after
+        toolTimeout seconds. Failures are returned as error results, so the
+        model can see them and carry on.
+
+        Args:
+            toolUse (dict): toolUse block with the toolUseId, name and input
+
+        Returns:
+            dict: toolResult block for the toolUseId
+        """
+        toolName = toolUse["name"]
+        toolArgs = toolUse["input"]
+        toolUseId = toolUse["toolUseId"]
+        self.logger.info("LLM Tool identified: %s (%s)" % (toolName, toolArgs))
+
+        try:
+            async with self._toolSemaphore:
+                result = await asyncio.wait_for(self.callTool(toolName, toolArgs),
+                                                timeout=self.toolTimeout)
+        except asyncio.TimeoutError:
+            self.logger.error("Tool %s timed out after %s seconds" % (toolName, self.toolTimeout))
+            return {
+                "toolUseId": toolUseId,
+                "content": [{"text": "Tool %s timed out after %s seconds" % (toolName, self.toolTimeout)}],
+                "status": "error"
+            }
+        except Exception as err:
+            self.logger.error("Tool %s failed: %s" % (toolName, err))
+            return {
+                "toolUseId": toolUseId,
+                "content": [{"text": "Tool %s failed: %s" % (toolName, err)}],
+                "status": "error"
+            }
+
+        resultText = result.content[0].text if result.content else ""
+        if result.isError:
+            self.logger.error("Tool %s returned an error: %s" % (toolName, resultText))
+            return {
+                "toolUseId": toolUseId,
+                "content": [{"text": resultText}],
+                "status": "error"
+            }
+
+        try:
+            resultValue = json.loads(resultText)["result"]
+        except (ValueError, TypeError, KeyError):
+            resultValue = resultText
+
+        return {
+            "toolUseId": toolUseId,
+            "content": [{"text": "Result is %s " % (str(resultValue))}]
+        }
+
+    async def runTools(self, toolUses: list) -> dict:
+        """
+        Run the tools of all toolUse blocks of a model turn concurrently.
+
+        Args:
+            toolUses (list): toolUse blocks of the assistant message
+
+        Returns:
+            dict: User message with one toolResult per toolUse, in the same order
+        """
+        self.logger.info("LLM request tool use: %d tools" % len(toolUses))
+        toolResults = await asyncio.gather(*[self.runTool(toolUse) for toolUse in toolUses])
+
+        return {
+            "role": "user",
+            "content": [{"toolResult": toolResult} for toolResult in toolResults]
+        }
+
+    async def processQuery(self, query: str, systemPrompt: str, messages: list = None) -> str:
         """
         Process a user query using Bedrock with MCP tool integration.
         
         This method sends the user query to a Bedrock model, handles any tool use
         requests from the model by calling the appropriate MCP server tools, and
-        returns the final response.
+        returns the final response. All tools the model asks for in one turn
+        run concurrently and their results go back in one message.
         
         Args:
             query (str): User query to process
             systemPrompt (str): System prompt to provide context to the model
-            messages (list): Optional list of previous messages in the conversation
+            messages (list): Optional list of previous messages in the conversation,
+                extended with the messages of this query
             
         Returns:
             str: Final response text from the model
         """
         stopReason = None
+        if messages is None:
+            messages = []
 
-        self.systemPrompt = [
+        # Local to the query, concurrent queries may use other prompts.
+        system = [
             {
                 "text": systemPrompt
             }
@@ -359,43 +969,22 @@ class MCPClient():
         toolConfig = await self.createToolConfig()
 
         while stopReason != "end_turn":
-            response = self.bedrockClient.converse(
+            response = await self.converse(
                 modelId=self.modelId,
                 messages=messages,
-                system=self.systemPrompt,
+                system=system,
                 toolConfig=toolConfig)
 
             outputMessage = response["output"]["message"]
             messages.append(outputMessage)
 
             if response["stopReason"] == "tool_use":
-                self.logger.info("LLM request tool use")
                 stopReason = "tool_use"
-                toolInfo = {}
                 content = response["output"]["message"]["content"]
-                for contentObj in content:
-                    if "toolUse" in contentObj:
-                        toolInfo = contentObj["toolUse"]
-                        break
+                toolUses = [contentObj["toolUse"] for contentObj in content if "toolUse" in contentObj]
 
-                toolName = toolInfo["name"]
-                toolArgs = toolInfo["input"]
-                toolUseId = toolInfo["toolUseId"]
-                self.logger.info("LLM Tool identified: %s (%s)" % (toolName, toolArgs))
-
-                # Execute tool call.
-                result = await self.session.call_tool(toolName, toolArgs)
-                resultValue = json.loads(result.content[0].text)
-                toolResult = {
-                    "toolUseId": toolUseId,
-                    "content": [{"text": "Result is %s " % (str(resultValue["result"]))}]
-                }
-                toolResponseMessage = {
-                    "role": "user",
-                    "content": [
-                        {"toolResult": toolResult}
-                    ]
-                }
+                # Execute all tool calls of the turn and answer them in one message.
+                toolResponseMessage = await self.runTools(toolUses)
                 messages.append(toolResponseMessage)
             elif response["stopReason"] == "end_turn":
                 stopReason = "end_turn"
@@ -403,16 +992,131 @@ class MCPClient():
                 responseText = response["output"]["message"]["content"][0]
                 return responseText["text"]
 
+    async def processQueryStream(self, query: str, systemPrompt: str, messages: list = None):
+        """
+        Process a user query like processQuery, streaming the response text.
+
+        The model response is streamed with the Bedrock ConverseStream API and
+        text is yielded as soon as it arrives. The input of a toolUse block is
+        assembled from its streamed fragments and the tool starts as soon as
+        its block is complete, while the model may still be streaming the
+        rest of the turn. Once all tools of a turn returned, their results
+        are sent back and streaming continues with the next turn.
+
+        Args:
+            query (str): User query to process
+            systemPrompt (str): System prompt to provide context to the model
+            messages (list): Optional list of previous messages in the conversation,
+                extended with the messages of this query
+
+        Yields:
+            str: Text deltas of the model response
+        """
+        if messages is None:
+            messages = []
+
+        # Local to the query, concurrent queries may use other prompts.
+        system = [
+            {
+                "text": systemPrompt
+            }
+        ]
+        message = {
+            "role": "user",
+            "content": [{"text": "%s" % query}]
+        }
+        messages.append(message)
+
+        toolConfig = await self.createToolConfig()
+
+        while True:
+            # Content blocks of the assistant message by index, and the
+            # running tool calls of its toolUse blocks.
+            blocks = {}
+            toolTasks = {}
+            stopReason = None
+            try:
+                async for event in self.converseStream(modelId=self.modelId,
+                                                       messages=messages,
+                                                       system=system,
+                                                       toolConfig=toolConfig):
+                    if "contentBlockStart" in event:
+                        start = event["contentBlockStart"]["start"]
+                        if "toolUse" in start:
+                            blocks[event["contentBlockStart"]["contentBlockIndex"]] = {
+                                "toolUse": {
+                                    "toolUseId": start["toolUse"]["toolUseId"],
+                                    "name": start["toolUse"]["name"],
+                                    "input": ""
+                                }
+                            }
+                    elif "contentBlockDelta" in event:
+                        index = event["contentBlockDelta"]["contentBlockIndex"]
+                        delta = event["contentBlockDelta"]["delta"]
+                        if "text" in delta:
+                            blocks.setdefault(index, {"text": ""})["text"] += delta["text"]
+                            yield delta["text"]
+                        elif "toolUse" in delta:
+                            blocks[index]["toolUse"]["input"] += delta["toolUse"]["input"]
+                    elif "contentBlockStop" in event:
+                        index = event["contentBlockStop"]["contentBlockIndex"]
+                        if "toolUse" in blocks.get(index, {}):
+                            toolTasks[index] = self._startStreamedTool(blocks[index]["toolUse"])
+                    elif "messageStop" in event:
+                        stopReason = event["messageStop"]["stopReason"]
+
+                outputMessage = {
+                    "role": "assistant",
+                    "content": [blocks[index] for index in sorted(blocks)
+                                if blocks[index].get("text", True)]
+                }
+                messages.append(outputMessage)
+                if stopReason != "tool_use":
+                    return
+
+                self.logger.info("LLM request tool use: %d tools" % len(toolTasks))
+                toolResults = [await toolTasks[index] for index in sorted(toolTasks)]
+            finally:
+                for task in toolTasks.values():
+                    task.cancel()
+
+            messages.append({
+                "role": "user",
+                "content": [{"toolResult": toolResult} for toolResult in toolResults]
+            })
+
+    def _startStreamedTool(self, toolUse: dict) -> asyncio.Task:
+        """
+        Start the tool of a completely streamed toolUse block.
+
+        Decodes the assembled input JSON in place, so the block can go back to
+        the model as part of the assistant message.
+        """
+        try:
+            toolUse["input"] = json.loads(toolUse["input"]) if toolUse["input"] else {}
+        except ValueError as err:
+            message = "Tool %s input is not valid JSON: %s" % (toolUse["name"], err)
+            self.logger.error("%s (%s)" % (message, toolUse["input"]))
+            toolUse["input"] = {}
+
+            async def invalidInput():
+                return {
+                    "toolUseId": toolUse["toolUseId"],
+                    "content": [{"text": message}],
+                    "status": "error"
+                }
+            return asyncio.ensure_future(invalidInput())
+
+        return asyncio.ensure_future(self.runTool(toolUse))
+
     async def cleanup(self):
         """
-        Properly clean up the session and streams.
+        Properly clean up the sessions and streams.
         
         This method ensures that all resources associated with the MCP client
-        session are properly released, including closing the session context
-        and stream context.
+        sessions are properly released, including closing the session and
+        stream of every server, and shuts down the Bedrock thread pool.
         """
-        if self._sessionContext:
-            await self._sessionContext.__aexit__(None, None, None)
+        await asyncio.gather(*[connection.close() for connection in list(self.servers.values())])
 
-        if self._streamsContext:
-            await self._streamsContext.__aexit__(None, None, None)
+        self._bedrockExecutor.shutdown(wait=False)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextlib
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("mcp")
+
+import commonlibs.mcp_client_lib as mcp_client_lib  # noqa: E402
+from mcp.types import CallToolResult, ListToolsResult, TextContent, Tool  # noqa: E402
+
+
+class FakeSession():
+    """
+    Stand-in for an MCP ClientSession.
+
+    Every tool adds its "a" and "b" arguments, after "delay" seconds if
+    given. A tool named "slow" sleeps for an hour and a tool named "fail"
+    raises.
+    """
+    def __init__(self, toolNames=("add",), pageSize=None, listDelay=0, callDelay=0):
+        self.toolNames = list(toolNames)
+        self.pageSize = pageSize
+        self.listDelay = listDelay
+        self.callDelay = callDelay
+        self.listCursors = []
+        self.calls = []
+        self.running = 0
+        self.maxRunning = 0
+
+    async def list_tools(self, cursor=None):
+        self.listCursors.append(cursor)
+        await asyncio.sleep(self.listDelay)
+        start = int(cursor or 0)
+        end = len(self.toolNames) if self.pageSize is None else start + self.pageSize
+        return ListToolsResult(tools=[Tool(name=name, description="Add two numbers",
+                                           inputSchema={"type": "object", "properties": {}})
+                                      for name in self.toolNames[start:end]],
+                               nextCursor=str(end) if end < len(self.toolNames) else None)
+
+    async def call_tool(self, name, args):
+        self.calls.append((name, args))
+        self.running += 1
+        self.maxRunning = max(self.maxRunning, self.running)
+        try:
+            if name == "slow":
+                await asyncio.sleep(3600)
+            if name == "fail":
+                raise RuntimeError("tool crashed")
+            await asyncio.sleep(args.get("delay", self.callDelay))
+        finally:
+            self.running -= 1
+
+        return CallToolResult(content=[TextContent(type="text",
+                                                   text=json.dumps({"result": args["a"] + args["b"]}))])
+
+
+class FakeEventStream():
+    """
+    Event stream that blocks after its events until closed, if hold is set.
+    """
+    def __init__(self, events, hold=False):
+        self.events = events
+        self.hold = hold
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        yield from self.events
+        if self.hold:
+            self.closed.wait(10)
+            raise ConnectionError("stream closed")
+
+    def close(self):
+        self.closed.set()
+
+
+def text_events(text):
+    return [
+        {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": text}}},
+        {"contentBlockStop": {"contentBlockIndex": 0}},
+        {"messageStop": {"stopReason": "end_turn"}}
+    ]
+
+
+def tool_events(toolUseId, inputFragments):
+    events = [{"contentBlockStart": {"contentBlockIndex": 0,
+                                     "start": {"toolUse": {"toolUseId": toolUseId, "name": "add"}}}}]
+    for fragment in inputFragments:
+        events.append({"contentBlockDelta": {"contentBlockIndex": 0,
+                                             "delta": {"toolUse": {"input": fragment}}}})
+    events.append({"contentBlockStop": {"contentBlockIndex": 0}})
+    events.append({"messageStop": {"stopReason": "tool_use"}})
+    return events
+
+
+class TestMCPClient(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def in_tmp_path(self, tmp_path, monkeypatch):
+        # The client logger writes ./mcpclient.log.
+        monkeypatch.chdir(tmp_path)
+
+    def get_client(self, sessions=None, **kwargs):
+        """
+        Return a client connected to fake sessions, by server name.
+        """
+        with mock.patch.object(mcp_client_lib.boto3, "Session"):
+            client = mcp_client_lib.MCPClient(verbose=False, **kwargs)
+        for name, session in (sessions or {"calculator": FakeSession()}).items():
+            connection = mcp_client_lib.MCPServerConnection(name, "http", {})
+            connection.session = session
+            client.servers[name] = connection
+        client.session = next(iter(client.servers.values())).session
+        return client
+
+    def stream_turns(self, client, turns):
+        turns = iter(turns)
+        client.bedrockClient.converse_stream.side_effect = \
+            lambda **kwargs: {"stream": FakeEventStream(next(turns))}
+
+    def test_stopping_closes_waiting_stream(self):
+        client = self.get_client()
+        stream = FakeEventStream(text_events("5")[:1], hold=True)
+        client.bedrockClient.converse_stream.return_value = {"stream": stream}
+
+        async def run():
+            events = client.converseStream(modelId="model", messages=[])
+            first = await events.__anext__()
+            start = time.monotonic()
+            await events.aclose()
+            return first, time.monotonic() - start
+
+        first, elapsed = asyncio.run(run())
+        self.assertIn("contentBlockDelta", first)
+        self.assertTrue(stream.closed.is_set())
+        self.assertLess(elapsed, 1)
+
+    def test_stream_runs_streamed_tool(self):
+        client = self.get_client()
+        self.stream_turns(client, [tool_events("t1", ['{"a": 2,', ' "b": 3}']), text_events("5")])
+
+        async def run():
+            messages = []
+            text = [delta async for delta in client.processQueryStream("2 + 3", "Add", messages)]
+            await client.cleanup()
+            return text, messages
+
+        text, messages = asyncio.run(run())
+        self.assertEqual(text, ["5"])
+        self.assertEqual(client.servers["calculator"].session.calls, [("add", {"a": 2, "b": 3})])
+        self.assertEqual(messages[1]["content"][0]["toolUse"]["input"], {"a": 2, "b": 3})
+        self.assertEqual(messages[2]["content"][0]["toolResult"]["content"], [{"text": "Result is 5 "}])
+
+    def test_stream_invalid_tool_input(self):
+        client = self.get_client()
+        self.stream_turns(client, [tool_events("t1", ['{"a": 2,']), text_events("Sorry")])
+
+        async def run():
+            messages = []
+            text = [delta async for delta in client.processQueryStream("2 + 3", "Add", messages)]
+            await client.cleanup()
+            return text, messages
+
+        text, messages = asyncio.run(run())
+        self.assertEqual(text, ["Sorry"])
+        self.assertEqual(client.servers["calculator"].session.calls, [])
+        self.assertEqual(messages[1]["content"][0]["toolUse"]["input"], {})
+        toolResult = messages[2]["content"][0]["toolResult"]
+        self.assertEqual(toolResult["toolUseId"], "t1")
+        self.assertEqual(toolResult["status"], "error")
+        self.assertIn("not valid JSON", toolResult["content"][0]["text"])
+
+    def test_concurrent_queries_keep_their_prompt_and_history(self):
+        client = self.get_client()
+
+        def converse(**kwargs):
+            # Answer with the system prompt and history length the call was made with.
+            return {
+                "stopReason": "end_turn",
+                "output": {"message": {"role": "assistant", "content": [
+                    {"text": "%s %d" % (kwargs["system"][0]["text"], len(kwargs["messages"]))}]}}
+            }
+        client.bedrockClient.converse.side_effect = converse
+
+        async def run():
+            responses = await asyncio.gather(*[client.processQuery("query", "prompt%d" % index)
+                                               for index in range(4)])
+            await client.cleanup()
+            return responses
+
+        self.assertEqual(asyncio.run(run()), ["prompt0 1", "prompt1 1", "prompt2 1", "prompt3 1"])
+
+
+class TestToolCatalogCache(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def in_tmp_path(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+    get_client = TestMCPClient.get_client
+
+    def test_list_changed_invalidates_only_that_server(self):
+        sessions = {"a": FakeSession(["add_a"]), "b": FakeSession(["add_b"])}
+        client = self.get_client(sessions)
+        notification = mcp_client_lib.ServerNotification(mcp_client_lib.ToolListChangedNotification())
+
+        async def run():
+            await client.createToolConfig()
+            await client.createToolConfig()
+            await client.serverMessageHandler(notification, serverName="a")
+            return await client.createToolConfig()
+
+        toolConfig = asyncio.run(run())
+        self.assertEqual(len(sessions["a"].listCursors), 2)
+        self.assertEqual(len(sessions["b"].listCursors), 1)
+        self.assertEqual([tool["toolSpec"]["name"] for tool in toolConfig["tools"]], ["add_a", "add_b"])
+
+    def test_cache_expires_after_ttl(self):
+        session = FakeSession()
+        client = self.get_client({"calculator": session}, toolCacheTtl=60)
+        now = [1000.0]
+
+        async def run():
+            with mock.patch.object(mcp_client_lib.time, "monotonic", lambda: now[0]):
+                await client.getTools()
+                now[0] += 59
+                await client.getTools()
+                calls = len(session.listCursors)
+                now[0] += 1
+                await client.getTools()
+            return calls
+
+        self.assertEqual(asyncio.run(run()), 1)
+        self.assertEqual(len(session.listCursors), 2)
+
+    def test_concurrent_callers_share_one_listing(self):
+        sessions = {"a": FakeSession(["add_a"], listDelay=0.05),
+                    "b": FakeSession(["add_b"], listDelay=0.05)}
+        client = self.get_client(sessions)
+
+        async def run():
+            return await asyncio.gather(*[client.getTools() for _ in range(5)])
+
+        results = asyncio.run(run())
+        self.assertEqual([len(session.listCursors) for session in sessions.values()], [1, 1])
+        self.assertTrue(all(list(tools) == ["add_a", "add_b"] for tools in results))
+
+    def test_listing_follows_pagination(self):
+        session = FakeSession(["add", "sub", "mul", "div", "mod"], pageSize=2)
+        client = self.get_client({"calculator": session})
+
+        tools = asyncio.run(client.getTools())
+        self.assertEqual(list(tools), ["add", "sub", "mul", "div", "mod"])
+        self.assertEqual(session.listCursors, [None, "2", "4"])
+
+
+class TestRunTools(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def in_tmp_path(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+    get_client = TestMCPClient.get_client
+
+    @staticmethod
+    def tool_use(toolUseId, name="add", **args):
+        return {"toolUseId": toolUseId, "name": name, "input": dict({"a": 1, "b": 2}, **args)}
+
+    def test_results_keep_tool_use_order(self):
+        session = FakeSession(["add"])
+        client = self.get_client({"calculator": session})
+        toolUses = [self.tool_use("t%d" % i, a=i, delay=0.01 * (5 - i)) for i in range(5)]
+
+        message = asyncio.run(client.runTools(toolUses))
+        self.assertEqual(message["role"], "user")
+        self.assertEqual([block["toolResult"]["toolUseId"] for block in message["content"]],
+                         ["t0", "t1", "t2", "t3", "t4"])
+        self.assertEqual([block["toolResult"]["content"][0]["text"] for block in message["content"]],
+                         ["Result is %d " % (i + 2) for i in range(5)])
+
+    def test_concurrency_is_bounded(self):
+        session = FakeSession(["add"], callDelay=0.02)
+        client = self.get_client({"calculator": session}, maxToolConcurrency=3)
+
+        asyncio.run(client.runTools([self.tool_use("t%d" % i) for i in range(10)]))
+        self.assertEqual(len(session.calls), 10)
+        self.assertEqual(session.maxRunning, 3)
+
+    def test_slow_tool_times_out_without_cancelling_batch(self):
+        session = FakeSession(["add", "slow"])
+        client = self.get_client({"calculator": session}, toolTimeout=0.1)
+
+        message = asyncio.run(client.runTools([self.tool_use("t0", "slow"), self.tool_use("t1")]))
+        slow, fast = [block["toolResult"] for block in message["content"]]
+        self.assertEqual(slow["status"], "error")
+        self.assertIn("timed out", slow["content"][0]["text"])
+        self.assertNotIn("status", fast)
+        self.assertEqual(fast["content"][0]["text"], "Result is 3 ")
+
+    def test_failing_tool_returns_error_result(self):
+        session = FakeSession(["add", "fail"])
+        client = self.get_client({"calculator": session})
+
+        toolResult = asyncio.run(client.runTool(self.tool_use("t0", "fail")))
+        self.assertEqual(toolResult["toolUseId"], "t0")
+        self.assertEqual(toolResult["status"], "error")
+        self.assertIn("tool crashed", toolResult["content"][0]["text"])
+
+
+class TestToolRouting(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def in_tmp_path(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+    get_client = TestMCPClient.get_client
+
+    def test_colliding_tools_are_prefixed_and_routed(self):
+        sessions = {"alpha": FakeSession(["add", "sub"]), "beta": FakeSession(["add"])}
+        client = self.get_client(sessions)
+
+        async def run():
+            tools = await client.getTools()
+            await client.callTool("alpha__add", {"a": 1, "b": 2})
+            await client.callTool("beta__add", {"a": 3, "b": 4})
+            await client.callTool("sub", {"a": 5, "b": 6})
+            return tools
+
+        tools = asyncio.run(run())
+        self.assertEqual(sorted(tools), ["alpha__add", "beta__add", "sub"])
+        self.assertEqual(tools["beta__add"][0], "beta")
+        self.assertEqual(sessions["alpha"].calls, [("add", {"a": 1, "b": 2}), ("sub", {"a": 5, "b": 6})])
+        self.assertEqual(sessions["beta"].calls, [("add", {"a": 3, "b": 4})])
+
+    def test_unknown_tool_raises_key_error(self):
+        session = FakeSession(["add"])
+        client = self.get_client({"calculator": session})
+
+        with self.assertRaisesRegex(KeyError, "Unknown tool missing"):
+            asyncio.run(client.callTool("missing", {}))
+        self.assertEqual(session.calls, [])
+
+
+class TestConnectServers(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def in_tmp_path(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+    def test_failed_and_hanging_servers_do_not_block_others(self):
+        opened = []
+        closed = []
+
+        @contextlib.asynccontextmanager
+        async def transport(url, headers):
+            if url == "http://fail":
+                raise ConnectionError("connection refused")
+            if url == "http://hang":
+                await asyncio.sleep(3600)
+            opened.append(("transport", url))
+            try:
+                yield url, url, None
+            finally:
+                closed.append(("transport", url))
+
+        class ClientSession(FakeSession):
+            def __init__(self, readStream, writeStream, **kwargs):
+                super().__init__(["add_%s" % readStream[7:]])
+                self.url = readStream
+
+            async def __aenter__(self):
+                opened.append(("session", self.url))
+                return self
+
+            async def __aexit__(self, *exc):
+                closed.append(("session", self.url))
+
+            async def initialize(self):
+                pass
+
+        with mock.patch.object(mcp_client_lib.boto3, "Session"):
+            client = mcp_client_lib.MCPClient(verbose=False)
+
+        async def run():
+            connected = await client.connectServers([{"name": name, "url": "http://%s" % name}
+                                                     for name in ("one", "fail", "hang", "two")],
+                                                    timeout=0.2)
+            tools = await client.getTools()
+            result = await client.callTool("add_two", {"a": 1, "b": 2})
+            await client.cleanup()
+            return connected, tools, result
+
+        with mock.patch.object(mcp_client_lib, "streamablehttp_client", transport), \
+                mock.patch.object(mcp_client_lib, "ClientSession", ClientSession):
+            connected, tools, result = asyncio.run(run())
+
+        self.assertEqual(connected, ["one", "two"])
+        self.assertEqual(sorted(tools), ["add_one", "add_two"])
+        self.assertEqual(json.loads(result.content[0].text), {"result": 3})
+        self.assertEqual(len(opened), 4)
+        self.assertEqual(sorted(closed), sorted(opened))
+        self.assertEqual(client.servers, {})